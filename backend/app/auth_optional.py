@@ -1,12 +1,15 @@
 """
 Optional API key authentication. When API_KEY is set in env, requests must include
 X-API-Key or Authorization: Bearer <API_KEY>. When not set, no auth (app works as before).
+The same middleware answers 503 while the database schema is still being prepared.
 """
-from typing import Callable
+import hmac
+import json
+import re
 
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
 from app.config import config
+from app.database import schema_failed, schema_ready
 
 
 def get_optional_api_key() -> str | None:
@@ -16,41 +19,92 @@ def get_optional_api_key() -> str | None:
 
 
 # Paths that skip API key check when API_KEY is set
-PUBLIC_PATHS = {"/health", "/users/login", "/docs", "/openapi.json", "/redoc", "/redoc/static/redoc.standalone.js"}
+PUBLIC_PATHS = frozenset({"/health", "/users/login", "/docs", "/openapi.json", "/redoc", "/redoc/static/redoc.standalone.js"})
+
+
+_PUBLIC_PREFIXES = ("/docs", "/openapi", "/redoc")
+
+# One anchored pattern: exact public paths (optional trailing slash) or a public prefix.
+_PUBLIC_RE = re.compile(
+    "(?:" + "|".join(re.escape(p) for p in sorted(PUBLIC_PATHS, key=len, reverse=True)) + ")/?$"
+    + "|" + "|".join(re.escape(p) for p in _PUBLIC_PREFIXES)
+)
 
 
 def _path_is_public(path: str) -> bool:
-    if path in PUBLIC_PATHS:
-        return True
-    if path.startswith("/docs") or path.startswith("/openapi") or path.startswith("/redoc"):
-        return True
-    return False
+    return _PUBLIC_RE.match(path) is not None
+
+
+def _json_response(status: int, payload: dict, *extra_headers: tuple[bytes, bytes]):
+    """Pre-build the ASGI start/body messages for a constant JSON response."""
+    body = json.dumps(payload).encode("utf-8")
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode("latin-1")),
+        *extra_headers,
+    ]
+    return (
+        {"type": "http.response.start", "status": status, "headers": headers},
+        {"type": "http.response.body", "body": body},
+    )
+
 
+# Rejection responses are constant, so they are serialized once at import. The
+# messages are shared: this middleware is registered last (outermost), so they go
+# straight to the server, which only reads them.
+_UNAUTHORIZED = _json_response(
+    401, {"detail": "Missing or invalid API key. Set X-API-Key header or Authorization: Bearer <key>."}
+)
+_STARTING = _json_response(503, {"detail": "Server is starting up, retry shortly."}, (b"retry-after", b"1"))
+_FAILED = _json_response(500, {"detail": "Database initialisation failed; see the server log.", "status": "failed"})
 
-class OptionalAPIKeyMiddleware(BaseHTTPMiddleware):
-    """When API_KEY is set, require X-API-Key or Authorization: Bearer for non-public paths."""
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        api_key = get_optional_api_key()
-        if not api_key:
-            return await call_next(request)
+async def _send_prebuilt(send: Send, response) -> None:
+    start, body = response
+    await send(start)
+    await send(body)
 
-        path = request.url.path.rstrip("/") or "/"
-        if _path_is_public(path):
-            return await call_next(request)
 
-        provided = request.headers.get("X-API-Key") or request.headers.get("Authorization")
-        if provided and provided.startswith("Bearer "):
+class OptionalAPIKeyMiddleware:
+    """
+    When API_KEY is set, require X-API-Key or Authorization: Bearer for non-public paths.
+    Until the schema is ready, every HTTP path except /health gets a 503 (500 if
+    database initialisation failed).
+    Pure ASGI (no BaseHTTPMiddleware) so each request only costs a header scan.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        key = get_optional_api_key()
+        self._api_key = key.encode("utf-8") if key else None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and not schema_ready.is_set() and scope["path"] != "/health":
+            await _send_prebuilt(send, _FAILED if schema_failed.is_set() else _STARTING)
+            return
+        if scope["type"] != "http" or self._api_key is None:
+            await self.app(scope, receive, send)
+            return
+
+        if _path_is_public(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        x_api_key = None
+        authorization = None
+        for name, value in scope["headers"]:
+            if name == b"x-api-key" and x_api_key is None:
+                x_api_key = value
+            elif name == b"authorization" and authorization is None:
+                authorization = value
+
+        provided = x_api_key or authorization
+        if provided and provided.startswith(b"Bearer "):
             provided = provided[7:].strip()
         elif provided:
             provided = provided.strip()
-        else:
-            provided = None
-
-        if provided != api_key:
-            from fastapi.responses import JSONResponse
-            return JSONResponse(
-                status_code=401,
-                content={"detail": "Missing or invalid API key. Set X-API-Key header or Authorization: Bearer <key>."},
-            )
-        return await call_next(request)
+
+        if not provided or not hmac.compare_digest(provided, self._api_key):
+            await _send_prebuilt(send, _UNAUTHORIZED)
+            return
+        await self.app(scope, receive, send)
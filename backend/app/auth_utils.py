@@ -1,21 +1,42 @@
-"""Password and PIN hashing for DukaPOS users (bcrypt)."""
-import bcrypt
+"""
+Password and PIN hashing for DukaPOS users (passlib CryptContext: argon2id, legacy bcrypt).
 
-# Bcrypt limit; longer inputs are truncated before hashing.
-_BCRYPT_MAX_PASSWORD_BYTES = 72
+PINs are only 4-6 digits, so a slow KDF adds latency without real protection
+against offline brute force; they use a salted HMAC-SHA256 keyed with the
+PIN_PEPPER secret instead, stored as "<salt hex>:<digest hex>". The pepper lives
+in .env, outside the database; the launcher generates it there on first run
+(app.config.ensure_pin_pepper) and importing this module without one is an error.
 
+Password hashing is deliberately CPU-heavy. Sync route handlers already run in FastAPI's
+threadpool and can call the plain functions; async handlers must await the
+*_async variants so the event loop is not blocked.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+import secrets
 
-def _to_bytes(s: str) -> bytes:
-    """Encode string to bytes, truncate to bcrypt limit."""
-    b = s.encode("utf-8")
-    if len(b) > _BCRYPT_MAX_PASSWORD_BYTES:
-        return b[:_BCRYPT_MAX_PASSWORD_BYTES]
-    return b
+from passlib.context import CryptContext
+from app.config import ENV_FILE, config
+
+# passlib 1.7 probes bcrypt.__about__ (removed in bcrypt 4.1) and logs a traceback.
+logging.getLogger("passlib").setLevel(logging.ERROR)
+
+# New hashes use argon2id; bcrypt_sha256 and plain bcrypt remain verifiable so
+# rows hashed by earlier releases keep working and are flagged by needs_update().
+_pwd_ctx = CryptContext(
+    schemes=["argon2", "bcrypt_sha256", "bcrypt"],
+    deprecated="auto",
+    argon2__rounds=3,
+    argon2__memory_cost=65536,
+    argon2__parallelism=2,
+)
 
 
 def hash_password(plain: str) -> str:
     """Hash a plain password for storage."""
-    return bcrypt.hashpw(_to_bytes(plain), bcrypt.gensalt()).decode("utf-8")
+    return _pwd_ctx.hash(plain)
 
 
 def verify_password(plain: str, hashed: str) -> bool:
@@ -23,21 +44,100 @@ def verify_password(plain: str, hashed: str) -> bool:
     if not hashed:
         return False
     try:
-        return bcrypt.checkpw(_to_bytes(plain), hashed.encode("utf-8"))
+        return _pwd_ctx.verify(plain, hashed)
+    except Exception:
+        return False
+
+
+def _load_pin_pepper() -> bytes:
+    """PIN_PEPPER from the environment/.env.
+
+    The pepper is the only thing keeping a leaked database from giving up every PIN,
+    so a missing one is an error rather than a silent empty key.
+    """
+    pepper = config("PIN_PEPPER", default="")
+    if not pepper:
+        raise RuntimeError(
+            f"PIN_PEPPER is not set. Start the server once with `python main.py` to generate it "
+            f"into {ENV_FILE}, or set PIN_PEPPER to a long random secret."
+        )
+    return pepper.encode("utf-8")
+
+
+_PIN_PEPPER = _load_pin_pepper()
+_PIN_SALT_BYTES = 16
+
+
+def _pin_digest(pin: str, salt: bytes, pepper: bytes = _PIN_PEPPER) -> str:
+    return hmac.new(pepper + salt, pin.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def _matches_unpeppered(plain_pin: str, pin_hash: str) -> bool:
+    """True for an HMAC PIN hash written while PIN_PEPPER was still empty."""
+    if not _PIN_PEPPER or not pin_hash or pin_hash.startswith("$"):
+        return False
+    try:
+        salt_hex, digest = pin_hash.split(":", 1)
+        return hmac.compare_digest(_pin_digest(plain_pin, bytes.fromhex(salt_hex), b""), digest)
     except Exception:
         return False
 
 
-def hash_pin(pin: str) -> str:
+def hash_pin(pin: str, salt: bytes | None = None) -> str:
     """Hash a 4-6 digit PIN for storage."""
-    return bcrypt.hashpw(_to_bytes(pin), bcrypt.gensalt()).decode("utf-8")
+    salt = salt or secrets.token_bytes(_PIN_SALT_BYTES)
+    return f"{salt.hex()}:{_pin_digest(pin, salt)}"
 
 
 def verify_pin(plain_pin: str, pin_hash: str) -> bool:
-    """Verify a plain PIN against its hash."""
+    """Verify a plain PIN against its hash (HMAC, or a legacy passlib/bcrypt hash)."""
+    if not pin_hash:
+        return False
+    try:
+        if pin_hash.startswith("$"):
+            return _pwd_ctx.verify(plain_pin, pin_hash)
+        salt_hex, digest = pin_hash.split(":", 1)
+        if hmac.compare_digest(_pin_digest(plain_pin, bytes.fromhex(salt_hex)), digest):
+            return True
+    except Exception:
+        return False
+    return _matches_unpeppered(plain_pin, pin_hash)
+
+
+def pin_needs_rehash(pin_hash: str, plain_pin: str | None = None) -> bool:
+    """True for PIN hashes written by the old bcrypt/argon2 path, or (given the verified
+    plain PIN) by the HMAC path before a pepper was configured."""
     if not pin_hash:
         return False
+    if pin_hash.startswith("$"):
+        return True
+    return plain_pin is not None and _matches_unpeppered(plain_pin, pin_hash)
+
+
+def needs_rehash(hashed: str) -> bool:
+    """True when a stored hash uses a deprecated scheme or outdated parameters."""
     try:
-        return bcrypt.checkpw(_to_bytes(plain_pin), pin_hash.encode("utf-8"))
+        return _pwd_ctx.needs_update(hashed)
     except Exception:
         return False
+
+
+# argon2-cffi and bcrypt both release the GIL while hashing, so a thread is enough.
+async def hash_password_async(plain: str) -> str:
+    """hash_password() on a worker thread."""
+    return await asyncio.to_thread(hash_password, plain)
+
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    """verify_password() on a worker thread."""
+    return await asyncio.to_thread(verify_password, plain, hashed)
+
+
+async def hash_pin_async(pin: str) -> str:
+    """hash_pin() on a worker thread."""
+    return await asyncio.to_thread(hash_pin, pin)
+
+
+async def verify_pin_async(plain_pin: str, pin_hash: str) -> bool:
+    """verify_pin() on a worker thread."""
+    return await asyncio.to_thread(verify_pin, plain_pin, pin_hash)
@@ -4,9 +4,13 @@ All modules should import `config` from here instead of from decouple directly.
 When running as a PyInstaller frozen exe, looks for .env next to server.exe
 (i.e. $INSTDIR/resources/.env, which is what the NSIS installer writes).
 """
+import functools
+import logging
+import os
+import secrets
 import sys as _sys
 from pathlib import Path
-from decouple import Config, RepositoryEnv
+from decouple import Config, RepositoryEnv, undefined
 
 if getattr(_sys, "frozen", False):
     # PyInstaller frozen exe: sys.executable = $INSTDIR/resources/server.exe
@@ -20,7 +24,40 @@ PROJECT_ROOT = ENV_FILE.parent
 
 # If .env exists, use it; otherwise fall back to decouple's default (looks in cwd)
 if ENV_FILE.is_file():
-    config = Config(RepositoryEnv(str(ENV_FILE)))
+    _repository = RepositoryEnv(str(ENV_FILE))
+    _raw_config = Config(_repository)
+    # Parse .env once into os.environ; real environment variables still win.
+    for _key, _value in _repository.data.items():
+        os.environ.setdefault(_key, _value)
 else:
-    from decouple import config as _default_config
-    config = _default_config
+    from decouple import config as _raw_config
+
+
+@functools.cache
+def config(option: str, default=undefined, cast=undefined):
+    """Look up a setting (process env first, then decouple), cached per (option, default, cast)."""
+    value = os.environ.get(option)
+    if value is not None and cast is undefined:
+        return value
+    return _raw_config(option, default=default, cast=cast)
+
+
+def ensure_pin_pepper() -> None:
+    """Generate PIN_PEPPER into .env if it is unset.
+
+    Run once by the launcher (python main.py / server.exe) before the app is imported,
+    so auth_utils and any server workers only ever read the pepper. Raises OSError if
+    .env cannot be written; PINs are never hashed with an empty pepper.
+    """
+    if config("PIN_PEPPER", default=""):
+        return
+    pepper = secrets.token_hex(32)
+    ENV_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(ENV_FILE, "a", encoding="utf-8") as f:
+        f.write(f"\nPIN_PEPPER={pepper}\n")
+    os.environ["PIN_PEPPER"] = pepper
+    config.cache_clear()
+    logging.getLogger("dukapos.config").warning(
+        "PIN_PEPPER was not set; generated one and saved it to %s. Keep that file with your "
+        "backups: changing or losing the pepper invalidates stored PINs.", ENV_FILE,
+    )
@@ -2,14 +2,17 @@
 import logging
 import os
 import sys
-from typing import Optional
-from sqlmodel import Session, create_engine, SQLModel, select
-from sqlalchemy import event
+import threading
+from typing import Dict, Optional, Set
+from sqlmodel import Session, create_engine, SQLModel
+from sqlalchemy import event, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import sessionmaker
 from app.config import config
 
 logger = logging.getLogger("dukapos.database")
 
-from app.models import Staff, InvoiceSequence, StoreSettings  # noqa: E402
+from app.models import StoreSettings  # noqa: E402
 
 # When run as PyInstaller exe, Electron sets DATABASE_URL to userData/data/pos.db
 if getattr(sys, "frozen", False) and os.environ.get("DATABASE_URL"):
@@ -17,9 +20,27 @@ if getattr(sys, "frozen", False) and os.environ.get("DATABASE_URL"):
 else:
     DATABASE_URL = config("DATABASE_URL", default="sqlite:///./dukapos.db")
 connect_args = {} if not DATABASE_URL.startswith("sqlite") else {"check_same_thread": False, "timeout": 30}
-engine = create_engine(DATABASE_URL, connect_args=connect_args, echo=False)
+# Sync routes run on Starlette's 40-thread pool; the default QueuePool (5 + 10 overflow)
+# makes bursts wait on pool_timeout and reconnect (re-running the PRAGMAs below) once
+# overflow connections are discarded. Each uvicorn worker holds up to
+# DB_POOL_SIZE + DB_MAX_OVERFLOW connections.
+pool_args = {}
+if ":memory:" not in DATABASE_URL and DATABASE_URL not in ("sqlite://", "sqlite:///"):
+    pool_args = {
+        "pool_size": config("DB_POOL_SIZE", default=20, cast=int),
+        "max_overflow": config("DB_MAX_OVERFLOW", default=10, cast=int),
+    }
+    if not DATABASE_URL.startswith("sqlite"):
+        # Server databases drop idle connections; SQLite files never go stale.
+        pool_args.update(pool_pre_ping=True, pool_recycle=1800)
+engine = create_engine(DATABASE_URL, connect_args=connect_args, echo=False, **pool_args)
 logger.debug("Using database at %s", DATABASE_URL)
 
+# Set once create_db_and_tables() has finished; startup runs it off the event loop.
+schema_ready = threading.Event()
+# Set instead if that startup run raised: the server stays up but reports the failure.
+schema_failed = threading.Event()
+
 
 @event.listens_for(engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
@@ -27,6 +48,9 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
         cursor = dbapi_connection.cursor()
         cursor.execute("PRAGMA journal_mode=WAL")
         cursor.execute("PRAGMA synchronous=NORMAL")
+        # Busy waits are already bounded by connect_args["timeout"] (30 s).
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
         cursor.close()
 
 
@@ -36,319 +60,434 @@ def create_db_and_tables() -> None:
     logger.debug("SQLModel tables created.")
     run_migrations_if_needed()
     logger.debug("Migrations finished.")
-    _migrate_user_columns()
-    _migrate_store_settings_columns()
-    _migrate_customer_kra_pin()
-    _migrate_product_description()
-    _migrate_product_image_url()
-    _migrate_product_discounts()
-    _migrate_discount_dates()
-    _migrate_customer_email_address()
-    _migrate_heldorder_notes()
-    _migrate_receipt_bank_columns()
-    _migrate_transactionitem_cashier()
-    _seed_default_staff()
-    _seed_sample_staff()
-    _seed_invoice_sequence()
+    # One connection and one transaction for every column migration, so startup
+    # pays for a single commit instead of one fsync per helper.
+    with engine.begin() as conn:
+        _run_all_migrations(conn)
+        _seed_staff(conn)
+    _seed_receipt_sequence()
     _seed_store_settings()
     logger.debug("Seeding finished.")
+    schema_ready.set()
+
+
+# Rows per INSERT ... SELECT batch when copying legacy tables.
+_MIGRATION_BATCH_ROWS = 10_000
+
+
+def _copy_in_batches(conn, source: str, insert_select: str) -> None:
+    """Run `insert_select` (INSERT ... SELECT ... FROM source) in id-keyed batches."""
+    last_id = 0
+    while True:
+        upper = conn.execute(
+            text(f"SELECT max(id) FROM (SELECT id FROM {source} WHERE id > :last ORDER BY id LIMIT :n)"),
+            {"last": last_id, "n": _MIGRATION_BATCH_ROWS},
+        ).scalar()
+        if upper is None:
+            return
+        conn.execute(text(f"{insert_select} WHERE id > :last AND id <= :upper"), {"last": last_id, "upper": upper})
+        last_id = upper
+
+
+# NOT NULL receipt columns the legacy transaction table has no source for.
+_LEGACY_RECEIPT_FILL = (("business_name", "'DukaPOS'"), ("discount_amount", "0"), ("bank_confirmed", "0"))
 
 
 def run_migrations_if_needed() -> None:
     """Migrate data from old User/Transaction tables to Staff/Receipt if needed."""
-    from sqlalchemy import text, inspect
+    from sqlalchemy import inspect
     with engine.connect() as conn:
-        insp = inspect(engine)
-        tables = insp.get_table_names()
-
-        # 1. User -> Staff
-        if "user" in tables and "staff" in tables:
-            staff_count = conn.execute(text("SELECT count(*) FROM staff")).scalar()
-            if staff_count == 0:
-                conn.execute(text("""
-                    INSERT INTO staff (id, username, password_hash, pin_hash, role, is_active)
-                    SELECT id, username, password_hash, pin_hash, role, is_active FROM user
-                """))
-                conn.commit()
-
-        # Migration check: only run if needed
-        logger.debug("Checking if migration is needed...")
-
-        # 2. Transaction -> Receipt
-        if "transaction" in tables and "receipt" in tables:
-            logger.debug("Migrating transaction -> receipt...")
-            conn.execute(text("""
-                INSERT OR IGNORE INTO receipt (id, receipt_id, timestamp, shift_id, staff_id, customer_id,
-                                    total_amount, payment_type, is_return, origin_station, payment_status)
-                SELECT id, 'MIG-' || id, timestamp, shift_id, cashier_id, customer_id,
-                       total_amount, payment_method, is_return, 'POS-01', payment_status FROM "transaction"
-            """))
-            conn.commit()
+        tables = inspect(conn).get_table_names()
+        if not ({"user", "transaction", "transactionitem"} & set(tables)):
+            return
 
-        # 3. TransactionItem -> SaleItem
-        if "transactionitem" in tables and "saleitem" in tables:
-            logger.debug("Migrating transactionitem -> saleitem...")
-            conn.execute(text("""
-                INSERT OR IGNORE INTO saleitem (id, receipt_id, product_id, staff_id, quantity, price_at_moment, is_return, return_reason)
-                SELECT id, transaction_id, product_id, cashier_id, quantity, price_at_moment, is_return, return_reason FROM transactionitem
-            """))
+        logger.debug("Checking if migration is needed...")
+        # The copy is re-runnable (INSERT OR IGNORE), so skip the per-commit fsync while it runs.
+        conn.exec_driver_sql("PRAGMA synchronous=OFF")
+        conn.commit()  # end the autobegun transaction so the copy gets its own
+        try:
+            with conn.begin():
+                # 1. User -> Staff
+                if "user" in tables and "staff" in tables:
+                    staff_count = conn.execute(text("SELECT count(*) FROM staff")).scalar()
+                    if staff_count == 0:
+                        conn.execute(text("""
+                            INSERT INTO staff (id, username, password_hash, pin_hash, role, is_active)
+                            SELECT id, username, password_hash, pin_hash, role, is_active FROM user
+                        """))
+
+                # 2. Transaction -> Receipt
+                if "transaction" in tables and "receipt" in tables:
+                    logger.debug("Migrating transaction -> receipt...")
+                    # An old receipt table only gains these columns in _run_all_migrations (with defaults),
+                    # so fill just the ones it already has.
+                    receipt_cols = _schema_snapshot(conn)["receipt"]
+                    fill = [(col, val) for col, val in _LEGACY_RECEIPT_FILL if col in receipt_cols]
+                    fill_cols = "".join(f", {col}" for col, _ in fill)
+                    fill_vals = "".join(f", {val}" for _, val in fill)
+                    _copy_in_batches(conn, '"transaction"', f"""
+                        INSERT OR IGNORE INTO receipt (id, receipt_id, timestamp, shift_id, staff_id, customer_id,
+                                            total_amount, payment_type, is_return, origin_station,
+                                            payment_status{fill_cols})
+                        SELECT id, 'MIG-' || id, timestamp, shift_id, cashier_id, customer_id,
+                               total_amount, upper(payment_method), is_return, 'POS-01',
+                               payment_status{fill_vals} FROM "transaction"
+                    """)
+
+                # 3. TransactionItem -> SaleItem
+                if "transactionitem" in tables and "saleitem" in tables:
+                    logger.debug("Migrating transactionitem -> saleitem...")
+                    _copy_in_batches(conn, "transactionitem", """
+                        INSERT OR IGNORE INTO saleitem (id, receipt_id, product_id, staff_id, quantity, price_at_moment, is_return, return_reason)
+                        SELECT id, transaction_id, product_id, cashier_id, quantity, price_at_moment, is_return, return_reason FROM transactionitem
+                    """)
+        finally:
+            conn.exec_driver_sql("PRAGMA synchronous=NORMAL")
             conn.commit()
         logger.debug("Migration check complete.")
 
 
-def _migrate_user_columns() -> None:
-    """Add password_hash, is_active to staff table if missing."""
-    from sqlalchemy import text, inspect
-    with engine.connect() as conn:
-        insp = inspect(engine)
-        if "staff" not in insp.get_table_names():
+def _schema_snapshot(conn) -> Dict[str, Set[str]]:
+    """Map each table name to its lower-cased column names (one catalog pass)."""
+    from sqlalchemy import inspect
+    insp = inspect(conn)
+    return {t.lower(): {c["name"].lower() for c in insp.get_columns(t)} for t in insp.get_table_names()}
+
+
+def _add_missing_columns(conn, schema, table: str, columns) -> None:
+    """ALTER TABLE ADD COLUMN for each (name, ddl) the snapshot says is missing."""
+    cols = schema.get(table)
+    if cols is None:
+        return
+    for name, ddl in columns:
+        if name not in cols:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+            cols.add(name)
+
+
+def _run_all_migrations(conn) -> None:
+    """Apply every additive column migration against one schema snapshot."""
+    schema = _schema_snapshot(conn)
+    _migrate_user_columns(conn, schema)
+    _migrate_store_settings_columns(conn, schema)
+    _migrate_customer_kra_pin(conn, schema)
+    _migrate_product_description(conn, schema)
+    _migrate_product_image_url(conn, schema)
+    _migrate_product_discounts(conn, schema)
+    _migrate_discount_dates(conn, schema)
+    _migrate_customer_email_address(conn, schema)
+    _migrate_customer_version(conn, schema)
+    _migrate_heldorder_notes(conn, schema)
+    _migrate_receipt_bank_columns(conn, schema)
+    _migrate_receipt_discount(conn, schema)
+    _migrate_transactionitem_cashier(conn, schema)
+    _normalize_receipt_payment_types(conn, schema)
+    _backfill_daily_summary(conn, schema)
+    _drop_superseded_indexes(conn)
+    _create_missing_indexes(conn)
+    _create_customer_search_index(conn, schema)
+    _create_product_search_index(conn, schema)
+    _refresh_planner_stats(conn)
+
+
+# Indexes dropped from the models; replaced by the partial ix_receipt_completed_ts.
+_SUPERSEDED_INDEXES = ("ix_receipt_status_ts",)
+
+
+def _drop_superseded_indexes(conn) -> None:
+    for name in _SUPERSEDED_INDEXES:
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+
+def _refresh_planner_stats(conn) -> None:
+    """
+    Sampled ANALYZE so the planner knows payment_status has only a few values: without
+    sqlite_stat1 it treats "payment_status = 'COMPLETED'" as selective and scans every
+    completed receipt instead of range-seeking ix_receipt_completed_ts.
+    """
+    if not DATABASE_URL.startswith("sqlite"):
+        return
+    conn.exec_driver_sql("PRAGMA analysis_limit=1000")  # bounded rows per index, so startup stays quick
+    conn.exec_driver_sql("ANALYZE")
+
+
+def _create_missing_indexes(conn) -> None:
+    """create_all only indexes new tables; add model indexes missing from existing ones."""
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(conn, checkfirst=True)
+            except Exception as e:
+                # e.g. legacy rows violating a unique index; keep starting up
+                logger.warning("Could not create index %s: %s", index.name, e)
+
+
+# Set by _create_customer_search_index when the customer_fts table is usable.
+_customer_fts = False
+
+_CUSTOMER_FTS_DDL = (
+    # External-content trigram table: MATCH on any 3+ character substring of name/phone
+    # is an index lookup, with the same case-insensitive semantics as ILIKE '%q%'.
+    "CREATE VIRTUAL TABLE customer_fts USING fts5(name, phone, content='customer', content_rowid='id', tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS customer_fts_ai AFTER INSERT ON customer BEGIN
+        INSERT INTO customer_fts(rowid, name, phone) VALUES (new.id, new.name, new.phone);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS customer_fts_ad AFTER DELETE ON customer BEGIN
+        INSERT INTO customer_fts(customer_fts, rowid, name, phone) VALUES ('delete', old.id, old.name, old.phone);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS customer_fts_au AFTER UPDATE OF name, phone ON customer BEGIN
+        INSERT INTO customer_fts(customer_fts, rowid, name, phone) VALUES ('delete', old.id, old.name, old.phone);
+        INSERT INTO customer_fts(rowid, name, phone) VALUES (new.id, new.name, new.phone);
+    END""",
+    "INSERT INTO customer_fts(customer_fts) VALUES ('rebuild')",
+)
+
+
+def _create_customer_search_index(conn, schema) -> None:
+    """Create the customer_fts search table (SQLite with FTS5 trigram support only)."""
+    global _customer_fts
+    if not DATABASE_URL.startswith("sqlite") or "customer" not in schema:
+        return
+    if "customer_fts" not in schema:
+        if not _fts5_trigram_supported(conn):
+            logger.info("FTS5 trigram tokenizer unavailable; customer search will scan the table.")
             return
-        cols = [c["name"] for c in insp.get_columns("staff")]
-        if "password_hash" not in cols:
-            conn.execute(text("ALTER TABLE staff ADD COLUMN password_hash TEXT DEFAULT ''"))
-        if "is_active" not in cols:
-            conn.execute(text("ALTER TABLE staff ADD COLUMN is_active INTEGER DEFAULT 1"))
-        conn.commit()
+        for ddl in _CUSTOMER_FTS_DDL:
+            conn.exec_driver_sql(ddl)
+        schema["customer_fts"] = {"name", "phone"}
+    _customer_fts = True
+
+
+def customer_fts_available() -> bool:
+    """True once the customer_fts trigram index exists and is kept in sync by triggers."""
+    return _customer_fts
+
+
+def _fts5_trigram_supported(conn) -> bool:
+    import sqlite3
+    fts5 = conn.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar()
+    return bool(fts5) and sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+# Set by _create_product_search_index when the product_fts table is usable.
+_product_fts = False
+
+_PRODUCT_FTS_DDL = (
+    # Barcodes are matched exactly through their unique index; only names need substring search.
+    "CREATE VIRTUAL TABLE product_fts USING fts5(name, content='product', content_rowid='id', tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF name ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        INSERT INTO product_fts(rowid, name) VALUES (new.id, new.name);
+    END""",
+    "INSERT INTO product_fts(product_fts) VALUES ('rebuild')",
+)
+
+
+def _create_product_search_index(conn, schema) -> None:
+    """Create the product_fts name search table (SQLite with FTS5 trigram support only)."""
+    global _product_fts
+    if not DATABASE_URL.startswith("sqlite") or "product" not in schema:
+        return
+    if "product_fts" not in schema:
+        if not _fts5_trigram_supported(conn):
+            logger.info("FTS5 trigram tokenizer unavailable; product search will scan the table.")
+            return
+        for ddl in _PRODUCT_FTS_DDL:
+            conn.exec_driver_sql(ddl)
+        schema["product_fts"] = {"name"}
+    _product_fts = True
 
 
-def _seed_default_staff() -> None:
-    """Ensure at least one admin exists in Staff."""
-    from app.auth_utils import hash_password, hash_pin
-    logger.debug("Seeding default staff...")
-    with Session(engine) as session:
-        has_any = session.exec(select(Staff)).first() is not None
-        logger.debug("Staff check: has_any=%s", has_any)
-        has_admin = session.exec(select(Staff).where(Staff.role == "admin")).first() is not None
-        if not has_any:
-            session.add(Staff(
-                username="admin",
-                password_hash=hash_password("admin123"),
-                role="admin",
-                pin_hash=hash_pin("0000"),
-                is_active=True,
-            ))
-            session.commit()
-        elif not has_admin:
-            session.add(Staff(
-                username="admin",
-                password_hash=hash_password("admin123"),
-                role="admin",
-                pin_hash=hash_pin("0000"),
-                is_active=True,
-            ))
-            session.commit()
+def product_fts_available() -> bool:
+    """True once the product_fts trigram index exists and is kept in sync by triggers."""
+    return _product_fts
+
+
+def _migrate_user_columns(conn, schema) -> None:
+    """Add password_hash, is_active to staff table if missing."""
+    _add_missing_columns(conn, schema, "staff", [
+        ("password_hash", "TEXT DEFAULT ''"),
+        ("is_active", "INTEGER DEFAULT 1"),
+    ])
+
 
+# Default credentials (see CLAUDE.md) are stored pre-hashed so startup never runs the
+# password KDF. Regenerate with app.auth_utils.hash_password if the defaults change.
+_ADMIN_BOOTSTRAP_HASH = "$argon2id$v=19$m=65536,t=3,p=2$Zez937uXMmYMYSwFAIAwJg$KKE1kAFoJPyUhMeZfQRekPof5fn9/Se7J/in4ENPGBc"  # admin123
+_DEFAULT_ADMIN = {"username": "admin", "pin": "0000", "role": "admin", "password_hash": _ADMIN_BOOTSTRAP_HASH}
 
 # Sample users for testing login
 _SAMPLE_STAFF = [
-    {"username": "cashier", "password": "cashier123", "pin": "1234", "role": "cashier"},
-    {"username": "jane", "password": "jane123", "pin": "5678", "role": "cashier"},
+    {  # cashier123
+        "username": "cashier", "pin": "1234", "role": "cashier",
+        "password_hash": "$argon2id$v=19$m=65536,t=3,p=2$mlOK0fp/zxkjZGwt5bx37g$GKJiKkiAAC3ZmOgFQaKjZz4i+ZWYEGavzQPtYSDa9LE",
+    },
+    {  # jane123
+        "username": "jane", "pin": "5678", "role": "cashier",
+        "password_hash": "$argon2id$v=19$m=65536,t=3,p=2$3VtrjVEq5ZwzJkSIkdKaMw$fuXVy9kqR30zqwtyiydCyFBsYnnBDFFUKylkIpPi9Zo",
+    },
 ]
 
-
-def _seed_sample_staff() -> None:
-    """Add sample cashier staff if they do not exist."""
-    from app.auth_utils import hash_password, hash_pin
-    with Session(engine) as session:
-        for sample in _SAMPLE_STAFF:
-            existing = session.exec(select(Staff).where(Staff.username == sample["username"])).first()
-            if existing:
-                continue
-            session.add(Staff(
-                username=sample["username"],
-                password_hash=hash_password(sample["password"]),
-                role=sample["role"],
-                pin_hash=hash_pin(sample["pin"]),
-                is_active=True,
-            ))
-        session.commit()
+# Idempotent seed row: existing usernames are skipped by the unique index, and the
+# default admin is only added while no admin account exists at all.
+_SEED_STAFF_SQL = text("""
+    INSERT INTO staff (username, password_hash, role, pin_hash, is_active)
+    SELECT :username, :password_hash, :role, :pin_hash, :is_active
+    WHERE :role != 'admin' OR NOT EXISTS (SELECT 1 FROM staff WHERE role = 'admin')
+    ON CONFLICT(username) DO NOTHING
+""")
 
 
-def _seed_invoice_sequence() -> None:
-    """Ensure one row in InvoiceSequence."""
-    with Session(engine) as session:
-        if session.exec(select(InvoiceSequence)).first() is None:
-            session.add(InvoiceSequence(last_number=0))
-            session.commit()
+def _seed_staff(conn) -> None:
+    """Ensure at least one admin exists and add the sample cashiers (one executemany)."""
+    from app.auth_utils import hash_pin
+    logger.debug("Seeding default staff...")
+    conn.execute(_SEED_STAFF_SQL, [
+        {
+            "username": row["username"],
+            "password_hash": row["password_hash"],
+            "role": row["role"],
+            "pin_hash": hash_pin(row["pin"]),
+            "is_active": True,
+        }
+        for row in (_DEFAULT_ADMIN, *_SAMPLE_STAFF)
+    ])
+
+
+def _seed_receipt_sequence() -> None:
+    """Carry the legacy InvoiceSequence counter over to ReceiptSeq (once, while it is empty)."""
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM receiptseq LIMIT 1")).first() is not None:
+            return
+        last_number = conn.execute(text("SELECT last_number FROM invoicesequence ORDER BY id LIMIT 1")).scalar()
+        if last_number:
+            conn.execute(text("INSERT INTO receiptseq (id) VALUES (:n)"), {"n": last_number})
 
 
-def _migrate_store_settings_columns() -> None:
+def _migrate_store_settings_columns(conn, schema) -> None:
     """Add new columns like station_id to storesettings."""
-    from sqlalchemy import text, inspect
-    with engine.connect() as conn:
-        insp = inspect(engine)
-        tables = [t.lower() for t in insp.get_table_names()]
-        if "storesettings" not in tables:
-            return
-        table_name = "storesettings"
-        try:
-            cols = [c["name"].lower() for c in insp.get_columns(table_name)]
-        except Exception:
-            return
-
-        updates = [
-            ("auto_print_receipt", "1"),
-            ("low_stock_warning_enabled", "1"),
-            ("sound_enabled", "1"),
-            ("auto_backup_enabled", "1"),
-            ("station_id", "'POS-01'"),
-            ("staff_limit", "5"),
-            ("master_ip", "'127.0.0.1'"),
-        ]
-
-        for col, default in updates:
-            if col not in cols:
-                try:
-                    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {col} INTEGER DEFAULT {default}"))
-                except Exception:
-                    # might be TEXT for station_id or master_ip
-                    try:
-                        conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {col} TEXT DEFAULT {default}"))
-                    except Exception:
-                        pass
-        conn.commit()
-
-
-def _migrate_customer_kra_pin() -> None:
+    _add_missing_columns(conn, schema, "storesettings", [
+        ("auto_print_receipt", "INTEGER DEFAULT 1"),
+        ("low_stock_warning_enabled", "INTEGER DEFAULT 1"),
+        ("sound_enabled", "INTEGER DEFAULT 1"),
+        ("auto_backup_enabled", "INTEGER DEFAULT 1"),
+        ("station_id", "TEXT DEFAULT 'POS-01'"),
+        ("staff_limit", "INTEGER DEFAULT 5"),
+        ("master_ip", "TEXT DEFAULT '127.0.0.1'"),
+    ])
+
+
+def _migrate_customer_kra_pin(conn, schema) -> None:
     """Add kra_pin to customer table if missing."""
-    from sqlalchemy import text, inspect
-    with engine.connect() as conn:
-        insp = inspect(engine)
-        if "customer" not in insp.get_table_names():
-            return
-        cols = [c["name"].lower() for c in insp.get_columns("customer")]
-        if "kra_pin" not in cols:
-            conn.execute(text("ALTER TABLE customer ADD COLUMN kra_pin TEXT DEFAULT ''"))
-        conn.commit()
+    _add_missing_columns(conn, schema, "customer", [("kra_pin", "TEXT DEFAULT ''")])
 
 
-def _migrate_product_description() -> None:
+def _migrate_product_description(conn, schema) -> None:
     """Add description to product table if missing."""
-    from sqlalchemy import text, inspect
-    with engine.connect() as conn:
-        insp = inspect(engine)
-        if "product" not in insp.get_table_names():
-            return
-        cols = [c["name"].lower() for c in insp.get_columns("product")]
-        if "description" not in cols:
-            conn.execute(text("ALTER TABLE product ADD COLUMN description TEXT"))
-        conn.commit()
+    _add_missing_columns(conn, schema, "product", [("description", "TEXT")])
 
 
-def _migrate_product_image_url() -> None:
+def _migrate_product_image_url(conn, schema) -> None:
     """Add image_url to product table if missing."""
-    from sqlalchemy import text, inspect
-    with engine.connect() as conn:
-        insp = inspect(engine)
-        if "product" not in insp.get_table_names():
-            return
-        cols = [c["name"].lower() for c in insp.get_columns("product")]
-        if "image_url" not in cols:
-            conn.execute(text("ALTER TABLE product ADD COLUMN image_url TEXT"))
-        conn.commit()
+    _add_missing_columns(conn, schema, "product", [("image_url", "TEXT")])
 
 
-def _migrate_product_discounts() -> None:
+def _migrate_product_discounts(conn, schema) -> None:
     """Add item-level discount campaign fields to product table if missing."""
-    from sqlalchemy import text, inspect
-    with engine.connect() as conn:
-        insp = inspect(engine)
-        if "product" not in insp.get_table_names():
-            return
-        cols = [c["name"].lower() for c in insp.get_columns("product")]
-
-        updates = [
-            ("item_discount_type", "TEXT"),
-            ("item_discount_value", "REAL"),
-            ("item_discount_start", "DATETIME"),
-            ("item_discount_expiry", "DATETIME"),
-        ]
+    _add_missing_columns(conn, schema, "product", [
+        ("item_discount_type", "TEXT"),
+        ("item_discount_value", "REAL"),
+        ("item_discount_start", "DATETIME"),
+        ("item_discount_expiry", "DATETIME"),
+    ])
 
-        for col, col_type in updates:
-            if col not in cols:
-                conn.execute(text(f"ALTER TABLE product ADD COLUMN {col} {col_type}"))
-        conn.commit()
 
-
-def _migrate_discount_dates() -> None:
+def _migrate_discount_dates(conn, schema) -> None:
     """Add start_date / end_date to discount table if missing."""
-    from sqlalchemy import text, inspect
-    with engine.connect() as conn:
-        insp = inspect(engine)
-        if "discount" not in insp.get_table_names():
-            return
-        cols = [c["name"].lower() for c in insp.get_columns("discount")]
-        if "start_date" not in cols:
-            conn.execute(text("ALTER TABLE discount ADD COLUMN start_date DATETIME"))
-        if "end_date" not in cols:
-            conn.execute(text("ALTER TABLE discount ADD COLUMN end_date DATETIME"))
-        conn.commit()
+    _add_missing_columns(conn, schema, "discount", [
+        ("start_date", "DATETIME"),
+        ("end_date", "DATETIME"),
+    ])
 
 
-def _migrate_customer_email_address() -> None:
+def _migrate_customer_email_address(conn, schema) -> None:
     """Add email and address to customer table."""
-    from sqlalchemy import text, inspect
-    with engine.connect() as conn:
-        insp = inspect(engine)
-        if "customer" not in insp.get_table_names():
-            return
-        cols = [c["name"].lower() for c in insp.get_columns("customer")]
-        for col in ("email", "address"):
-            if col not in cols:
-                conn.execute(text(f"ALTER TABLE customer ADD COLUMN {col} TEXT"))
-        conn.commit()
+    _add_missing_columns(conn, schema, "customer", [("email", "TEXT"), ("address", "TEXT")])
+
 
+def _migrate_customer_version(conn, schema) -> None:
+    """Add the optimistic-lock version counter to customer."""
+    _add_missing_columns(conn, schema, "customer", [("version", "INTEGER DEFAULT 0")])
 
-def _migrate_heldorder_notes() -> None:
+
+def _migrate_heldorder_notes(conn, schema) -> None:
     """Add notes to heldorder table."""
-    from sqlalchemy import text, inspect
-    with engine.connect() as conn:
-        insp = inspect(engine)
-        if "heldorder" not in insp.get_table_names():
-            return
-        cols = [c["name"].lower() for c in insp.get_columns("heldorder")]
-        if "notes" not in cols:
-            conn.execute(text("ALTER TABLE heldorder ADD COLUMN notes TEXT DEFAULT ''"))
-        conn.commit()
+    _add_missing_columns(conn, schema, "heldorder", [("notes", "TEXT DEFAULT ''")])
 
 
-def _migrate_transactionitem_cashier() -> None:
+def _migrate_transactionitem_cashier(conn, schema) -> None:
     """Add cashier accountability columns."""
-    from sqlalchemy import text, inspect
-    with engine.connect() as conn:
-        insp = inspect(engine)
-        if "saleitem" in insp.get_table_names():
-            cols = [c["name"].lower() for c in insp.get_columns("saleitem")]
-            if "staff_id" not in cols:
-                conn.execute(text("ALTER TABLE saleitem ADD COLUMN staff_id INTEGER DEFAULT 1"))
-        conn.commit()
+    _add_missing_columns(conn, schema, "saleitem", [("staff_id", "INTEGER DEFAULT 1")])
+
+
+def _normalize_receipt_payment_types(conn, schema) -> None:
+    """Upper-case payment_type on receipts written before it was normalised at insert."""
+    if "receipt" in schema:
+        conn.execute(text(
+            "UPDATE receipt SET payment_type = upper(payment_type) WHERE payment_type <> upper(payment_type)"
+        ))
+
+
+def _backfill_daily_summary(conn, schema) -> None:
+    """Fill an empty dailysummary table from the receipts recorded before it existed."""
+    if not {"dailysummary", "receipt", "saleitem", "product"} <= schema.keys():
+        return
+    if conn.execute(text("SELECT 1 FROM dailysummary LIMIT 1")).first():
+        return
+    conn.execute(text("""
+        INSERT INTO dailysummary (day, total_revenue, total_cash, total_mobile, total_bank,
+                                  total_credit, net_profit, tx_count)
+        SELECT t.day, t.revenue, t.cash, t.mobile, t.bank, t.credit, coalesce(pr.profit, 0), t.n
+        FROM (
+            SELECT date(timestamp) AS day, sum(total_amount) AS revenue,
+                   sum(CASE WHEN payment_type = 'CASH' THEN total_amount ELSE 0 END) AS cash,
+                   sum(CASE WHEN payment_type IN ('MOBILE', 'MPESA') THEN total_amount ELSE 0 END) AS mobile,
+                   sum(CASE WHEN payment_type = 'BANK' THEN total_amount ELSE 0 END) AS bank,
+                   sum(CASE WHEN payment_type = 'CREDIT' THEN total_amount ELSE 0 END) AS credit,
+                   count(*) AS n
+            FROM receipt GROUP BY date(timestamp)
+        ) AS t
+        LEFT JOIN (
+            SELECT date(r.timestamp) AS day, sum((si.price_at_moment - p.price_buying) * si.quantity) AS profit
+            FROM saleitem si
+            JOIN receipt r ON r.id = si.receipt_id
+            JOIN product p ON p.id = si.product_id
+            GROUP BY date(r.timestamp)
+        ) AS pr ON pr.day = t.day
+    """))
+
+
+def _migrate_receipt_bank_columns(conn, schema) -> None:
+    """Add bank-specific columns to receipt table."""
+    # New bank fields
+    _add_missing_columns(conn, schema, "receipt", [
+        ("bank_name", "TEXT"),
+        ("bank_sender_name", "TEXT"),
+        ("bank_confirmed", "INTEGER DEFAULT 0"),
+        ("bank_confirmation_timestamp", "DATETIME"),
+        ("business_name", "TEXT DEFAULT 'DukaPOS'"),
+    ])
 
 
-def _migrate_receipt_bank_columns() -> None:
-    """Add bank-specific columns to receipt table."""
-    from sqlalchemy import text, inspect
-    with engine.connect() as conn:
-        insp = inspect(engine)
-        if "receipt" not in insp.get_table_names():
-            return
-        cols = [c["name"].lower() for c in insp.get_columns("receipt")]
-
-        # New bank fields
-        bank_updates = [
-            ("bank_name", "TEXT"),
-            ("bank_sender_name", "TEXT"),
-            ("bank_confirmed", "INTEGER DEFAULT 0"),
-            ("bank_confirmation_timestamp", "DATETIME"),
-            ("business_name", "TEXT DEFAULT 'DukaPOS'")
-        ]
-
-        for col, col_type in bank_updates:
-            if col not in cols:
-                try:
-                    conn.execute(text(f"ALTER TABLE receipt ADD COLUMN {col} {col_type}"))
-                except Exception:
-                    pass
-        conn.commit()
+def _migrate_receipt_discount(conn, schema) -> None:
+    """Add the whole-sale discount column to receipt table."""
+    _add_missing_columns(conn, schema, "receipt", [("discount_amount", "FLOAT DEFAULT 0")])
 
 
 def _seed_store_settings() -> None:
@@ -372,32 +511,47 @@ def _seed_store_settings() -> None:
             session.commit()
 
 
+# One insert allocates the number (no read-modify-write) and reads the station prefix.
+_NEXT_RECEIPT_SQL = text(
+    "INSERT INTO receiptseq DEFAULT VALUES "
+    "RETURNING id, (SELECT station_id FROM storesettings WHERE id = 1)"
+)
+# Only the newest ReceiptSeq row matters; older ones are pruned every N receipts.
+_RECEIPT_SEQ_PRUNE_EVERY = 500
+
+
+def _next_receipt_id(conn) -> str:
+    next_num, prefix = conn.execute(_NEXT_RECEIPT_SQL).one()
+    if next_num % _RECEIPT_SEQ_PRUNE_EVERY == 0:
+        conn.execute(text("DELETE FROM receiptseq WHERE id < :n"), {"n": next_num})
+    return f"{prefix or 'POS-01'}-{next_num:05d}"
+
+
 def get_next_receipt_id(session_param: Optional[Session] = None) -> str:
     """Generate next receipt ID with Station ID prefix (e.g. POS-01-00001)."""
-    def _logic(s: Session):
-        settings = s.get(StoreSettings, 1)
-        prefix = settings.station_id if settings else "POS-01"
+    if session_param:
+        return _next_receipt_id(session_param.connection())
+    with engine.begin() as conn:
+        return _next_receipt_id(conn)
 
-        row = s.exec(select(InvoiceSequence)).first()
-        if not row:
-            row = InvoiceSequence(last_number=1)
-            s.add(row)
-            return f"{prefix}-00001"
 
-        next_num = row.last_number + 1
-        row.last_number = next_num
-        s.add(row)
-        return f"{prefix}-{next_num:05d}"
+def upsert_insert(session: Session, table):
+    """INSERT for the session's backend that supports on_conflict_do_update().
+
+    PostgreSQL and SQLite share the index_elements=/set_=/excluded API but need
+    their own dialect's insert construct to compile.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
 
-    if session_param:
-        return _logic(session_param)
-    else:
-        with Session(engine) as session:
-            res = _logic(session)
-            session.commit()
-            return res
+
+# Request-scoped sessions for Depends(get_session). expire_on_commit=False keeps
+# committed objects loaded (ids come back from the INSERT and every default is
+# client-side), so handlers can return them without a refresh() SELECT.
+SessionLocal = sessionmaker(bind=engine, class_=Session, expire_on_commit=False)
 
 
 def get_session():
-    with Session(engine) as session:
+    with SessionLocal() as session:
         yield session
@@ -1,11 +1,17 @@
 """SQLModel schema for DukaPOS."""
 from __future__ import annotations
-from datetime import datetime
+from datetime import date, datetime, timezone
 from typing import List, Optional
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Index, text
 from sqlalchemy.orm import relationship as sa_rel
 
 
+def _utcnow() -> datetime:
+    """Naive UTC timestamp, the form every datetime column stores (datetime.utcnow is deprecated)."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class Staff(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     username: str = Field(index=True, unique=True)
@@ -37,7 +43,7 @@ class Product(SQLModel, table=True):
 
 class Shift(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    opened_at: datetime = Field(default_factory=datetime.utcnow)
+    opened_at: datetime = Field(default_factory=_utcnow, index=True)
     closed_at: Optional[datetime] = None
     cashier_id: int = Field(foreign_key="staff.id")
     opening_float: float = 0.0
@@ -48,7 +54,7 @@ class Shift(SQLModel, table=True):
 class Customer(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: Optional[str] = None
-    phone: Optional[str] = None
+    phone: Optional[str] = Field(default=None, index=True)
     email: Optional[str] = None
     address: Optional[str] = None
     kra_pin: str = ""
@@ -56,17 +62,25 @@ class Customer(SQLModel, table=True):
     debt_limit: float = 0.0
     points_balance: int = 0
     lifetime_points: int = 0
+    # Bumped on every balance change; balance writes are single UPDATE statements, so this is a change counter.
+    version: int = 0
 
 
 class InvoiceSequence(SQLModel, table=True):
-    """Single row: next receipt number sequence."""
+    """Legacy single-row counter, superseded by ReceiptSeq; only read to carry the count over."""
     id: Optional[int] = Field(default=None, primary_key=True)
     last_number: int = 0
 
 
+class ReceiptSeq(SQLModel, table=True):
+    """Receipt number allocator: each insert's AUTOINCREMENT id is the next receipt number."""
+    __table_args__ = {"sqlite_autoincrement": True}
+    id: Optional[int] = Field(default=None, primary_key=True)
+
+
 class SaleItem(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    receipt_id: int = Field(foreign_key="receipt.id")
+    receipt_id: int = Field(foreign_key="receipt.id", index=True)
     product_id: int = Field(foreign_key="product.id")
     staff_id: int = Field(default=1, foreign_key="staff.id")
     quantity: int
@@ -79,17 +93,29 @@ class SaleItem(SQLModel, table=True):
     receipt: Optional[Receipt] = Relationship(
         sa_relationship=sa_rel("Receipt", back_populates="items")
     )
+    # Lets item listings eager-load names with selectinload(SaleItem.product)
+    product: Optional[Product] = Relationship(sa_relationship=sa_rel("Product"))
 
 
 class Receipt(SQLModel, table=True):
+    # Date-range reports and shift Z-reports filter on these columns; C2B matching
+    # looks up recent PENDING receipts of a payment type (equality columns first).
+    # Detailed sales reads COMPLETED receipts in a date range: a partial index holds
+    # just those rows (queries must spell the status as a literal to use it).
+    __table_args__ = (
+        Index("ix_receipt_shift_ts", "shift_id", "timestamp"),
+        Index("ix_receipt_status_type_ts", "payment_status", "payment_type", "timestamp"),
+        Index("ix_receipt_completed_ts", "timestamp", sqlite_where=text("payment_status = 'COMPLETED'")),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     receipt_id: str = Field(index=True, unique=True)  # e.g. POS-01-0001
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    timestamp: datetime = Field(default_factory=_utcnow, index=True)
     shift_id: Optional[int] = Field(default=None, foreign_key="shift.id")
     staff_id: int = Field(foreign_key="staff.id")
     customer_id: Optional[int] = Field(default=None, foreign_key="customer.id")
     total_amount: float = 0.0
-    payment_type: str  # "CASH", "MOBILE", "BANK", "CREDIT", "SPLIT"
+    payment_type: str  # "CASH", "MOBILE", "BANK", "CREDIT", "SPLIT" (always stored upper-case)
     payment_subtype: Optional[str] = None  # "M-Pesa", "Bank Transfer", "Equity", "KCB", "Absa", "Visa/Card"
     reference_code: Optional[str] = None  # Transaction message code
     checkout_request_id: Optional[str] = Field(default=None, index=True)
@@ -115,13 +141,28 @@ class Receipt(SQLModel, table=True):
     )
 
 
+class DailySummary(SQLModel, table=True):
+    """Per-day sales totals, bumped in the same transaction as each receipt insert."""
+    day: date = Field(primary_key=True)  # UTC calendar day of Receipt.timestamp
+    total_revenue: float = 0.0
+    total_cash: float = 0.0
+    total_mobile: float = 0.0  # MOBILE and legacy MPESA
+    total_bank: float = 0.0
+    total_credit: float = 0.0
+    net_profit: float = 0.0  # (price_at_moment - price_buying at sale time) * qty
+    tx_count: int = 0
+
+
 class HeldOrder(SQLModel, table=True):
+    # Held orders are listed per cashier, newest first
+    __table_args__ = (Index("ix_heldorder_staff_created", "staff_id", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     staff_id: int = Field(foreign_key="staff.id")
     items_json: str = "[]"
     total_gross: float = 0.0
     notes: str = ""
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=_utcnow)
 
 
 class StoreSettings(SQLModel, table=True):
@@ -148,7 +189,7 @@ class PriceOverrideLog(SQLModel, table=True):
     cashier_id: Optional[int] = Field(default=None, foreign_key="staff.id")
     product_id: Optional[int] = Field(default=None, foreign_key="product.id")
     new_price: float
-    timestamp: datetime = Field(default_factory=lambda: datetime.utcnow())
+    timestamp: datetime = Field(default_factory=_utcnow)
 
 
 class StockAdjustment(SQLModel, table=True):
@@ -158,7 +199,7 @@ class StockAdjustment(SQLModel, table=True):
     staff_id: Optional[int] = Field(default=None, foreign_key="staff.id")
     quantity_change: int  # positive = add, negative = remove
     reason: str  # "Damage", "Expired", "Theft", "Received", "Correction"
-    timestamp: datetime = Field(default_factory=lambda: datetime.utcnow())
+    timestamp: datetime = Field(default_factory=_utcnow)
 
 
 class Discount(SQLModel, table=True):
@@ -189,7 +230,7 @@ class PurchaseOrder(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     supplier_id: int = Field(foreign_key="supplier.id")
     staff_id: Optional[int] = Field(default=None, foreign_key="staff.id")
-    created_at: datetime = Field(default_factory=lambda: datetime.utcnow())
+    created_at: datetime = Field(default_factory=_utcnow)
     status: str = "pending"  # "pending" or "received"
     total_cost: float = 0.0
     notes: str = ""
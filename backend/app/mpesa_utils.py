@@ -9,18 +9,23 @@ Env variables (MPESA_* preferred; DARAJA_* / bare names accepted as fallbacks):
   MPESA_CALLBACK_URL      (or DARAJA_CALLBACK_URL)
   MPESA_ENV               sandbox | production  (sets Daraja base URL)
   MPESA_TRANSACTION_TYPE  CustomerPayBillOnline | CustomerBuyGoodsOnline
+
+All Daraja calls are coroutines on one shared httpx.AsyncClient, so a pending STK
+Push never holds a worker thread.
 """
+import asyncio
 import base64
-import json
+import functools
 import re
 import time
 from datetime import datetime
 from typing import Optional
-from urllib.request import Request, urlopen
-from urllib.error import HTTPError, URLError
+
+import httpx
 
 # Kenyan M-Pesa numbers after normalisation: 2547XXXXXXXX or 2541XXXXXXXX
 _KENYA_PHONE_RE = re.compile(r"^254[17]\d{8}$")
+_NON_DIGITS_RE = re.compile(r"\D+")
 
 from app.config import config  # noqa: E402
 
@@ -40,6 +45,30 @@ def _get_daraja_base() -> str:
 
 DARAJA_BASE = _get_daraja_base()
 
+# One keep-alive client for every Daraja call, so OAuth, STK Push and STK Query reuse
+# the same TLS connection instead of handshaking per request. Created on first use
+# (inside the server's event loop) and closed from the app lifespan.
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=DARAJA_BASE,
+            timeout=httpx.Timeout(15.0, connect=5.0),
+            limits=httpx.Limits(max_keepalive_connections=10),
+        )
+    return _client
+
+
+async def aclose_client() -> None:
+    """Close the shared Daraja client (app shutdown)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
 
 # ---------------------------------------------------------------------------
 # Credentials — MPESA_* preferred, DARAJA_* / bare names as fallback
@@ -63,12 +92,38 @@ CONSUMER_SECRET = _cfg("MPESA_CONSUMER_SECRET", "CONSUMER_SECRET")
 # OAuth access token with in-memory cache (tokens valid ~3600 s)
 # ---------------------------------------------------------------------------
 _token_cache: dict = {"token": "", "expires_at": 0.0}
+_token_lock: Optional[asyncio.Lock] = None
+# Refresh this many seconds before Daraja's expires_in runs out.
+_TOKEN_REFRESH_MARGIN = 60
+
+
+@functools.lru_cache(maxsize=4)
+def _basic_auth(consumer_key: str, consumer_secret: str) -> str:
+    """OAuth Basic header; credentials only change on restart, so it is encoded once."""
+    return "Basic " + base64.b64encode(f"{consumer_key}:{consumer_secret}".encode()).decode()
+
 
+@functools.lru_cache(maxsize=4)
+def _password_prefix(shortcode: str, passkey: str) -> bytes:
+    return (shortcode + passkey).encode()
 
-def get_access_token() -> str:
+
+def _stk_password(shortcode: str, passkey: str, timestamp: str) -> str:
+    """Daraja STK password: base64(shortcode + passkey + timestamp)."""
+    return base64.b64encode(_password_prefix(shortcode, passkey) + timestamp.encode()).decode()
+
+
+def _cached_token() -> str:
+    if _token_cache["token"] and time.monotonic() < _token_cache["expires_at"]:
+        return _token_cache["token"]
+    return ""
+
+
+async def get_access_token() -> str:
     """
     Return a valid Daraja OAuth access token (client_credentials flow).
-    Caches the token for 3500 s to avoid redundant Daraja API calls.
+    The token is reused until shortly before its expires_in; concurrent callers await
+    one refresh instead of each fetching their own.
     Raises ValueError if credentials are missing or the request fails.
     """
     consumer_key = _cfg("MPESA_CONSUMER_KEY", "CONSUMER_KEY")
@@ -76,24 +131,33 @@ def get_access_token() -> str:
     if not consumer_key or not consumer_secret:
         raise ValueError("MPESA_CONSUMER_KEY and MPESA_CONSUMER_SECRET must be set")
 
-    now = time.time()
-    if _token_cache["token"] and now < _token_cache["expires_at"]:
-        return _token_cache["token"]
+    global _token_lock
+    token = _cached_token()
+    if token:
+        return token
+    if _token_lock is None:
+        _token_lock = asyncio.Lock()
+    async with _token_lock:
+        token = _cached_token()  # another caller may have refreshed while we waited
+        if token:
+            return token
 
-    url = f"{DARAJA_BASE}/oauth/v1/generate?grant_type=client_credentials"
-    credentials = base64.b64encode(
-        f"{consumer_key}:{consumer_secret}".encode()
-    ).decode()
-    req = Request(url, method="GET", headers={"Authorization": f"Basic {credentials}"})
-    try:
-        with urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode())
+        try:
+            resp = await _get_client().get(
+                "/oauth/v1/generate",
+                params={"grant_type": "client_credentials"},
+                headers={"Authorization": _basic_auth(consumer_key, consumer_secret)},
+                timeout=10,
+            )
+            resp.raise_for_status()
+            data = resp.json()
             token = data["access_token"]
-            _token_cache["token"] = token
-            _token_cache["expires_at"] = now + 3500  # 100 s safety buffer
-            return token
-    except (HTTPError, URLError, KeyError) as e:
-        raise ValueError(f"Daraja OAuth failed: {e}") from e
+            expires_in = int(data.get("expires_in") or 3599)
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            raise ValueError(f"Daraja OAuth failed: {e}") from e
+        _token_cache["token"] = token
+        _token_cache["expires_at"] = time.monotonic() + max(expires_in - _TOKEN_REFRESH_MARGIN, 0)
+        return token
 
 
 def invalidate_token_cache() -> None:
@@ -102,9 +166,42 @@ def invalidate_token_cache() -> None:
     _token_cache["expires_at"] = 0.0
 
 
+async def post_to_daraja(path: str, payload: dict, token: str, failure: str) -> dict:
+    """
+    POST a JSON payload to a Daraja endpoint with a Bearer token.
+    Daraja error responses come back as {"error": body, "status": code}; transport
+    failures and non-JSON replies raise ValueError prefixed with `failure`.
+    """
+    try:
+        resp = await _get_client().post(path, json=payload, headers={"Authorization": f"Bearer {token}"})
+    except httpx.HTTPError as e:
+        raise ValueError(f"{failure}: {e}") from e
+    if resp.is_error:
+        return {"error": resp.text, "status": resp.status_code}
+    try:
+        return resp.json()
+    except ValueError as e:
+        raise ValueError(f"{failure}: {e}") from e
+
+
 # ---------------------------------------------------------------------------
 # STK Push
 # ---------------------------------------------------------------------------
+@functools.lru_cache(maxsize=4096)
+def _normalize_msisdn(phone: str) -> str:
+    """
+    Normalise 07XXXXXXXX / 7XXXXXXXX / +254 7XX XXX XXX to 254XXXXXXXXX.
+    Returns "" when the result is not a Kenyan mobile number. Cached: retries and
+    repeat customers hit the same numbers.
+    """
+    digits = _NON_DIGITS_RE.sub("", phone)
+    if len(digits) == 10 and digits[0] == "0":
+        digits = "254" + digits[1:]
+    elif len(digits) == 9:
+        digits = "254" + digits
+    return digits if _KENYA_PHONE_RE.match(digits) else ""
+
+
 def build_stk_push_payload(
     phone: str,
     amount: float,
@@ -122,20 +219,14 @@ def build_stk_push_payload(
       - "CustomerBuyGoodsOnline" → Till / Buy Goods number
     Set MPESA_TRANSACTION_TYPE in .env to switch.
     """
-    # Normalize phone → 254XXXXXXXXX
-    p = phone.strip().replace(" ", "").replace("+", "")
-    if p.startswith("0"):
-        p = "254" + p[1:]
-    elif not p.startswith("254"):
-        p = "254" + p
-    if not _KENYA_PHONE_RE.match(p):
+    p = _normalize_msisdn(phone)
+    if not p:
         raise ValueError(f"Invalid Kenyan phone number: '{phone}'. Expected format: 07XXXXXXXX or 254XXXXXXXXX")
 
     timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
     passkey = passkey or _cfg("MPESA_PASSKEY", "DARAJA_PASSKEY")
     shortcode = shortcode or _cfg("MPESA_SHORTCODE", "DARAJA_SHORTCODE", default="174379")
-    password_str = shortcode + passkey + timestamp
-    password = base64.b64encode(password_str.encode()).decode()
+    password = _stk_password(shortcode, passkey, timestamp)
 
     transaction_type = _cfg(
         "MPESA_TRANSACTION_TYPE", "DARAJA_TRANSACTION_TYPE",
@@ -160,41 +251,20 @@ def build_stk_push_payload(
     }
 
 
-def send_stk_push(phone: str, amount: float) -> dict:
+async def send_stk_push(phone: str, amount: float) -> dict:
     """
     Obtain a Daraja access token and send an STK Push request.
     Returns the Daraja JSON response or raises ValueError.
     """
-    token = get_access_token()
+    token = await get_access_token()
     payload = build_stk_push_payload(phone, amount)
-    url = f"{DARAJA_BASE}/mpesa/stkpush/v1/processrequest"
-    body = json.dumps(payload).encode()
-    req = Request(
-        url,
-        data=body,
-        method="POST",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        },
-    )
-    try:
-        with urlopen(req, timeout=15) as resp:
-            return json.loads(resp.read().decode())
-    except HTTPError as e:
-        try:
-            err_body = e.read().decode()
-            return {"error": err_body, "status": e.code}
-        except Exception:
-            raise ValueError(f"STK Push failed: {e}") from e
-    except (URLError, json.JSONDecodeError) as e:
-        raise ValueError(f"STK Push failed: {e}") from e
+    return await post_to_daraja("/mpesa/stkpush/v1/processrequest", payload, token, "STK Push failed")
 
 
 # ---------------------------------------------------------------------------
 # STK Push Query (status check for lost callbacks)
 # ---------------------------------------------------------------------------
-def query_transaction_status(checkout_request_id: str) -> dict:
+async def query_transaction_status(checkout_request_id: str) -> dict:
     """
     Query M-Pesa STK Push transaction status by CheckoutRequestID.
 
@@ -204,36 +274,17 @@ def query_transaction_status(checkout_request_id: str) -> dict:
 
     Returns Daraja JSON (ResultCode, ResultDesc, CallbackMetadata…) or raises ValueError.
     """
-    token = get_access_token()
+    token = await get_access_token()
     shortcode = _cfg("MPESA_SHORTCODE", "DARAJA_SHORTCODE", default="174379")
     passkey = _cfg("MPESA_PASSKEY", "DARAJA_PASSKEY")
 
     timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-    password = base64.b64encode((shortcode + passkey + timestamp).encode()).decode()
+    password = _stk_password(shortcode, passkey, timestamp)
 
-    url = f"{DARAJA_BASE}/mpesa/stkpushquery/v1/query"
-    payload = json.dumps({
+    payload = {
         "BusinessShortCode": shortcode,
         "Password": password,
         "Timestamp": timestamp,
         "CheckoutRequestID": checkout_request_id,
-    }).encode()
-    req = Request(
-        url,
-        data=payload,
-        method="POST",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        },
-    )
-    try:
-        with urlopen(req, timeout=15) as resp:
-            return json.loads(resp.read().decode())
-    except HTTPError as e:
-        try:
-            return {"error": e.read().decode(), "status": e.code}
-        except Exception:
-            raise ValueError(f"Transaction status query failed: {e}") from e
-    except (URLError, json.JSONDecodeError) as e:
-        raise ValueError(f"Transaction status query failed: {e}") from e
+    }
+    return await post_to_daraja("/mpesa/stkpushquery/v1/query", payload, token, "Transaction status query failed")
@@ -4,22 +4,55 @@ Hardware-agnostic: Usb, Network, Serial via python-escpos.
 Standard kick sequence for RJ11-connected drawers.
 Lightweight plain-text receipt template (no PDFs/images).
 """
-from typing import Any, List, Optional
+from collections import OrderedDict
+from typing import Any, BinaryIO, List, Optional
+import atexit
 import threading
+import uuid
 
 # Standard ESC/POS cash drawer pulse (RJ11)
-CASH_DRAWER_KICK = bytes([0x1B, 0x70, 0x00, 0x19, 0xFA])
+CASH_DRAWER_KICK = b"\x1bp\x00\x19\xfa"
 
-# Thread pool for non-blocking print/kick so UI stays fluid
+# Pre-encoded receipt formatting (what escpos' set()/text() emit for these), written
+# with _raw() so constant parts skip the per-call encoder.
+_CENTER_BOLD = b"\x1bE\x01\x1ba\x01"  # ESC E 1, ESC a 1
+_BOLD_OFF = b"\x1bE\x00"
+_ALIGN_LEFT = b"\x1ba\x00"
+_ALIGN_RIGHT = b"\x1ba\x02"
+_ALIGN_CENTER = b"\x1ba\x01"
+_SEP_LINE = b"--------------------------------\n"
+
+# Virtual printer log, opened once on first use (file backend)
+_log_fp: Optional[BinaryIO] = None
+_log_lock = threading.Lock()
+
+# One printer worker thread: jobs reach the device strictly in submission order and
+# two jobs never interleave writes on the same connection.
 _executor: Optional[Any] = None
+# Jobs allowed to wait behind a stalled printer before new ones fail fast.
+_MAX_PENDING_JOBS = 32
+_pending_jobs = 0
+_pending_lock = threading.Lock()
+# Recent jobs by id, so a caller that stopped waiting can poll for the outcome.
+_JOB_HISTORY = 256
+_jobs: "OrderedDict[str, Any]" = OrderedDict()
 
 
 def _get_executor():
     global _executor
-    if _executor is None:
-        import concurrent.futures
-        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="pos_printer")
-    return _executor
+    # Under the lock: the async print endpoints and threadpool callers can race on the
+    # first job, and a second executor would break the one-worker FIFO guarantee.
+    with _pending_lock:
+        if _executor is None:
+            import concurrent.futures
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="pos_printer")
+        return _executor
+
+
+def _job_finished(_future: Any) -> None:
+    global _pending_jobs
+    with _pending_lock:
+        _pending_jobs -= 1
 
 
 class ESCPOSPrinter:
@@ -34,36 +67,31 @@ class ESCPOSPrinter:
         self._kwargs = kwargs
         self._printer: Any = None
         self._lock = threading.Lock()
+        # Resolve the escpos class up front so the (slow) escpos import never runs
+        # under the lock or on the first receipt.
+        self._printer_cls, self._ctor_args, self._ctor_kwargs = self._resolve_backend()
+
+    def _resolve_backend(self) -> tuple:
+        from escpos.printer import Dummy, Network, Serial, Usb
+        if self._backend in ("dummy", "file"):
+            # The file backend uses Dummy too; its buffer is flushed to receipts_log.txt
+            return Dummy, (), {}
+        if self._backend == "usb":
+            return Usb, (), self._kwargs
+        if self._backend == "network":
+            host = self._kwargs.get("host", "127.0.0.1")
+            port = int(self._kwargs.get("port", 9100))
+            timeout = int(self._kwargs.get("timeout", 5))
+            return Network, (host,), {"port": port, "timeout": timeout}
+        if self._backend == "serial":
+            return Serial, (), self._kwargs
+        raise ValueError(f"Unknown printer backend: {self._backend}")
 
     def _get_printer(self) -> Any:
         with self._lock:
-            if self._printer is not None:
-                return self._printer
-            if self._backend == "dummy":
-                from escpos.printer import Dummy
-                self._printer = Dummy()
-                return self._printer
-            if self._backend == "file":
-                from escpos.printer import Dummy
-                # We use Dummy but we'll flush it to a file
-                self._printer = Dummy()
-                return self._printer
-            if self._backend == "usb":
-                from escpos.printer import Usb
-                self._printer = Usb(**self._kwargs)
-                return self._printer
-            if self._backend == "network":
-                from escpos.printer import Network
-                host = self._kwargs.get("host", "127.0.0.1")
-                port = int(self._kwargs.get("port", 9100))
-                timeout = int(self._kwargs.get("timeout", 5))
-                self._printer = Network(host, port=port, timeout=timeout)
-                return self._printer
-            if self._backend == "serial":
-                from escpos.printer import Serial
-                self._printer = Serial(**self._kwargs)
-                return self._printer
-            raise ValueError(f"Unknown printer backend: {self._backend}")
+            if self._printer is None:
+                self._printer = self._printer_cls(*self._ctor_args, **self._ctor_kwargs)
+            return self._printer
 
     def kick_drawer(self) -> None:
         """Send standard cash drawer kick sequence (ESC p 0 0 25 250)."""
@@ -75,14 +103,21 @@ class ESCPOSPrinter:
 
         if self._backend == "file":
             self._save_to_log("--- CASH DRAWER KICKED ---")
+            p.clear()  # Clear dummy buffer
 
     def _save_to_log(self, content: str) -> None:
         """Helper to append text to a local log file for virtual printer mode."""
-        from app.config import PROJECT_ROOT
-        log_path = PROJECT_ROOT / "receipts_log.txt"
+        global _log_fp
         try:
-            with open(log_path, "a", encoding="utf-8") as f:
-                f.write(content + "\n")
+            with _log_lock:
+                if _log_fp is None:
+                    from app.config import PROJECT_ROOT
+                    # Append mode (O_APPEND): each write lands at the end even if
+                    # another process has the file open too.
+                    _log_fp = open(PROJECT_ROOT / "receipts_log.txt", "ab", buffering=65536)
+                    atexit.register(_log_fp.close)
+                _log_fp.write(content.encode("utf-8") + b"\n")
+                _log_fp.flush()  # one write() per entry; the file stays open
         except Exception:
             pass
 
@@ -106,11 +141,15 @@ class ESCPOSPrinter:
         receipt_header = kwargs.get("receipt_header", "")
         receipt_footer = kwargs.get("receipt_footer", "Thank you for shopping!")
 
-        p = self._get_printer()
+        printer = self._get_printer()
+        # Render into an in-memory Dummy and send the finished receipt as one write;
+        # printing line by line costs a device/TCP write per p.text() call.
+        from escpos.printer import Dummy
+        p = Dummy()
         # Center + bold for shop name (header)
-        p.set(align="center", bold=True)
+        p._raw(_CENTER_BOLD)
         p.text(f"\n{shop_name}\n")
-        p.set(bold=False)
+        p._raw(_BOLD_OFF)
         if kra_pin:
             p.text(f"KRA PIN: {kra_pin}\n")
         if contact_phone:
@@ -120,16 +159,16 @@ class ESCPOSPrinter:
         if receipt_header and receipt_header.strip():
             for line in receipt_header.strip().splitlines():
                 p.text(f"{line.strip()}\n")
-        p.text("--------------------------------\n")
-        p.set(align="left")
+        p._raw(_SEP_LINE + _ALIGN_LEFT)
+        lines: List[str] = []
         for it in items:
             name = (it.get("name") or "Item")[:24]
             qty = it.get("quantity", it.get("qty", 1))
             price = float(it.get("price", 0))
-            line_total = price * qty
-            p.text(f"  {name} x{qty}  KSh {line_total:.2f}\n")
-        p.text("--------------------------------\n")
-        p.set(align="right")
+            lines.append(f"  {name} x{qty}  KSh {format(price * qty, '.2f')}")
+        if lines:
+            p.text("\n".join(lines) + "\n")
+        p._raw(_SEP_LINE + _ALIGN_RIGHT)
         p.text(f"TOTAL: KSh {total_gross:.2f}\n")
 
         # Multi-tender breakdown
@@ -160,7 +199,7 @@ class ESCPOSPrinter:
                 label += f" ({payment_subtype})"
             p.text(f"Paid via: {label}\n")
 
-        p.set(align="center")
+        p._raw(_ALIGN_CENTER)
         footer_text = receipt_footer.strip() if receipt_footer and receipt_footer.strip() else "Thank you for shopping!"
         p.text(f"\n{footer_text}\n\n\n")
 
@@ -169,19 +208,23 @@ class ESCPOSPrinter:
             from datetime import datetime
             ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             self._save_to_log(f"=== RECEIPT {ts} ===\n" + p.output.decode('ascii', errors='ignore') + "\n====================\n")
-            p.clear()  # Clear dummy buffer
+            return
 
-        if self._backend not in ["dummy", "file"]:
+        if self._backend != "dummy":
             p.cut()
+        printer._raw(p.output)
 
 
 _printer_instance: Optional[ESCPOSPrinter] = None
+_instance_lock = threading.Lock()
 
 
 def get_printer() -> ESCPOSPrinter:
     global _printer_instance
     if _printer_instance is None:
-        _printer_instance = _create_printer_from_env()
+        with _instance_lock:
+            if _printer_instance is None:
+                _printer_instance = _create_printer_from_env()
     return _printer_instance
 
 
@@ -219,5 +262,40 @@ def _create_printer_from_env() -> ESCPOSPrinter:
 
 
 def run_in_printer_thread(fn: Any, *args: Any, **kwargs: Any) -> Any:
-    """Run print/kick in a worker thread. Returns a Future so caller can wait with timeout."""
-    return _get_executor().submit(fn, *args, **kwargs)
+    """
+    Queue print/kick on the printer thread. Returns a Future so caller can wait with timeout.
+    When the queue is full (printer stalled) the Future fails at once instead of piling up.
+    """
+    global _pending_jobs
+    import concurrent.futures
+    with _pending_lock:
+        if _pending_jobs >= _MAX_PENDING_JOBS:
+            full: concurrent.futures.Future = concurrent.futures.Future()
+            full.set_exception(RuntimeError("Printer queue is full"))
+            return full
+        _pending_jobs += 1
+    future = _get_executor().submit(fn, *args, **kwargs)
+    future.add_done_callback(_job_finished)
+    return future
+
+
+def submit_printer_job(fn: Any, *args: Any, **kwargs: Any) -> tuple:
+    """Queue fn like run_in_printer_thread and return (job_id, future); see printer_job_status."""
+    future = run_in_printer_thread(fn, *args, **kwargs)
+    job_id = uuid.uuid4().hex
+    with _pending_lock:
+        _jobs[job_id] = future
+        while len(_jobs) > _JOB_HISTORY:
+            _jobs.popitem(last=False)
+    return job_id, future
+
+
+def printer_job_status(job_id: str) -> Optional[str]:
+    """'queued', 'printing', 'done' or 'failed'; None for unknown or long-forgotten jobs."""
+    with _pending_lock:
+        future = _jobs.get(job_id)
+    if future is None:
+        return None
+    if not future.done():
+        return "printing" if future.running() else "queued"
+    return "failed" if future.cancelled() or future.exception() is not None else "done"
@@ -114,12 +114,12 @@ def update_api_keys(keys: ApiKeysUpdate):
 
 
 @router.post("/api-keys/test")
-def test_api_connection():
+async def test_api_connection():
     """Test M-Pesa API connection by attempting to get an access token."""
     try:
         from app.mpesa_utils import get_access_token
 
-        token = get_access_token()
+        token = await get_access_token()
 
         if token:
             return {
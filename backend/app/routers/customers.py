@@ -2,13 +2,21 @@
 from typing import List, Optional
 from fastapi import APIRouter, Body, HTTPException, Query
 from pydantic import BaseModel
+from sqlalchemy import delete, func, text, update
 from sqlmodel import Session, select
 
-from app.database import engine
+from app.database import customer_fts_available, engine
 from app.models import Customer
 
 router = APIRouter(prefix="/customers", tags=["customers"])
 
+# Write endpoints open their sessions with expire_on_commit=False and skip refresh():
+# Customer has no server-side defaults, so after commit the ORM object already holds
+# exactly what is in the row (the id is filled in by the INSERT).
+
+# Trigram index lookup; only matches queries of 3+ characters.
+_FTS_MATCH = text("customer.id IN (SELECT rowid FROM customer_fts WHERE customer_fts MATCH :q)")
+
 
 class CustomerCreate(BaseModel):
     name: Optional[str] = None
@@ -34,6 +42,24 @@ class CustomerRead(BaseModel):
     model_config = {"from_attributes": True}
 
 
+class CustomerSummary(BaseModel):
+    """List/search row: the fields the customer table and credit picker show."""
+    id: int
+    name: Optional[str] = None
+    phone: Optional[str] = None
+    kra_pin: str = ""
+    current_balance: float
+    debt_limit: float
+    points_balance: int = 0
+    lifetime_points: int = 0
+
+    model_config = {"from_attributes": True}
+
+
+# Columns selected for list rows, so email/address are never read or hydrated.
+_SUMMARY_COLUMNS = tuple(getattr(Customer, f) for f in CustomerSummary.model_fields)
+
+
 class CustomerUpdate(BaseModel):
     name: Optional[str] = None
     phone: Optional[str] = None
@@ -51,18 +77,36 @@ class PaymentRecordRequest(BaseModel):
     notes: Optional[str] = None
 
 
-@router.get("", response_model=List[CustomerRead])
-def list_customers(q: Optional[str] = Query(None)):
-    """List customers, optionally search by name or phone."""
+_DEFAULT_PAGE_SIZE = 50
+
+
+@router.get("", response_model=List[CustomerSummary])
+def list_customers(
+    q: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    after_id: Optional[int] = Query(None, description="Keyset cursor: last id of the previous page"),
+):
+    """
+    List customers in id order, optionally search by name or phone. Pages are keyset-based:
+    pass limit, then the last id you received as after_id (pages default to 50 rows).
+    Without either, every match is returned. Use GET /customers/{id} for the full record.
+    """
     with Session(engine) as session:
-        stmt = select(Customer)
+        stmt = select(*_SUMMARY_COLUMNS).order_by(Customer.id)
+        if limit is not None or after_id is not None:
+            stmt = stmt.limit(limit or _DEFAULT_PAGE_SIZE)
+        if after_id is not None:
+            stmt = stmt.where(Customer.id > after_id)
         if q and q.strip():
             qq = q.strip().lower()
-            stmt = stmt.where(
-                (Customer.name.ilike(f"%{qq}%")) | (Customer.phone.ilike(f"%{qq}%"))
-            )
-        customers = session.exec(stmt).all()
-        return list(customers)
+            if len(qq) >= 3 and customer_fts_available():
+                # Quoted as one FTS phrase so user input is never parsed as query syntax
+                stmt = stmt.where(_FTS_MATCH.bindparams(q='"' + qq.replace('"', '""') + '"'))
+            else:
+                stmt = stmt.where(
+                    (Customer.name.ilike(f"%{qq}%")) | (Customer.phone.ilike(f"%{qq}%"))
+                )
+        return session.exec(stmt).all()
 
 
 @router.get("/{customer_id}", response_model=CustomerRead)
@@ -78,7 +122,7 @@ def get_customer(customer_id: int):
 def create_customer(data: CustomerCreate):
     if data.debt_limit < 0:
         raise HTTPException(status_code=400, detail="debt_limit cannot be negative")
-    with Session(engine) as session:
+    with Session(engine, expire_on_commit=False) as session:
         customer = Customer(
             name=data.name,
             phone=data.phone,
@@ -90,29 +134,32 @@ def create_customer(data: CustomerCreate):
         )
         session.add(customer)
         session.commit()
-        session.refresh(customer)
         return customer
 
 
 @router.patch("/{customer_id}", response_model=CustomerRead)
 def update_customer(customer_id: int, data: CustomerUpdate):
-    updates = data.model_dump(exclude_unset=True)
+    # Only the fields the client sent; read straight off the model instead of model_dump()
+    updates = {k: getattr(data, k) for k in data.model_fields_set}
     if "debt_limit" in updates and updates["debt_limit"] is not None and updates["debt_limit"] < 0:
         raise HTTPException(status_code=400, detail="debt_limit cannot be negative")
-    with Session(engine) as session:
-        customer = session.get(Customer, customer_id)
+    if "kra_pin" in updates:
+        updates["kra_pin"] = (updates["kra_pin"] or "").strip()
+    if updates.get("current_balance") is not None and updates["current_balance"] < 0:
+        updates["current_balance"] = 0.0
+    if "current_balance" in updates:
+        updates["version"] = Customer.version + 1
+    with Session(engine, expire_on_commit=False) as session:
+        if not updates:
+            customer = session.get(Customer, customer_id)
+        else:
+            # UPDATE ... RETURNING: the 404 check and the write are one statement
+            customer = session.execute(
+                update(Customer).where(Customer.id == customer_id).values(**updates).returning(Customer)
+            ).scalars().first()
+            session.commit()
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
-        for k, v in updates.items():
-            if k == "kra_pin":
-                setattr(customer, k, (v or "").strip())
-            elif k == "current_balance" and v is not None and v < 0:
-                setattr(customer, k, 0.0)
-            else:
-                setattr(customer, k, v)
-        session.add(customer)
-        session.commit()
-        session.refresh(customer)
         return customer
 
 
@@ -129,19 +176,26 @@ def record_payment(
     if amt <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
     with Session(engine) as session:
-        customer = session.get(Customer, customer_id)
-        if not customer:
+        # One atomic statement: the subtraction happens in SQLite, so concurrent payments
+        # cannot lose each other and no read round-trip is needed.
+        row = session.execute(
+            update(Customer)
+            .where(Customer.id == customer_id)
+            .values(
+                current_balance=func.max(0.0, Customer.current_balance - amt),
+                version=Customer.version + 1,
+            )
+            .returning(Customer.current_balance)
+        ).first()
+        if row is None:
             raise HTTPException(status_code=404, detail="Customer not found")
-        customer.current_balance = max(0.0, customer.current_balance - amt)
-        session.add(customer)
         session.commit()
-        session.refresh(customer)
         return {
             "customer_id": customer_id,
             "id": customer_id,
             "payment_id": customer_id,
             "amount": amt,
-            "new_balance": customer.current_balance,
+            "new_balance": float(row[0]),
         }
 
 
@@ -152,7 +206,7 @@ class PointsRequest(BaseModel):
 @router.post("/{customer_id}/add-points")
 def adjust_points(customer_id: int, data: PointsRequest):
     """Add or redeem loyalty points for a customer."""
-    with Session(engine) as session:
+    with Session(engine, expire_on_commit=False) as session:
         customer = session.get(Customer, customer_id)
         if not customer:
             raise HTTPException(status_code=404, detail="Customer not found")
@@ -161,7 +215,6 @@ def adjust_points(customer_id: int, data: PointsRequest):
             customer.lifetime_points += data.points
         session.add(customer)
         session.commit()
-        session.refresh(customer)
         return {"customer_id": customer_id, "points_balance": customer.points_balance, "lifetime_points": customer.lifetime_points}
 
 
@@ -169,9 +222,10 @@ def adjust_points(customer_id: int, data: PointsRequest):
 def delete_customer(customer_id: int):
     """Delete a customer (API/test compatibility)."""
     with Session(engine) as session:
-        customer = session.get(Customer, customer_id)
-        if not customer:
+        deleted = session.execute(
+            delete(Customer).where(Customer.id == customer_id).returning(Customer.id)
+        ).first()
+        if deleted is None:
             raise HTTPException(status_code=404, detail="Customer not found")
-        session.delete(customer)
         session.commit()
         return None
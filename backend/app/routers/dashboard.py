@@ -1,11 +1,14 @@
 """Dashboard summary API: today's revenue, M-Pesa vs Cash, net profit."""
-from datetime import datetime, timezone
+import threading
+import time
+from datetime import date, datetime, timezone
 from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from sqlmodel import Session, select
+from sqlmodel import Session
 
-from app.database import engine
-from app.models import Receipt, SaleItem, Product
+from app.database import engine, upsert_insert
+from app.models import DailySummary, Receipt
 
 router = APIRouter(prefix="/dashboard", tags=["dashboard"])
 
@@ -21,49 +24,85 @@ class DashboardSummary(BaseModel):
     transaction_count: int
 
 
+_VAT_FRACTION = 0.16 / 1.16  # VAT share of a 16%-inclusive amount
+
+# Receipt.payment_type is stored upper-case; each type feeds at most one bucket.
+_BUCKET_BY_TYPE = {
+    "CASH": "total_cash",
+    "MOBILE": "total_mobile",
+    "MPESA": "total_mobile",  # legacy receipts migrated from transaction
+    "BANK": "total_bank",
+    "CREDIT": "total_credit",
+}
+_SUMMARY_SUMS = ("total_revenue", "total_cash", "total_mobile", "total_bank", "total_credit", "net_profit", "tx_count")
+
+# The POS polls /dashboard/summary every few seconds; serve repeats from memory for a
+# few seconds and drop the entry whenever a sale is committed.
+_SUMMARY_TTL = 5.0
+_summary_cache: dict[str, tuple[float, "DashboardSummary"]] = {}
+_summary_lock = threading.Lock()
+_summary_generation = 0  # bumped by invalidation so in-flight computations don't store stale data
+
+
+def invalidate_summary_cache() -> None:
+    """Forget the cached summary (call after committing a receipt)."""
+    global _summary_generation
+    with _summary_lock:
+        _summary_cache.clear()
+        _summary_generation += 1
+
+
+def bump_daily_summary(session: Session, receipt: Receipt, profit: float) -> None:
+    """Add a new receipt to its day's DailySummary row (caller commits).
+
+    One INSERT ... ON CONFLICT(day) DO UPDATE adding to the running totals, so
+    concurrent sales never overwrite each other's increments.
+    """
+    values = dict.fromkeys(_SUMMARY_SUMS, 0.0)
+    values["total_revenue"] = receipt.total_amount
+    bucket = _BUCKET_BY_TYPE.get(receipt.payment_type)
+    if bucket:
+        values[bucket] = receipt.total_amount
+    values["net_profit"] = profit
+    values["tx_count"] = 1
+    table = DailySummary.__table__
+    stmt = upsert_insert(session, table).values(day=receipt.timestamp.date(), **values)
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=["day"],
+        set_={col: table.c[col] + stmt.excluded[col] for col in _SUMMARY_SUMS},
+    ))
+
+
 @router.get("/summary", response_model=DashboardSummary)
-def get_dashboard_summary():
+async def get_dashboard_summary():
     """Today's revenue, Mobile vs Cash breakdown, net profit from (selling - buying) * qty."""
-    today_start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    # Async so cache hits (most polls) are served on the event loop; only a miss
+    # takes a worker thread for the DailySummary read.
+    today = datetime.now(timezone.utc).date()
+    key = today.isoformat()
+    with _summary_lock:
+        hit = _summary_cache.get(key)
+        generation = _summary_generation
+    if hit and time.monotonic() - hit[0] < _SUMMARY_TTL:
+        return hit[1]
+    summary = await run_in_threadpool(_load_summary, today)
+    with _summary_lock:
+        if generation == _summary_generation:
+            _summary_cache.clear()  # only today's entry is ever useful
+            _summary_cache[key] = (time.monotonic(), summary)
+    return summary
+
+
+def _load_summary(day: date) -> DashboardSummary:
     with Session(engine) as session:
-        receipts = session.exec(
-            select(Receipt).where(Receipt.timestamp >= today_start)
-        ).all()
-        total_revenue = 0.0
-        total_cash = 0.0
-        total_mobile = 0.0
-        total_bank = 0.0
-        total_credit = 0.0
-        for r in receipts:
-            total_revenue += r.total_amount
-            ptype = r.payment_type.upper()
-            if ptype == "CASH":
-                total_cash += r.total_amount
-            elif ptype == "MOBILE":
-                total_mobile += r.total_amount
-            elif ptype == "BANK":
-                total_bank += r.total_amount
-            elif ptype == "CREDIT":
-                total_credit += r.total_amount
-
-        vat_collected = total_revenue / 1.16 * 0.16
-        net_profit = 0.0
-        for r in receipts:
-            items = session.exec(
-                select(SaleItem).where(SaleItem.receipt_id == r.id)
-            ).all()
-            for it in items:
-                prod = session.get(Product, it.product_id)
-                if prod:
-                    net_profit += (it.price_at_moment - prod.price_buying) * it.quantity
-
-        return DashboardSummary(
-            total_revenue=total_revenue,
-            total_cash=total_cash,
-            total_mobile=total_mobile,
-            total_bank=total_bank,
-            total_credit=total_credit,
-            net_profit=round(net_profit, 2),
-            vat_collected=round(vat_collected, 2),
-            transaction_count=len(receipts),
-        )
+        row = session.get(DailySummary, day) or DailySummary(day=day)
+    return DashboardSummary(
+        total_revenue=row.total_revenue,
+        total_cash=row.total_cash,
+        total_mobile=row.total_mobile,
+        total_bank=row.total_bank,
+        total_credit=row.total_credit,
+        net_profit=round(row.net_profit, 2),
+        vat_collected=round(row.total_revenue * _VAT_FRACTION, 2),
+        transaction_count=row.tx_count,
+    )
@@ -5,17 +5,12 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from sqlmodel import Session, select
 
-from app.database import engine
+from app.database import get_session
 from app.models import Discount
 
 router = APIRouter(prefix="/discounts", tags=["discounts"])
 
 
-def get_db():
-    with Session(engine) as session:
-        yield session
-
-
 class DiscountCreate(BaseModel):
     name: str
     discount_type: str  # "percent" or "fixed"
@@ -81,7 +76,7 @@ def _discount_to_read(d: Discount) -> DiscountRead:
 @router.get("", response_model=List[DiscountRead])
 def list_discounts(
     active_only: bool = True,
-    session: Session = Depends(get_db),
+    session: Session = Depends(get_session),
 ):
     """List discounts. By default returns only active ones (respecting validity window)."""
     stmt = select(Discount)
@@ -99,7 +94,7 @@ def list_discounts(
 
 
 @router.post("", response_model=DiscountRead, status_code=201)
-def create_discount(data: DiscountCreate, session: Session = Depends(get_db)):
+def create_discount(data: DiscountCreate, session: Session = Depends(get_session)):
     """Create a new discount."""
     if data.discount_type not in ("percent", "fixed"):
         raise HTTPException(status_code=400, detail="discount_type must be 'percent' or 'fixed'")
@@ -115,7 +110,6 @@ def create_discount(data: DiscountCreate, session: Session = Depends(get_db)):
     discount = Discount(**raw)
     session.add(discount)
     session.commit()
-    session.refresh(discount)
     return _discount_to_read(discount)
 
 
@@ -123,7 +117,7 @@ def create_discount(data: DiscountCreate, session: Session = Depends(get_db)):
 def update_discount(
     discount_id: int,
     data: DiscountUpdate,
-    session: Session = Depends(get_db),
+    session: Session = Depends(get_session),
 ):
     """Update a discount (including deactivating it)."""
     discount = session.get(Discount, discount_id)
@@ -144,12 +138,11 @@ def update_discount(
         setattr(discount, k, v)
     session.add(discount)
     session.commit()
-    session.refresh(discount)
     return _discount_to_read(discount)
 
 
 @router.post("/validate-code", response_model=DiscountRead)
-def validate_promo_code(body: dict, session: Session = Depends(get_db)):
+def validate_promo_code(body: dict, session: Session = Depends(get_session)):
     """Validate a promo code and return the active discount, or 404 if invalid."""
     code = (body.get("code") or "").strip()
     if not code:
@@ -169,7 +162,7 @@ def validate_promo_code(body: dict, session: Session = Depends(get_db)):
 
 
 @router.delete("/{discount_id}", status_code=204)
-def delete_discount(discount_id: int, session: Session = Depends(get_db)):
+def delete_discount(discount_id: int, session: Session = Depends(get_session)):
     """Permanently delete a discount."""
     discount = session.get(Discount, discount_id)
     if not discount:
@@ -1,10 +1,11 @@
 """Hardware-agnostic POS peripherals: cash drawer kick. Uses standard ESC/POS sequence (RJ11)."""
-import concurrent.futures
+import asyncio
+from concurrent.futures import Future
 from fastapi import APIRouter
 from pydantic import BaseModel
 from typing import Optional
 
-from app.printer_service import get_printer, run_in_printer_thread
+from app.printer_service import get_printer, submit_printer_job
 
 PRINTER_OFFLINE = "PRINTER_OFFLINE"
 TIMEOUT_SEC = 8
@@ -15,6 +16,19 @@ router = APIRouter(prefix="/hardware", tags=["hardware"])
 class KickDrawerResponse(BaseModel):
     ok: bool
     warning: Optional[str] = None
+    job_id: Optional[str] = None
+
+
+async def wait_for_printer(future: Future) -> bool:
+    """
+    Wait up to TIMEOUT_SEC for a printer job without holding a worker thread.
+    On timeout the job stays queued (shielded from cancellation) and can be polled by id.
+    """
+    try:
+        await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), TIMEOUT_SEC)
+        return True
+    except Exception:
+        return False
 
 
 def _do_kick_drawer() -> None:
@@ -23,11 +37,9 @@ def _do_kick_drawer() -> None:
 
 
 @router.post("/kick-drawer", response_model=KickDrawerResponse)
-def kick_drawer():
+async def kick_drawer():
     """Trigger cash drawer pulse via printer. Returns 200 with warning PRINTER_OFFLINE if printer unavailable."""
-    future = run_in_printer_thread(_do_kick_drawer)
-    try:
-        future.result(timeout=TIMEOUT_SEC)
-        return KickDrawerResponse(ok=True)
-    except (Exception, concurrent.futures.TimeoutError):
-        return KickDrawerResponse(ok=False, warning=PRINTER_OFFLINE)
+    job_id, future = submit_printer_job(_do_kick_drawer)
+    if await wait_for_printer(future):
+        return KickDrawerResponse(ok=True, job_id=job_id)
+    return KickDrawerResponse(ok=False, warning=PRINTER_OFFLINE, job_id=job_id)
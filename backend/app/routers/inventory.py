@@ -6,12 +6,13 @@ from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlmodel import Session, select
+import numpy as np
 import pandas as pd
 import openpyxl
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
 
-from app.database import engine
+from app.database import engine, get_session, upsert_insert
 from app.models import Product, StockAdjustment
 from app.websocket_manager import broadcast_sync, create_event, EventType
 
@@ -122,11 +123,6 @@ def download_template():
     )
 
 
-def get_db():
-    with Session(engine) as session:
-        yield session
-
-
 # ── Stock Adjustment ──────────────────────────────────────────────────────────
 
 class StockAdjustCreate(BaseModel):
@@ -148,7 +144,7 @@ class StockAdjustRead(BaseModel):
 
 
 @router.post("/adjust", response_model=StockAdjustRead, status_code=201)
-def adjust_stock(data: StockAdjustCreate, session: Session = Depends(get_db)):
+def adjust_stock(data: StockAdjustCreate, session: Session = Depends(get_session)):
     """Create a stock adjustment (updates product stock_quantity and logs the change)."""
     if data.quantity_change == 0:
         raise HTTPException(status_code=400, detail="quantity_change cannot be zero")
@@ -179,7 +175,6 @@ def adjust_stock(data: StockAdjustCreate, session: Session = Depends(get_db)):
         EventType.INVENTORY_UPDATED,
         {"product_id": product.id, "product_name": product.name, "new_quantity": product.stock_quantity},
     ))
-    session.refresh(adj)
     return StockAdjustRead(
         id=adj.id,
         product_id=adj.product_id,
@@ -194,7 +189,7 @@ def adjust_stock(data: StockAdjustCreate, session: Session = Depends(get_db)):
 def list_adjustments(
     product_id: Optional[int] = Query(None),
     limit: int = Query(50, le=200),
-    session: Session = Depends(get_db),
+    session: Session = Depends(get_session),
 ):
     """List recent stock adjustments, optionally filtered by product."""
     stmt = select(StockAdjustment).order_by(StockAdjustment.timestamp.desc()).limit(limit)  # type: ignore[attr-defined]
@@ -246,18 +241,34 @@ COLUMN_ALIASES = {
 }
 
 
+def _column_key(label) -> str:
+    key = str(label).strip().lower()
+    if key.endswith(" *"):   # strip required-field marker from template headers
+        key = key[:-2].strip()
+    return key
+
+
+# Header keys worth parsing: every alias plus the Product field names themselves
+_KNOWN_COLUMN_KEYS = frozenset(COLUMN_ALIASES) | frozenset(COLUMN_ALIASES.values())
+
+
+def _is_known_column(label) -> bool:
+    """usecols filter: only parse columns that map to a Product field."""
+    return _column_key(label) in _KNOWN_COLUMN_KEYS
+
+
 def _normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     """Normalize column names to Product field names where possible."""
-    out = {}
+    mapping = {}
     for c in df.columns:
-        key = str(c).strip().lower()
-        if key.endswith(" *"):   # strip required-field marker from template headers
-            key = key[:-2].strip()
-        if key in COLUMN_ALIASES:
-            out[COLUMN_ALIASES[key]] = df[c]
-        else:
-            out[key] = df[c]
-    return pd.DataFrame(out)
+        key = _column_key(c)
+        mapping[c] = COLUMN_ALIASES.get(key, key)
+    # rename() relabels in place of rebuilding the frame column by column
+    renamed = df.rename(columns=mapping, copy=False)
+    if renamed.columns.has_duplicates:
+        # Several headers alias one field (e.g. "Name" and "Item Name"): the last one wins
+        renamed = renamed.loc[:, ~renamed.columns.duplicated(keep="last")]
+    return renamed
 
 
 # All column-label variants that hold barcodes — passed to pd.read_excel converters
@@ -334,15 +345,17 @@ def _read_upload(file: UploadFile) -> tuple[pd.DataFrame, int]:
     if file.filename and file.filename.lower().endswith(".csv"):
         df = pd.read_csv(
             io.BytesIO(raw),
+            usecols=_is_known_column,
             converters=converters,
             na_values=["", "N/A", "n/a", "-"],
             keep_default_na=True,
         )
         return df, 2  # row 1 = header, row 2 = first data row
 
-    # ── XLSX: scan every row to locate the real header row ───────────────────
+    # ── XLSX: sniff the first rows to locate the real header row ─────────────
     # engine="openpyxl" is explicit — newer pandas removed xlrd support for .xlsx.
-    df_all = pd.read_excel(io.BytesIO(raw), header=None, engine="openpyxl")
+    # Six rows cover the five header candidates plus the hint row after them.
+    df_all = pd.read_excel(io.BytesIO(raw), header=None, nrows=6, engine="openpyxl")
     header_row_idx = _find_header_row(df_all)
 
     if header_row_idx is None:
@@ -370,6 +383,7 @@ def _read_upload(file: UploadFile) -> tuple[pd.DataFrame, int]:
 
     read_kwargs: dict = {
         "engine": "openpyxl",
+        "usecols": _is_known_column,
         "converters": converters,
         "na_values": ["", "N/A", "n/a", "None", "-"],
         "keep_default_na": True,
@@ -381,6 +395,17 @@ def _read_upload(file: UploadFile) -> tuple[pd.DataFrame, int]:
     return df, data_start_row
 
 
+# Numeric Product fields and the header label used in per-cell warnings
+_NUMERIC_COLUMNS = {
+    "price_selling": "Selling Price",
+    "price_buying": "Buying Price",
+    "stock_quantity": "Current Stock",
+    "min_stock_alert": "Low Stock Limit",
+    "wholesale_price": "Wholesale Price",
+    "wholesale_threshold": "Wholesale Threshold",
+}
+
+
 def _coerce_numeric_columns(df: pd.DataFrame, data_start_row: int) -> tuple[pd.DataFrame, List[str]]:
     """Coerce numeric columns with ``pd.to_numeric(errors='coerce')``.
 
@@ -389,19 +414,13 @@ def _coerce_numeric_columns(df: pd.DataFrame, data_start_row: int) -> tuple[pd.D
     numbers (they are replaced with NaN / missing rather than crashing).
     """
     warnings: List[str] = []
-    numeric_cols = {
-        "price_selling": "Selling Price",
-        "price_buying": "Buying Price",
-        "stock_quantity": "Current Stock",
-        "min_stock_alert": "Low Stock Limit",
-        "wholesale_price": "Wholesale Price",
-        "wholesale_threshold": "Wholesale Threshold",
-    }
-    for field, label in numeric_cols.items():
+    for field, label in _NUMERIC_COLUMNS.items():
         if field not in df.columns:
             continue
-        original = df[field].copy()
-        df[field] = pd.to_numeric(df[field], errors="coerce")
+        original = df[field]
+        if pd.api.types.is_numeric_dtype(original):
+            continue  # already parsed as numbers (typical for Excel): nothing to coerce
+        df[field] = pd.to_numeric(original, errors="coerce")
         # Find cells that were non-null before coercion but became NaN after.
         bad_mask = original.notna() & df[field].isna()
         for idx in df.index[bad_mask]:
@@ -439,6 +458,118 @@ def _check_intra_file_duplicates(df: pd.DataFrame, data_start_row: int) -> List[
     return warnings
 
 
+# Columns written by the upload; anything else on an existing product is left untouched.
+_UPLOAD_FIELDS = (
+    "name", "barcode", "category", "price_buying", "price_selling", "stock_quantity",
+    "min_stock_alert", "wholesale_price", "wholesale_threshold",
+)
+# Integer Product fields; values must fit SQLite's signed 64-bit INTEGER before the cast
+_WHOLE_FIELDS = ("stock_quantity", "min_stock_alert", "wholesale_threshold")
+_INT64_BOUND = 2.0 ** 63
+# Rows per INSERT/IN batch: 9 columns x 500 rows stays well under SQLite's bound-parameter limit.
+_UPSERT_BATCH = 500
+
+
+def _optional_column(df: pd.DataFrame, field: str) -> pd.Series:
+    return df[field] if field in df.columns else pd.Series(np.nan, index=df.index, dtype=float)
+
+
+def _prepare_upload_rows(df: pd.DataFrame, data_start_row: int) -> tuple[pd.DataFrame, List[str]]:
+    """Validate and default every row with column operations.
+
+    Returns *(rows, errors)*: the importable rows (columns ``_UPLOAD_FIELDS``, file
+    order, duplicates kept) and the skip messages for rejected rows.
+    """
+    barcode = df["barcode"].astype(str).str.strip()
+    price_selling = df["price_selling"]
+    no_barcode = barcode.str.lower().isin(("nan", "none", ""))
+    no_price = ~no_barcode & price_selling.isna()
+    negative = ~no_barcode & ~no_price & (price_selling < 0)
+    # Per row, the first numeric field holding an infinite value or a whole number beyond INTEGER range
+    out_of_range_field = pd.Series("", index=df.index)
+    for field in reversed(_NUMERIC_COLUMNS):
+        col = _optional_column(df, field)
+        limit = _INT64_BOUND if field in _WHOLE_FIELDS else np.inf
+        out_of_range_field = out_of_range_field.mask(col.notna() & ~(col.abs() < limit), field)
+    out_of_range = ~(no_barcode | no_price | negative) & (out_of_range_field != "")
+    skipped = no_barcode | no_price | negative | out_of_range
+
+    errors: List[str] = []
+    for i in np.flatnonzero(skipped.to_numpy()):
+        excel_row = int(df.index[i]) + data_start_row
+        if no_barcode.iat[i]:
+            errors.append(f"Row {excel_row}: missing barcode — skipped")
+        elif no_price.iat[i]:
+            errors.append(f"Row {excel_row} ({barcode.iat[i]}): missing Selling Price — skipped")
+        elif negative.iat[i]:
+            errors.append(
+                f"Row {excel_row} ({barcode.iat[i]}): Selling Price {float(price_selling.iat[i])} is negative — skipped"
+            )
+        else:
+            field = out_of_range_field.iat[i]
+            errors.append(
+                f"Row {excel_row} ({barcode.iat[i]}): {_NUMERIC_COLUMNS[field]} {float(df[field].iat[i])} "
+                f"is out of range — skipped"
+            )
+
+    name = df["name"].astype(str).str.strip().where(df["name"].notna(), "").replace("", "Unknown")
+    category_raw = _optional_column(df, "category")
+    category = category_raw.astype(str).str.strip().where(category_raw.notna(), "").replace("", "General")
+
+    # Buying price falls back to the selling price when missing or negative
+    price_buying = df["price_buying"]
+    price_buying = price_buying.where(price_buying >= 0, price_selling)
+
+    def whole(field: str, default: int) -> pd.Series:
+        col = _optional_column(df, field)
+        return np.trunc(col.where(col.abs() < _INT64_BOUND, default)).astype(int)
+
+    wholesale_price = _optional_column(df, "wholesale_price")
+    wholesale_threshold = np.trunc(_optional_column(df, "wholesale_threshold"))
+
+    rows = pd.DataFrame({
+        "name": name,
+        "barcode": barcode,
+        "category": category,
+        "price_buying": price_buying.astype(float),
+        "price_selling": price_selling.astype(float),
+        "stock_quantity": whole("stock_quantity", 0),
+        "min_stock_alert": whole("min_stock_alert", 5),
+        "wholesale_price": wholesale_price.where(wholesale_price >= 0).astype(float),
+        "wholesale_threshold": wholesale_threshold.where(
+            (wholesale_threshold >= 0) & (wholesale_threshold < _INT64_BOUND)
+        ).astype("Int64"),
+    })
+    return rows[~skipped], errors
+
+
+def _upsert_products(session: Session, rows: pd.DataFrame) -> tuple[int, int]:
+    """Insert new barcodes and update existing ones with batched ``INSERT ... ON CONFLICT``.
+
+    Returns *(created, updated)*, counted per file row as the one-at-a-time import did:
+    the first row for an unknown barcode creates it, every later row updates.
+    """
+    barcodes = rows["barcode"]
+    unique_codes = barcodes.unique().tolist()
+    existing: set[str] = set()
+    for i in range(0, len(unique_codes), _UPSERT_BATCH):
+        batch = unique_codes[i:i + _UPSERT_BATCH]
+        existing.update(session.exec(select(Product.barcode).where(Product.barcode.in_(batch))).all())
+    created = int((~barcodes.duplicated() & ~barcodes.isin(existing)).sum())
+
+    # Last occurrence of a duplicated barcode wins; NaN/NA become NULL
+    final = rows.drop_duplicates(subset=["barcode"], keep="last").astype(object)
+    records = final.where(final.notna(), None).to_dict(orient="records")
+    stmt = upsert_insert(session, Product.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["barcode"],
+        set_={f: stmt.excluded[f] for f in _UPLOAD_FIELDS if f != "barcode"},
+    )
+    for i in range(0, len(records), _UPSERT_BATCH):
+        session.execute(stmt, records[i:i + _UPSERT_BATCH])
+    return created, len(rows) - created
+
+
 @router.post("/upload")
 def upload_inventory(file: UploadFile = File(...)):
     """
@@ -491,97 +622,11 @@ def upload_inventory(file: UploadFile = File(...)):
     # Warn about barcodes that appear more than once in the file
     dup_warnings = _check_intra_file_duplicates(df, data_start_row)
 
-    created = 0
-    updated = 0
-    errors: List[str] = list(coerce_warnings) + list(dup_warnings)
+    rows, row_errors = _prepare_upload_rows(df, data_start_row)
+    errors: List[str] = list(coerce_warnings) + list(dup_warnings) + row_errors
 
     with Session(engine) as session:
-        for idx, row in df.iterrows():
-            excel_row = int(idx) + data_start_row  # type: ignore[arg-type]
-            barcode = str(row["barcode"]).strip()
-            if not barcode or barcode.lower() in ("nan", "none", ""):
-                errors.append(f"Row {excel_row}: missing barcode — skipped")
-                continue
-            try:
-                name_val = row["name"]
-                name = str(name_val).strip() if not pd.isna(name_val) else ""
-                name = name or "Unknown"
-
-                if pd.isna(row["price_selling"]):
-                    errors.append(f"Row {excel_row} ({barcode}): missing Selling Price — skipped")
-                    continue
-                price_selling = float(row["price_selling"])
-                if price_selling < 0:
-                    errors.append(f"Row {excel_row} ({barcode}): Selling Price {price_selling} is negative — skipped")
-                    continue
-
-                _pb = row.get("price_buying")
-                price_buying = float(_pb) if _pb is not None and not pd.isna(_pb) else price_selling
-                if price_buying < 0:
-                    price_buying = price_selling  # fallback rather than hard-fail
-
-                _sq = row.get("stock_quantity")
-                stock_quantity = int(_sq) if _sq is not None and not pd.isna(_sq) else 0
-
-                _ms = row.get("min_stock_alert")
-                min_stock_alert = int(_ms) if _ms is not None and not pd.isna(_ms) else 5
-
-                _wp = row.get("wholesale_price")
-                wholesale_price: Optional[float] = None
-                if _wp is not None and not pd.isna(_wp):
-                    try:
-                        v = float(_wp)
-                        wholesale_price = v if v >= 0 else None
-                    except (TypeError, ValueError):
-                        pass
-
-                _wt = row.get("wholesale_threshold")
-                wholesale_threshold: Optional[int] = None
-                if _wt is not None and not pd.isna(_wt):
-                    try:
-                        v = int(_wt)
-                        wholesale_threshold = v if v >= 0 else None
-                    except (TypeError, ValueError):
-                        pass
-
-                _cat = row.get("category")
-                category: str = "General"
-                if _cat is not None and not (isinstance(_cat, float) and pd.isna(_cat)):
-                    cat_str = str(_cat).strip()
-                    if cat_str:
-                        category = cat_str
-
-                existing = session.exec(
-                    select(Product).where(Product.barcode == barcode)
-                ).first()
-                if existing:
-                    existing.name = name
-                    existing.price_buying = price_buying
-                    existing.price_selling = price_selling
-                    existing.stock_quantity = stock_quantity
-                    existing.min_stock_alert = min_stock_alert
-                    existing.wholesale_price = wholesale_price
-                    existing.wholesale_threshold = wholesale_threshold
-                    existing.category = category
-                    session.add(existing)
-                    updated += 1
-                else:
-                    product = Product(
-                        name=name,
-                        barcode=barcode,
-                        category=category,
-                        price_buying=price_buying,
-                        price_selling=price_selling,
-                        stock_quantity=stock_quantity,
-                        min_stock_alert=min_stock_alert,
-                        wholesale_price=wholesale_price,
-                        wholesale_threshold=wholesale_threshold,
-                    )
-                    session.add(product)
-                    created += 1
-            except Exception as e:
-                errors.append(f"Row {excel_row} ({barcode}): {e}")
-                continue
+        created, updated = _upsert_products(session, rows)
         session.commit()
 
     return {
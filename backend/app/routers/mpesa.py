@@ -1,18 +1,20 @@
 """M-Pesa Daraja: STK Push, callback webhook, C2B confirmation with automatic WebSocket notification."""
-import json
+import asyncio
 import logging
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
-from urllib.request import Request as UrlRequest, urlopen
-from urllib.error import HTTPError, URLError
 
-from fastapi import APIRouter, HTTPException, Request
+import orjson
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from sqlmodel import Session, select
+from sqlmodel import Session, or_, select
 
 from app.database import engine
 from app.models import Receipt
-from app.mpesa_utils import send_stk_push, get_access_token, DARAJA_BASE
+from app.mpesa_utils import send_stk_push, get_access_token, post_to_daraja, query_transaction_status
 from app.config import config
 from app.websocket_manager import manager, EventType, create_event
 
@@ -51,46 +53,36 @@ def _check_mpesa_ip(request: Request) -> None:
         logger.info(f"M-Pesa webhook from {client_ip}")
 
 
-def _extract_stk_callback_result_code(body: dict) -> Optional[int]:
-    """Extract ResultCode from Daraja STK callback Body.stkCallback."""
-    try:
-        stk = (body or {}).get("Body") or {}
-        stk = stk.get("stkCallback") if isinstance(stk, dict) else {}
-        if isinstance(stk, dict) and "ResultCode" in stk:
-            return int(stk["ResultCode"])
-    except (TypeError, ValueError):
-        pass
-    return None
-
+def _parse_stk_callback(body) -> tuple[Optional[int], Optional[str], Optional[str]]:
+    """
+    Walk Body.stkCallback once and return (ResultCode, CheckoutRequestID, MpesaReceiptNumber).
+    Missing or malformed parts come back as None.
+    """
+    stk = body.get("Body") if isinstance(body, dict) else None
+    stk = stk.get("stkCallback") if isinstance(stk, dict) else None
+    if not isinstance(stk, dict):
+        return None, None, None
 
-def _extract_checkout_request_id(body: dict) -> str | None:
-    try:
-        stk = (body or {}).get("Body") or {}
-        stk = stk.get("stkCallback") if isinstance(stk, dict) else {}
-        if isinstance(stk, dict):
-            cid = stk.get("CheckoutRequestID")
-            return str(cid).strip() if cid else None
-    except (TypeError, ValueError):
-        pass
-    return None
+    result_code: Optional[int] = None
+    if "ResultCode" in stk:
+        try:
+            result_code = int(stk["ResultCode"])
+        except (TypeError, ValueError):
+            pass
 
+    cid = stk.get("CheckoutRequestID")
+    checkout_id = str(cid).strip() if cid else None
 
-def _extract_mpesa_receipt_number(body: dict) -> Optional[str]:
-    """Extract MpesaReceiptNumber from Body.stkCallback.CallbackMetadata.Item."""
-    try:
-        stk = (body or {}).get("Body") or {}
-        stk = stk.get("stkCallback") if isinstance(stk, dict) else {}
-        meta = stk.get("CallbackMetadata") if isinstance(stk, dict) else {}
-        items = meta.get("Item") if isinstance(meta, dict) else []
-        if not isinstance(items, list):
-            return None
+    receipt_number: Optional[str] = None
+    meta = stk.get("CallbackMetadata")
+    items = meta.get("Item") if isinstance(meta, dict) else None
+    if isinstance(items, list):
         for item in items:
             if isinstance(item, dict) and item.get("Name") == "MpesaReceiptNumber":
                 val = item.get("Value")
-                return str(val).strip() if val is not None else None
-    except (TypeError, ValueError):
-        pass
-    return None
+                receipt_number = str(val).strip() if val is not None else None
+                break
+    return result_code, checkout_id, receipt_number
 
 
 class VerifyManualRequest(BaseModel):
@@ -107,7 +99,7 @@ class STKPushRequest(BaseModel):
 
 
 @router.post("/stk-push")
-def stk_push(data: STKPushRequest):
+async def stk_push(data: STKPushRequest):
     """
     Trigger M-Pesa STK Push (Lipa Na M-Pesa Online).
     Requires CONSUMER_KEY, CONSUMER_SECRET (and optionally DARAJA_PASSKEY, DARAJA_SHORTCODE, DARAJA_CALLBACK_URL).
@@ -119,7 +111,7 @@ def stk_push(data: STKPushRequest):
     if not data.phone or not data.phone.strip():
         raise HTTPException(status_code=400, detail="phone number is required")
     try:
-        result = send_stk_push(data.phone, data.amount)
+        result = await send_stk_push(data.phone, data.amount)
         if result.get("error"):
             raise HTTPException(
                 status_code=502,
@@ -135,65 +127,100 @@ def stk_push(data: STKPushRequest):
         raise HTTPException(status_code=502, detail=str(e)) from e
 
 
+def _complete_stk_receipt(checkout_id: str, receipt_code: str) -> tuple[Optional[int], float]:
+    """Mark the receipt for this CheckoutRequestID COMPLETED; returns (receipt id, amount)."""
+    with Session(engine) as session:
+        r = session.exec(
+            select(Receipt).where(Receipt.checkout_request_id == checkout_id)
+        ).first()
+        if not r:
+            return None, 0.0
+        r.payment_status = "COMPLETED"
+        r.mpesa_code = receipt_code or r.mpesa_code
+        r.reference_code = receipt_code or r.reference_code
+        session.add(r)
+        session.commit()
+        return r.id, r.total_amount
+
+
+# Daraja has already been told "Success" when the write runs, so it will not re-deliver:
+# retry transient failures (database locked, pool timeout) with backoff before giving up.
+_STK_WRITE_ATTEMPTS = 5
+_STK_RETRY_DELAY = 1.0  # seconds, doubled after each failed attempt
+
+
+async def _complete_stk_receipt_with_retry(checkout_id: str, receipt_code: str) -> tuple[Optional[int], float]:
+    delay = _STK_RETRY_DELAY
+    for attempt in range(1, _STK_WRITE_ATTEMPTS):
+        try:
+            return await run_in_threadpool(_complete_stk_receipt, checkout_id, receipt_code)
+        except Exception as e:
+            logger.warning(
+                "STK result write for %s failed (attempt %d/%d): %s; retrying in %.0fs",
+                checkout_id, attempt, _STK_WRITE_ATTEMPTS, e, delay,
+            )
+            await asyncio.sleep(delay)
+            delay *= 2
+    return await run_in_threadpool(_complete_stk_receipt, checkout_id, receipt_code)  # last try raises
+
+
+async def _apply_stk_result(checkout_id: Optional[str], result_code: Optional[int], receipt_code: str) -> None:
+    """Record an STK result and notify POS terminals (runs after the webhook has answered)."""
+    try:
+        if result_code == 0 and checkout_id:
+            db_id, tx_amount = await _complete_stk_receipt_with_retry(checkout_id, receipt_code)
+
+            # Broadcast payment received to all connected POS terminals
+            if db_id:
+                event = create_event(
+                    EventType.MPESA_STK_CALLBACK,
+                    {
+                        "status": "success",
+                        "checkout_request_id": checkout_id,
+                        "mpesa_receipt": receipt_code,
+                        "receipt_id": db_id,
+                        "amount": tx_amount,
+                    }
+                )
+                await manager.broadcast(event)
+        elif result_code is not None and result_code != 0:
+            # Payment failed or cancelled - notify frontend
+            event = create_event(
+                EventType.MPESA_PAYMENT_FAILED,
+                {
+                    "status": "failed",
+                    "checkout_request_id": checkout_id,
+                    "result_code": result_code,
+                }
+            )
+            await manager.broadcast(event)
+    except Exception:
+        # The receipt stays PENDING; GET /payments/verify/{checkout_id} (STK query) recovers it.
+        logger.exception(
+            "Failed to apply STK callback for CheckoutRequestID %s (%s); "
+            "recover with /payments/verify", checkout_id, receipt_code or "no receipt number",
+        )
+
+
 @router.post("/callback")
-async def mpesa_stk_callback(request: Request):
+async def mpesa_stk_callback(request: Request, background_tasks: BackgroundTasks):
     """
     Daraja STK Push result callback (webhook).
     Safaricom POSTs here when the customer completes or cancels STK Push.
     On ResultCode 0: find Transaction by CheckoutRequestID, set payment_status=COMPLETED, mpesa_code=MpesaReceiptNumber.
     Broadcasts WebSocket event to all connected POS terminals.
-    Always returns 200 so Daraja does not retry.
+    Always returns 200 so Daraja does not retry; the DB write and broadcast run
+    as a background task after the response is sent, retrying transient DB errors.
+    A result that still cannot be written is recovered through /payments/verify.
     """
     _check_mpesa_ip(request)
     try:
-        body = await request.json()
+        body = orjson.loads(await request.body())
     except Exception:
         return {"ResultCode": 0, "ResultDesc": "Accepted"}
-    result_code = _extract_stk_callback_result_code(body)
-
-    checkout_id = _extract_checkout_request_id(body)
-    if result_code == 0 and checkout_id:
-        receipt_code = _extract_mpesa_receipt_number(body) or ""
-        tx_amount = 0.0
-        db_id = None
-
-        with Session(engine) as session:
-            r = session.exec(
-                select(Receipt).where(Receipt.checkout_request_id == checkout_id)
-            ).first()
-            if r:
-                r.payment_status = "COMPLETED"
-                r.mpesa_code = receipt_code or r.mpesa_code
-                r.reference_code = receipt_code or r.reference_code
-                tx_amount = r.total_amount
-                db_id = r.id
-                session.add(r)
-                session.commit()
-
-        # Broadcast payment received to all connected POS terminals
-        if db_id:
-            event = create_event(
-                EventType.MPESA_STK_CALLBACK,
-                {
-                    "status": "success",
-                    "checkout_request_id": checkout_id,
-                    "mpesa_receipt": receipt_code,
-                    "receipt_id": db_id,
-                    "amount": tx_amount,
-                }
-            )
-            await manager.broadcast(event)
-    elif result_code is not None and result_code != 0:
-        # Payment failed or cancelled - notify frontend
-        event = create_event(
-            EventType.MPESA_PAYMENT_FAILED,
-            {
-                "status": "failed",
-                "checkout_request_id": checkout_id,
-                "result_code": result_code,
-            }
-        )
-        await manager.broadcast(event)
+    result_code, checkout_id, receipt_code = _parse_stk_callback(body)
+    if result_code is not None:
+        background_tasks.add_task(_apply_stk_result, checkout_id, result_code, receipt_code or "")
 
     return {"ResultCode": 0, "ResultDesc": "Success"}
 
@@ -219,6 +246,55 @@ def _parse_c2b_confirmation(body: dict) -> Optional[tuple[str, float]]:
         return None
 
 
+def _match_c2b_payment(trans_id: str, trans_amount: float) -> Optional[int]:
+    """
+    Match a PENDING MPESA transaction: same amount (tolerance 0.01), created in last 15 minutes.
+    Marks it COMPLETED with the C2B TransID and returns its id.
+    """
+    cutoff = datetime.utcnow() - timedelta(minutes=15)
+    with Session(engine) as session:
+        # Unreferenced filter and LIMIT 1 run in SQL: one row back instead of every candidate
+        r = session.exec(
+            select(Receipt)
+            .where(Receipt.payment_type.in_(["MOBILE", "BANK"]))
+            .where(Receipt.payment_status == "PENDING")
+            .where(Receipt.total_amount >= trans_amount - 0.01)
+            .where(Receipt.total_amount <= trans_amount + 0.01)
+            .where(Receipt.timestamp >= cutoff)
+            .where(or_(Receipt.reference_code.is_(None), Receipt.reference_code == ""))
+            .order_by(Receipt.timestamp.desc())
+            .limit(1)
+        ).first()
+        if r:
+            r.payment_status = "COMPLETED"
+            r.reference_code = trans_id
+            session.add(r)
+            session.commit()
+            return r.id
+    return None
+
+
+# Daraja re-sends a confirmation it thinks went unanswered. Remember recent TransIDs so
+# a retry neither matches a second PENDING receipt nor re-broadcasts to every terminal.
+# Unmatched payments are still broadcast once: Buy Goods checkout matches them client-side.
+_C2B_SEEN_TTL = 900.0
+_C2B_SEEN_MAX = 1024
+_c2b_seen: "OrderedDict[str, float]" = OrderedDict()
+
+
+def _first_c2b_sighting(trans_id: str) -> bool:
+    """True the first time trans_id is seen within the TTL (called on the event loop only)."""
+    now = time.monotonic()
+    while _c2b_seen and (
+        len(_c2b_seen) >= _C2B_SEEN_MAX or now - next(iter(_c2b_seen.values())) > _C2B_SEEN_TTL
+    ):
+        _c2b_seen.popitem(last=False)
+    if trans_id in _c2b_seen:
+        return False
+    _c2b_seen[trans_id] = now
+    return True
+
+
 @router.post("/c2b-confirmation")
 async def mpesa_c2b_confirmation(request: Request):
     """
@@ -231,13 +307,16 @@ async def mpesa_c2b_confirmation(request: Request):
     """
     _check_mpesa_ip(request)
     try:
-        body = await request.json()
+        body = orjson.loads(await request.body())
     except Exception:
         return {"ResultCode": 0, "ResultDesc": "Accepted"}
     parsed = _parse_c2b_confirmation(body)
     if not parsed:
         return {"ResultCode": 0, "ResultDesc": "Accepted"}
     trans_id, trans_amount = parsed
+    if not _first_c2b_sighting(trans_id):
+        logger.info(f"Duplicate C2B confirmation {trans_id} ignored")
+        return {"ResultCode": 0, "ResultDesc": "Success"}
 
     # Extract customer info from C2B body
     customer_phone = body.get("MSISDN", "")
@@ -247,31 +326,12 @@ async def mpesa_c2b_confirmation(request: Request):
         body.get("LastName", ""),
     ])).strip()
 
-    # Match PENDING MPESA transaction: same amount (tolerance 0.01), created in last 15 minutes
-    cutoff = datetime.utcnow() - timedelta(minutes=15)
-    matched_id = None
-
-    with Session(engine) as session:
-        candidates = list(
-            session.exec(
-                select(Receipt)
-                .where(Receipt.payment_type.in_(["MOBILE", "BANK"]))
-                .where(Receipt.payment_status == "PENDING")
-                .where(Receipt.total_amount >= trans_amount - 0.01)
-                .where(Receipt.total_amount <= trans_amount + 0.01)
-                .where(Receipt.timestamp >= cutoff)
-                .order_by(Receipt.timestamp.desc())
-            )
-        )
-        for r in candidates:
-            if r.reference_code:
-                continue
-            r.payment_status = "COMPLETED"
-            r.reference_code = trans_id
-            matched_id = r.id
-            session.add(r)
-            session.commit()
-            break
+    try:
+        matched_id = await run_in_threadpool(_match_c2b_payment, trans_id, trans_amount)
+    except Exception:
+        # Nothing was applied: let Daraja's retry of this TransID through
+        _c2b_seen.pop(trans_id, None)
+        raise
 
     # Broadcast C2B payment received to all connected POS terminals
     event = create_event(
@@ -291,10 +351,10 @@ async def mpesa_c2b_confirmation(request: Request):
 
 
 @router.get("/status")
-def mpesa_status():
+async def mpesa_status():
     """Check if Daraja credentials are configured (does not validate token)."""
     try:
-        get_access_token()
+        await get_access_token()
         return {"configured": True}
     except ValueError:
         return {"configured": False}
@@ -308,7 +368,7 @@ class C2BRegisterRequest(BaseModel):
 
 
 @router.post("/c2b-register")
-def register_c2b_urls(data: C2BRegisterRequest):
+async def register_c2b_urls(data: C2BRegisterRequest):
     """
     Register C2B Validation and Confirmation URLs with Daraja.
     Call once to set up webhooks for Buy Goods / Paybill payments.
@@ -318,7 +378,7 @@ def register_c2b_urls(data: C2BRegisterRequest):
     3. Your confirmation endpoint broadcasts via WebSocket to POS terminals
     """
     try:
-        token = get_access_token()
+        token = await get_access_token()
     except ValueError as e:
         raise HTTPException(status_code=503, detail="M-Pesa not configured") from e
 
@@ -331,28 +391,10 @@ def register_c2b_urls(data: C2BRegisterRequest):
         "ValidationURL": data.validation_url,
     }
 
-    url = f"{DARAJA_BASE}/mpesa/c2b/v1/registerurl"
-    body = json.dumps(payload).encode()
-    req = UrlRequest(
-        url,
-        data=body,
-        method="POST",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        },
-    )
     try:
-        with urlopen(req, timeout=15) as resp:
-            return json.loads(resp.read().decode())
-    except HTTPError as e:
-        try:
-            err_body = e.read().decode()
-            return {"error": err_body, "status": e.code}
-        except Exception:
-            raise HTTPException(status_code=502, detail=f"C2B registration failed: {e}") from e
-    except URLError as e:
-        raise HTTPException(status_code=502, detail=f"C2B registration failed: {e}") from e
+        return await post_to_daraja("/mpesa/c2b/v1/registerurl", payload, token, "C2B registration failed")
+    except ValueError as e:
+        raise HTTPException(status_code=502, detail=str(e)) from e
 
 
 @router.post("/c2b-validation")
@@ -376,7 +418,7 @@ async def mpesa_c2b_validation(request: Request):
 
 
 @router.get("/transaction-status")
-def transaction_status(checkout_request_id: str):
+async def transaction_status(checkout_request_id: str):
     """
     Verify M-Pesa STK Push transaction status (for lost callbacks).
     Query Daraja by CheckoutRequestID returned from STK Push.
@@ -384,8 +426,7 @@ def transaction_status(checkout_request_id: str):
     if not checkout_request_id or not checkout_request_id.strip():
         raise HTTPException(status_code=400, detail="checkout_request_id required")
     try:
-        from app.mpesa_utils import query_transaction_status
-        result = query_transaction_status(checkout_request_id.strip())
+        result = await query_transaction_status(checkout_request_id.strip())
         if result.get("error"):
             raise HTTPException(status_code=502, detail=result.get("error", "Daraja error"))
         return result
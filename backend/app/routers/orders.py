@@ -1,7 +1,9 @@
 """Held orders (save/restore cart) per cashier."""
-import json
 from typing import Optional
+
+import orjson
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from sqlmodel import Session, select
 
@@ -45,14 +47,15 @@ class HeldOrderRead(BaseModel):
 @router.post("/hold", response_model=HoldOrderResponse, status_code=201)
 def hold_order(data: HoldOrderRequest):
     """Save cart as held order."""
-    with Session(engine) as session:
+    # id comes back from the INSERT and created_at is set client-side, so keep the
+    # attributes loaded across commit instead of re-SELECTing with refresh().
+    with Session(engine, expire_on_commit=False) as session:
         staff = session.get(Staff, data.staff_id)
         if not staff:
             raise HTTPException(status_code=400, detail="Invalid staff_id")
 
         # Serialize list of models to JSON string
-        items_data = [item.model_dump() for item in data.items]
-        items_json = json.dumps(items_data)
+        items_json = orjson.dumps([item.model_dump() for item in data.items]).decode()
 
         held = HeldOrder(
             staff_id=data.staff_id,
@@ -62,7 +65,6 @@ def hold_order(data: HoldOrderRequest):
         )
         session.add(held)
         session.commit()
-        session.refresh(held)
         return HoldOrderResponse(
             id=held.id or 0,
             staff_id=held.staff_id,
@@ -79,16 +81,16 @@ def list_held_orders(staff_id: int = Query(1)):
         held_list = session.exec(
             select(HeldOrder).where(HeldOrder.staff_id == staff_id).order_by(HeldOrder.created_at.desc())
         ).all()
-        return [
-            HoldOrderResponse(
-                id=h.id or 0,
-                staff_id=h.staff_id,
-                total_gross=h.total_gross,
-                notes=h.notes or "",
-                created_at=h.created_at.isoformat(),
-            )
+        return ORJSONResponse([
+            {
+                "id": h.id or 0,
+                "staff_id": h.staff_id,
+                "total_gross": h.total_gross,
+                "notes": h.notes or "",
+                "created_at": h.created_at.isoformat(),
+            }
             for h in held_list
-        ]
+        ])
 
 
 @router.get("/held/{order_id}", response_model=HeldOrderRead)
@@ -101,9 +103,9 @@ def get_held_order(order_id: int, staff_id: int = Query(1)):
         if held.staff_id != staff_id:
             raise HTTPException(status_code=403, detail="Not your held order")
         try:
-            items_raw = json.loads(held.items_json) if held.items_json else []
+            items_raw = orjson.loads(held.items_json) if held.items_json else []
             items = [HeldItem(**item) for item in items_raw]
-        except Exception:
+        except (TypeError, ValueError):  # bad JSON (orjson.JSONDecodeError) or malformed items
             items = []
         return HeldOrderRead(
             id=held.id or 0,
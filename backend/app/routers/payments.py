@@ -1,5 +1,9 @@
 """Payments API v1: M-Pesa verify (STK Push status query)."""
+import time
+from collections import OrderedDict
+
 from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Session, select
 
 from app.database import engine
@@ -8,9 +12,44 @@ from app.mpesa_utils import query_transaction_status
 
 router = APIRouter(prefix="/payments", tags=["payments"])
 
+# The till polls /verify every couple of seconds until it sees success, and may keep
+# polling after; a completed payment never changes, so answer repeats from memory
+# instead of another Daraja STK Query.
+_VERIFIED_TTL = 3600.0
+_VERIFIED_MAX = 1024
+_verified: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+
+
+def _cached_verification(checkout_id: str):
+    """Completed-verify response for checkout_id, if seen within the TTL (event loop only)."""
+    now = time.monotonic()
+    while _verified and now - next(iter(_verified.values()))[0] > _VERIFIED_TTL:
+        _verified.popitem(last=False)
+    hit = _verified.get(checkout_id)
+    return hit[1] if hit else None
+
+
+def _remember_verification(checkout_id: str, response: dict) -> None:
+    _verified[checkout_id] = (time.monotonic(), response)
+    while len(_verified) > _VERIFIED_MAX:
+        _verified.popitem(last=False)
+
+
+def _mark_receipt_completed(checkout_id: str, mpesa_receipt_number: str) -> None:
+    with Session(engine) as session:
+        tx = session.exec(
+            select(Receipt).where(Receipt.checkout_request_id == checkout_id)
+        ).first()
+        if tx:
+            tx.payment_status = "COMPLETED"
+            tx.mpesa_code = mpesa_receipt_number or tx.mpesa_code
+            tx.reference_code = mpesa_receipt_number or tx.reference_code
+            session.add(tx)
+            session.commit()
+
 
 @router.get("/verify/{checkout_id}")
-def verify_payment(checkout_id: str):
+async def verify_payment(checkout_id: str):
     """
     Verify M-Pesa STK Push by CheckoutRequestID.
     Calls Daraja STK Query; if ResultCode == "0", updates Transaction:
@@ -20,9 +59,12 @@ def verify_payment(checkout_id: str):
     checkout_id = (checkout_id or "").strip()
     if not checkout_id:
         raise HTTPException(status_code=400, detail="checkout_id required")
+    cached = _cached_verification(checkout_id)
+    if cached is not None:
+        return cached
 
     try:
-        data = query_transaction_status(checkout_id)
+        data = await query_transaction_status(checkout_id)
     except ValueError as e:
         if "must be set" in str(e) or "MPESA_CONSUMER" in str(e) or "CONSUMER_KEY" in str(e):
             raise HTTPException(
@@ -45,22 +87,15 @@ def verify_payment(checkout_id: str):
                     mpesa_receipt_number = str(item.get("Value", ""))
                     break
 
-        with Session(engine) as session:
-            tx = session.exec(
-                select(Receipt).where(Receipt.checkout_request_id == checkout_id)
-            ).first()
-            if tx:
-                tx.payment_status = "COMPLETED"
-                tx.mpesa_code = mpesa_receipt_number or tx.mpesa_code
-                tx.reference_code = mpesa_receipt_number or tx.reference_code
-                session.add(tx)
-                session.commit()
-
-        return {
+        await run_in_threadpool(_mark_receipt_completed, checkout_id, mpesa_receipt_number)
+
+        response = {
             "success": True,
             "mpesa_receipt_number": mpesa_receipt_number,
             "result_desc": result_desc or "Payment completed.",
         }
+        _remember_verification(checkout_id, response)
+        return response
 
     return {
         "success": False,
@@ -1,11 +1,14 @@
 """Print receipt and cash drawer kick. Returns 200 with warning PRINTER_OFFLINE if printer unavailable. Runs in thread so UI stays fluid."""
-from concurrent.futures import TimeoutError as FuturesTimeoutError
-from fastapi import APIRouter, Body
+from fastapi import APIRouter, Body, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
+from sqlmodel import Session, select
 from typing import List, Optional
 
-from app.printer_service import get_printer, run_in_printer_thread
-from app.routers.hardware import PRINTER_OFFLINE, TIMEOUT_SEC
+from app.database import engine
+from app.models import StoreSettings
+from app.printer_service import get_printer, printer_job_status, submit_printer_job
+from app.routers.hardware import PRINTER_OFFLINE, wait_for_printer
 
 router = APIRouter(prefix="/print", tags=["print"])
 
@@ -33,6 +36,7 @@ class KickDrawerResponse(BaseModel):
     ok: bool
     status: str = "ok"  # API/test compatibility
     warning: Optional[str] = None
+    job_id: Optional[str] = None
 
 
 def _do_print_receipt(
@@ -68,35 +72,35 @@ def _do_kick_drawer() -> None:
     get_printer().kick_drawer()
 
 
-@router.post("/receipt")
-def print_receipt(payload: Optional[ReceiptPayload] = Body(None)):
-    """Print receipt via ESC/POS. Returns 200 with warning PRINTER_OFFLINE if printer unavailable."""
-    req = payload if payload is not None else ReceiptPayload()
-
-    # Fetch settings from DB to override defaults/payload if needed
-    from app.database import engine
-    from app.models import StoreSettings
-    from sqlmodel import Session, select
-
+def _receipt_settings(req: ReceiptPayload) -> tuple:
+    """(shop_name, station_id, contact_phone, kra_pin, header, footer); store settings win over the payload."""
     with Session(engine) as session:
         settings = session.exec(select(StoreSettings)).first()
         if settings:
-            shop_name = settings.shop_name
-            station_id = settings.station_id
-            contact_phone = settings.contact_phone
-            kra_pin = settings.kra_pin
-            receipt_header = settings.receipt_header or ""
-            receipt_footer = settings.receipt_footer or "Thank you for shopping!"
-        else:
-            shop_name = req.shop_name
-            station_id = req.station_id
-            contact_phone = req.contact_phone
-            kra_pin = req.kra_pin
-            receipt_header = ""
-            receipt_footer = "Thank you for shopping!"
+            return (
+                settings.shop_name,
+                settings.station_id,
+                settings.contact_phone,
+                settings.kra_pin,
+                settings.receipt_header or "",
+                settings.receipt_footer or "Thank you for shopping!",
+            )
+    return req.shop_name, req.station_id, req.contact_phone, req.kra_pin, "", "Thank you for shopping!"
+
+
+@router.post("/receipt")
+async def print_receipt(payload: Optional[ReceiptPayload] = Body(None)):
+    """
+    Print receipt via ESC/POS. Returns 200 with warning PRINTER_OFFLINE if printer unavailable.
+    The wait for the printer happens on the event loop, so a stalled printer ties up no worker threads.
+    """
+    req = payload if payload is not None else ReceiptPayload()
+    shop_name, station_id, contact_phone, kra_pin, receipt_header, receipt_footer = (
+        await run_in_threadpool(_receipt_settings, req)
+    )
 
     items = [{"name": i.name, "qty": i.quantity, "price": i.price} for i in req.items]
-    future = run_in_printer_thread(
+    job_id, future = submit_printer_job(
         _do_print_receipt,
         shop_name,
         items,
@@ -110,19 +114,24 @@ def print_receipt(payload: Optional[ReceiptPayload] = Body(None)):
         receipt_header,
         receipt_footer,
     )
-    try:
-        future.result(timeout=TIMEOUT_SEC)
-        return {"ok": True, "status": "ok"}
-    except (Exception, FuturesTimeoutError):
-        return {"ok": False, "status": "error", "warning": PRINTER_OFFLINE}
+    if await wait_for_printer(future):
+        return {"ok": True, "status": "ok", "job_id": job_id}
+    return {"ok": False, "status": "error", "warning": PRINTER_OFFLINE, "job_id": job_id}
 
 
 @router.post("/kick-drawer", response_model=KickDrawerResponse)
-def kick_drawer():
+async def kick_drawer():
     """Send cash drawer kick (ESC/POS sequence). Returns 200 with warning PRINTER_OFFLINE if printer not found."""
-    future = run_in_printer_thread(_do_kick_drawer)
-    try:
-        future.result(timeout=TIMEOUT_SEC)
-        return KickDrawerResponse(ok=True)
-    except (Exception, FuturesTimeoutError):
-        return KickDrawerResponse(ok=False, status="error", warning=PRINTER_OFFLINE)
+    job_id, future = submit_printer_job(_do_kick_drawer)
+    if await wait_for_printer(future):
+        return KickDrawerResponse(ok=True, job_id=job_id)
+    return KickDrawerResponse(ok=False, status="error", warning=PRINTER_OFFLINE, job_id=job_id)
+
+
+@router.get("/status/{job_id}")
+def print_job_status(job_id: str):
+    """Outcome of a print/kick job whose response came back PRINTER_OFFLINE: queued, printing, done or failed."""
+    status = printer_job_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Print job not found")
+    return {"job_id": job_id, "status": status}
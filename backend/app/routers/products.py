@@ -2,13 +2,18 @@
 from typing import List, Optional
 from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import or_, text
 from sqlmodel import Session, select
 from pydantic import BaseModel, Field, computed_field
 
+from app.database import get_session, product_fts_available
 from app.models import Product
 
 router = APIRouter(prefix="/products", tags=["products"])
 
+_FTS_MATCH = text("product.id IN (SELECT rowid FROM product_fts WHERE product_fts MATCH :q)")
+
 
 class ProductCreate(BaseModel):
     """Accept price_sell as alias for price_selling; price_buying optional for test/API compatibility."""
@@ -66,6 +71,21 @@ class ProductRead(BaseModel):
     model_config = {"from_attributes": True}
 
 
+_PRODUCT_READ_FIELDS = tuple(ProductRead.model_fields)
+
+
+def _product_row(p: Product) -> dict:
+    """
+    ProductRead as a plain dict (aliases included) for direct orjson encoding. Rows come
+    straight from typed columns, so handlers return this instead of letting FastAPI
+    validate the ORM object through ProductRead(from_attributes=True).
+    """
+    row = {f: getattr(p, f) for f in _PRODUCT_READ_FIELDS}
+    row["stock"] = p.stock_quantity
+    row["price_sell"] = p.price_selling
+    return row
+
+
 class ProductUpdate(BaseModel):
     """Accept stock as alias for stock_quantity."""
     name: Optional[str] = None
@@ -88,15 +108,8 @@ class ProductUpdate(BaseModel):
     model_config = {"populate_by_name": True}
 
 
-def get_db():
-    from app.database import engine
-    from sqlmodel import Session
-    with Session(engine) as session:
-        yield session
-
-
 @router.get("/categories", response_model=List[str])
-def list_categories(session: Session = Depends(get_db)):
+def list_categories(session: Session = Depends(get_session)):
     """Return distinct product categories for filter dropdowns."""
     rows = session.exec(select(Product.category).distinct()).all()
     categories = sorted({r for r in rows if r})
@@ -106,38 +119,42 @@ def list_categories(session: Session = Depends(get_db)):
 @router.get("", response_model=List[ProductRead])
 def list_products(
     q: Optional[str] = Query(None, description="Search by name or barcode"),
-    session: Session = Depends(get_db),
+    session: Session = Depends(get_session),
 ):
     """List products, optionally filtered by search."""
     statement = select(Product)
     if q:
         q = q.strip()
-        statement = statement.where(
-            (Product.name.ilike(f"%{q}%")) | (Product.barcode == q)
-        )
+        if len(q) >= 3 and product_fts_available():
+            # Quoted as one FTS phrase so user input is never parsed as query syntax
+            name_match = _FTS_MATCH.bindparams(q='"' + q.replace('"', '""') + '"')
+        else:
+            name_match = Product.name.ilike(f"%{q}%")
+        statement = statement.where(or_(name_match, Product.barcode == q))
     products = session.exec(statement).all()
-    return list(products)
+    # ProductRead stays as the documented schema (response_model)
+    return ORJSONResponse([_product_row(p) for p in products])
 
 
 @router.get("/barcode/{barcode}", response_model=ProductRead)
-def get_by_barcode(barcode: str, session: Session = Depends(get_db)):
+def get_by_barcode(barcode: str, session: Session = Depends(get_session)):
     """Get product by barcode (for scanner)."""
     product = session.exec(select(Product).where(Product.barcode == barcode)).first()
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    return ORJSONResponse(_product_row(product))
 
 
 @router.get("/{product_id}", response_model=ProductRead)
-def get_product(product_id: int, session: Session = Depends(get_db)):
+def get_product(product_id: int, session: Session = Depends(get_session)):
     product = session.get(Product, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    return ORJSONResponse(_product_row(product))
 
 
 @router.post("", response_model=ProductRead, status_code=201)
-def create_product(data: ProductCreate, session: Session = Depends(get_db)):
+def create_product(data: ProductCreate, session: Session = Depends(get_session)):
     existing = session.exec(select(Product).where(Product.barcode == data.barcode)).first()
     if existing:
         raise HTTPException(status_code=400, detail="Barcode already exists")
@@ -150,13 +167,12 @@ def create_product(data: ProductCreate, session: Session = Depends(get_db)):
     product = Product(**data.model_dump())
     session.add(product)
     session.commit()
-    session.refresh(product)
-    return product
+    return ORJSONResponse(_product_row(product), status_code=201)
 
 
 @router.patch("/{product_id}", response_model=ProductRead)
 def update_product(
-    product_id: int, data: ProductUpdate, session: Session = Depends(get_db)
+    product_id: int, data: ProductUpdate, session: Session = Depends(get_session)
 ):
     product = session.get(Product, product_id)
     if not product:
@@ -174,12 +190,11 @@ def update_product(
         setattr(product, k, v)
     session.add(product)
     session.commit()
-    session.refresh(product)
-    return product
+    return ORJSONResponse(_product_row(product))
 
 
 @router.delete("/{product_id}", status_code=204)
-def delete_product(product_id: int, session: Session = Depends(get_db)):
+def delete_product(product_id: int, session: Session = Depends(get_session)):
     product = session.get(Product, product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
@@ -1,16 +1,24 @@
+import csv
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
 from io import StringIO, BytesIO
-from typing import Optional
+from typing import NamedTuple, Optional
 from fastapi import APIRouter, Query, Depends, HTTPException, Response
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from sqlmodel import Session, select, extract
-import pandas as pd
+from sqlalchemy import case, extract, literal_column
+from sqlmodel import Session, func, select
+import openpyxl
 
 from app.database import engine, get_session
 from app.models import Receipt, SaleItem, Product, Staff, Shift
 
 router = APIRouter(prefix="/reports", tags=["reports"])
+logger = logging.getLogger("dukapos.reports")
 
 
 class DailyRow(BaseModel):
@@ -39,7 +47,47 @@ def _parse_date(s: str) -> datetime:
 
 
 def _date_str(dt: datetime) -> str:
-    return dt.strftime("%Y-%m-%d")
+    return dt.date().isoformat()  # C fast path; strftime re-parses its format on every call
+
+
+def _type_total(*payment_types: str):
+    """SUM(total_amount) over receipts whose (upper-case) payment type is one of payment_types."""
+    return func.coalesce(
+        func.sum(case((Receipt.payment_type.in_(payment_types), Receipt.total_amount), else_=0.0)), 0.0
+    )
+
+
+# Reports over days that are already over barely change (late M-Pesa confirmations,
+# buying-price edits feeding profit), so repeat views and exports of them are served
+# from memory for a few minutes. Ranges reaching into today are always recomputed.
+_REPORT_TTL = 300.0
+_REPORT_CACHE_SIZE = 128
+_report_cache: "OrderedDict[tuple, tuple[float, BaseModel]]" = OrderedDict()
+_report_lock = threading.Lock()
+
+
+def _ended_before_today(end: datetime) -> bool:
+    today = datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+    return end.replace(tzinfo=None) <= today
+
+
+def _cached_report(key: tuple, closed: bool, build):
+    """Return build(), reusing a recent result for closed (past-only) ranges."""
+    if not closed:
+        return build()
+    now = time.monotonic()
+    with _report_lock:
+        hit = _report_cache.get(key)
+        if hit and now - hit[0] < _REPORT_TTL:
+            _report_cache.move_to_end(key)
+            return hit[1]
+    report = build()
+    with _report_lock:
+        _report_cache[key] = (now, report)
+        _report_cache.move_to_end(key)
+        while len(_report_cache) > _REPORT_CACHE_SIZE:
+            _report_cache.popitem(last=False)
+    return report
 
 
 @router.get("/sales", response_model=SalesReportResponse)
@@ -59,45 +107,47 @@ def get_sales_report(
     if end < start:
         start, end = end, start
     end = end.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return _cached_report(("sales", start, end), _ended_before_today(end), lambda: _query_sales_report(start, end))
+
 
+def _query_sales_report(start: datetime, end: datetime) -> SalesReportResponse:
     with Session(engine) as session:
-        receipts = session.exec(
-            select(Receipt).where(
-                Receipt.timestamp >= start,
-                Receipt.timestamp <= end,
-            )
+        in_range = (Receipt.timestamp >= start, Receipt.timestamp <= end)
+        day_col = func.date(Receipt.timestamp)
+        # Revenue, count and payment buckets per day in one grouped query; profit
+        # needs the item join, so it is a second query (joining items here would
+        # repeat each receipt's total once per line).
+        day_rows = session.exec(
+            select(
+                day_col,
+                func.sum(Receipt.total_amount),
+                func.count(),
+                _type_total("CASH"),
+                _type_total("MOBILE", "MPESA"),
+                _type_total("BANK"),
+                _type_total("CREDIT"),
+            ).where(*in_range).group_by(day_col)
         ).all()
+        profit_by_day = dict(session.exec(
+            select(day_col, func.sum((SaleItem.price_at_moment - func.coalesce(Product.price_buying, 0.0)) * SaleItem.quantity))
+            .select_from(SaleItem)
+            .join(Receipt, Receipt.id == SaleItem.receipt_id)
+            .join(Product, Product.id == SaleItem.product_id)
+            .where(*in_range)
+            .group_by(day_col)
+        ).all())
 
         by_day: dict[str, dict] = {}
         total_cash = 0.0
         total_mobile = 0.0
         total_bank = 0.0
         total_credit = 0.0
-
-        for r in receipts:
-            day = _date_str(r.timestamp)
-            if day not in by_day:
-                by_day[day] = {"revenue": 0.0, "profit": 0.0, "count": 0}
-            by_day[day]["revenue"] += r.total_amount
-            by_day[day]["count"] += 1
-
-            ptype = r.payment_type.upper()
-            if ptype == "CASH":
-                total_cash += r.total_amount
-            elif ptype in ["MOBILE", "MPESA"]:
-                total_mobile += r.total_amount
-            elif ptype == "BANK":
-                total_bank += r.total_amount
-            elif ptype == "CREDIT":
-                total_credit += r.total_amount
-
-            items = session.exec(
-                select(SaleItem).where(SaleItem.receipt_id == r.id)
-            ).all()
-            for it in items:
-                prod = session.get(Product, it.product_id)
-                if prod:
-                    by_day[day]["profit"] += (it.price_at_moment - (prod.price_buying or 0.0)) * it.quantity
+        for day, revenue, count, cash, mobile, bank, credit in day_rows:
+            by_day[day] = {"revenue": revenue, "profit": profit_by_day.get(day) or 0.0, "count": count}
+            total_cash += cash
+            total_mobile += mobile
+            total_bank += bank
+            total_credit += credit
 
         days_sorted = sorted(by_day.keys())
         by_day_list = [
@@ -121,6 +171,22 @@ def get_sales_report(
         )
 
 
+_XLSX_BATCH_ROWS = 1000
+
+
+def _xlsx_bytes(sheet_name: str, header: tuple, rows) -> bytes:
+    """One-sheet .xlsx of header + rows from openpyxl's write-only workbook, which
+    streams rows into the file instead of keeping every cell in memory."""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name)
+    ws.append(header)
+    for row in rows:
+        ws.append(tuple(row))
+    output = BytesIO()
+    wb.save(output)
+    return output.getvalue()
+
+
 @router.get("/export/xlsx")
 @router.get("/export/excel")
 def export_sales_excel(
@@ -128,7 +194,7 @@ def export_sales_excel(
     end_date: str = Query(..., description="YYYY-MM-DD"),
     session: Session = Depends(get_session)
 ):
-    """Export sales report as Excel using pandas."""
+    """Export sales report as Excel."""
     try:
         start = _parse_date(start_date)
         end = _parse_date(end_date)
@@ -138,46 +204,24 @@ def export_sales_excel(
 
     end = end.replace(hour=23, minute=59, second=59)
 
-    import logging
-    logger = logging.getLogger("dukapos.reports")
     logger.info(f"EXPORT EXCEL: requested for {start_date} to {end_date}")
-    try:
-        receipts = session.exec(
-            select(Receipt).where(Receipt.timestamp >= start, Receipt.timestamp <= end)
-        ).all()
-        logger.info(f"EXPORT EXCEL: found {len(receipts)} receipts")
-    except Exception as e:
-        logger.error(f"EXPORT EXCEL query failed: {str(e)}")
-        raise
-
-    data = []
-    for r in receipts:
-        data.append({
-            "Receipt ID": r.receipt_id,
-            "Timestamp": r.timestamp,
-            "Total Amount": r.total_amount,
-            "Payment Type": r.payment_type,
-            "Subtype": r.payment_subtype or "",
-            "Ref Code": r.reference_code or "",
-            "Station": r.origin_station,
-            "Status": r.payment_status
-        })
+    receipts = session.exec(
+        select(
+            Receipt.receipt_id, Receipt.timestamp, Receipt.total_amount, Receipt.payment_type,
+            func.coalesce(Receipt.payment_subtype, ""), func.coalesce(Receipt.reference_code, ""),
+            Receipt.origin_station, Receipt.payment_status,
+        ).where(Receipt.timestamp >= start, Receipt.timestamp <= end)
+        .execution_options(yield_per=_XLSX_BATCH_ROWS)
+    )
+    content = _xlsx_bytes(
+        "Sales",
+        ("Receipt ID", "Timestamp", "Total Amount", "Payment Type", "Subtype", "Ref Code", "Station", "Status"),
+        receipts,
+    )
 
-    logger.info(f"EXPORT EXCEL: writing {len(data)} rows to dataframe")
-    df = pd.DataFrame(data)
-    output = BytesIO()
-    try:
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Sales')
-        logger.info("EXPORT EXCEL: xlsx written to buffer")
-    except Exception as e:
-        logger.error(f"EXPORT EXCEL writing failed: {str(e)}")
-        raise
-
-    output.seek(0)
     filename = f"sales_report_{start_date}_to_{end_date}.xlsx"
     return Response(
-        content=output.getvalue(),
+        content=content,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
@@ -192,14 +236,16 @@ def export_sales_csv(
     """Export sales report as CSV."""
     report = get_sales_report(start_date=start_date, end_date=end_date)
     buf = StringIO()
-    buf.write("date,revenue,profit,transaction_count\n")
-    for row in report.by_day:
-        buf.write(f"{row.date},{row.revenue},{row.profit},{row.transaction_count}\n")
+    writer = _csv_writer(buf)
+    writer.writerow(("date", "revenue", "profit", "transaction_count"))
+    writer.writerows((row.date, row.revenue, row.profit, row.transaction_count) for row in report.by_day)
     buf.write("\n")
-    buf.write("payment_type,amount\n")
-    buf.write(f"cash,{report.by_payment_type.cash}\n")
-    buf.write(f"mobile,{report.by_payment_type.mobile}\n")
-    buf.write(f"credit,{report.by_payment_type.credit}\n")
+    writer.writerow(("payment_type", "amount"))
+    writer.writerows((
+        ("cash", report.by_payment_type.cash),
+        ("mobile", report.by_payment_type.mobile),
+        ("credit", report.by_payment_type.credit),
+    ))
     return PlainTextResponse(
         buf.getvalue(),
         media_type="text/csv",
@@ -212,43 +258,65 @@ def export_sales_csv(
 @router.get("/inventory/export/xlsx")
 def export_inventory_excel(session: Session = Depends(get_session)):
     """Export current inventory as Excel."""
-    products = session.exec(select(Product)).all()
-    data = []
-    for p in products:
-        data.append({
-            "ID": p.id,
-            "Name": p.name,
-            "Barcode": p.barcode,
-            "Description": p.description or "",
-            "Buying Price": p.price_buying,
-            "Selling Price": p.price_selling,
-            "Wholesale": p.wholesale_price or 0,
-            "Stock": p.stock_quantity,
-            "Min Alert": p.min_stock_alert,
-        })
-    df = pd.DataFrame(data)
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Inventory')
-    output.seek(0)
+    products = session.exec(
+        select(
+            Product.id, Product.name, Product.barcode, func.coalesce(Product.description, ""),
+            Product.price_buying, Product.price_selling, func.coalesce(Product.wholesale_price, 0),
+            Product.stock_quantity, Product.min_stock_alert,
+        ).execution_options(yield_per=_XLSX_BATCH_ROWS)
+    )
+    content = _xlsx_bytes(
+        "Inventory",
+        ("ID", "Name", "Barcode", "Description", "Buying Price", "Selling Price", "Wholesale", "Stock", "Min Alert"),
+        products,
+    )
     return Response(
-        content=output.getvalue(),
+        content=content,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers={"Content-Disposition": "attachment; filename=dukapos_inventory_export.xlsx"}
     )
 
 
+_CSV_CHUNK_ROWS = 1000
+
+
+def _csv_writer(buf):
+    """csv.writer with the exports' LF line endings; quotes fields with commas, quotes or newlines."""
+    return csv.writer(buf, lineterminator="\n")
+
+
+def _csv_chunks(rows):
+    """Format rows as CSV text, yielded in blocks of lines for a StreamingResponse."""
+    buf = StringIO()
+    writer = _csv_writer(buf)
+    for n, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if n % _CSV_CHUNK_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
 @router.get("/inventory/export/csv", response_class=PlainTextResponse)
-def export_inventory_csv(session: Session = Depends(get_session)):
+def export_inventory_csv():
     """Export current inventory as CSV."""
-    products = session.exec(select(Product)).all()
-    buf = StringIO()
-    buf.write("id,name,barcode,price_buying,price_selling,stock_quantity,min_stock_alert\n")
-    for p in products:
-        name = f'"{p.name}"' if "," in p.name else p.name
-        buf.write(f"{p.id},{name},{p.barcode},{p.price_buying},{p.price_selling},{p.stock_quantity},{p.min_stock_alert}\n")
-    return PlainTextResponse(
-        buf.getvalue(),
+    def rows():
+        yield "id,name,barcode,price_buying,price_selling,stock_quantity,min_stock_alert\n"
+        # Own session: the response body is produced after the request's dependencies close.
+        # yield_per keeps only one batch of products in memory at a time.
+        with Session(engine) as session:
+            products = session.exec(
+                select(
+                    Product.id, Product.name, Product.barcode, Product.price_buying,
+                    Product.price_selling, Product.stock_quantity, Product.min_stock_alert,
+                ).order_by(Product.id).execution_options(yield_per=_CSV_CHUNK_ROWS)
+            )
+            yield from _csv_chunks(products)
+
+    return StreamingResponse(
+        rows(),
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=dukapos_inventory_export.csv"}
     )
@@ -294,92 +362,128 @@ class DetailedSalesResponse(BaseModel):
     items: list[SoldItemDetail]
 
 
+class _DetailedSales(NamedTuple):
+    """DetailedSalesResponse as built internally: items are SoldItemDetail-shaped dicts,
+    so a month of lines skips per-row model validation and goes straight to orjson."""
+    period: str
+    date: str
+    summary: DetailedSalesSummary
+    items: list[dict]
+
+
 @router.get("/detailed-sales", response_model=DetailedSalesResponse)
 def get_detailed_sales(
     period: str = Query("daily", description="'daily' or 'monthly'"),
     date: str = Query(..., description="YYYY-MM-DD or YYYY-MM"),
 ):
     """Detailed itemized sales report."""
+    # Plain data straight to orjson; returning a model would make FastAPI re-validate
+    # every SoldItemDetail against response_model before encoding.
+    report = _build_detailed_sales(period, date)
+    return ORJSONResponse({
+        "period": report.period,
+        "date": report.date,
+        "summary": report.summary.model_dump(),
+        "items": report.items,
+    })
+
+
+def _detailed_range(period: str, date: str) -> tuple[datetime, datetime, str]:
+    """[start, end) of the requested day or month, and its label."""
+    if period == "monthly":
+        try:
+            month_start = datetime(int(date[:4]), int(date[5:7]), 1)
+        except Exception:
+            month_start = datetime.now(timezone.utc).replace(tzinfo=None, day=1)
+        month_start = month_start.replace(hour=0, minute=0, second=0, microsecond=0)
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        return month_start, next_month, month_start.strftime("%Y-%m")
+
+    try:
+        day = datetime.strptime(date[:10], "%Y-%m-%d")
+    except Exception:
+        day = datetime.now(timezone.utc).replace(tzinfo=None)
+    day = day.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day, day + timedelta(days=1), _date_str(day)
+
+
+def _build_detailed_sales(period: str, date: str) -> _DetailedSales:
+    start, end, date_label = _detailed_range(period, date)
+    return _cached_report(
+        ("detailed", period, start, end),
+        _ended_before_today(end),
+        lambda: _query_detailed_sales(period, start, end, date_label),
+    )
+
+
+def _query_detailed_sales(period: str, start: datetime, end: datetime, date_label: str) -> _DetailedSales:
     with Session(engine) as session:
-        if period == "monthly":
-            try:
-                year = int(date[:4])
-                month = int(date[5:7])
-            except Exception:
-                now = datetime.now(timezone.utc)
-                year, month = now.year, now.month
-
-            receipts = session.exec(
-                select(Receipt).where(
-                    extract("year", Receipt.timestamp) == year,
-                    extract("month", Receipt.timestamp) == month,
-                    Receipt.payment_status == "COMPLETED",
-                ).order_by(Receipt.timestamp)
-            ).all()
-            date_label = f"{year}-{month:02d}"
-        else:
-            try:
-                selected_date = datetime.strptime(date[:10], "%Y-%m-%d")
-            except Exception:
-                selected_date = datetime.now(timezone.utc)
-
-            start_day = selected_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_day = selected_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-            receipts = session.exec(
-                select(Receipt).where(
-                    Receipt.timestamp >= start_day,
-                    Receipt.timestamp <= end_day,
-                    Receipt.payment_status == "COMPLETED",
-                ).order_by(Receipt.timestamp)
-            ).all()
-            date_label = selected_date.strftime("%Y-%m-%d")
+        # A plain range (not extract(year/month)) on COMPLETED receipts, with the status
+        # inlined as a literal so SQLite can prove the partial ix_receipt_completed_ts applies.
+        receipt_filter = (
+            Receipt.payment_status == literal_column("'COMPLETED'"),
+            Receipt.timestamp >= start,
+            Receipt.timestamp < end,
+        )
+
+        # Payment buckets and the receipt count are one aggregate row from SQL
+        tx_count, total_cash, total_mobile, total_bank, total_credit = session.exec(
+            select(
+                func.count(),
+                _type_total("CASH"),
+                _type_total("MOBILE", "MPESA"),
+                _type_total("BANK"),
+                _type_total("CREDIT"),
+            ).where(*receipt_filter)
+        ).one()
+
+        # Every line with its receipt columns and product name in one joined query,
+        # in receipt time order, instead of a SELECT per receipt plus a Product lookup per line.
+        lines = session.exec(
+            select(
+                Receipt.id, Receipt.receipt_id, Receipt.timestamp, Receipt.payment_type,
+                Receipt.bank_name, Receipt.reference_code,
+                SaleItem.product_id, SaleItem.quantity, SaleItem.price_at_moment, Product.name,
+            )
+            .select_from(SaleItem)
+            .join(Receipt, Receipt.id == SaleItem.receipt_id)
+            .outerjoin(Product, Product.id == SaleItem.product_id)
+            .where(*receipt_filter)
+            .order_by(Receipt.timestamp, Receipt.id, SaleItem.id)
+        ).all()
 
-        total_cash = 0.0
-        total_mobile = 0.0
-        total_bank = 0.0
-        total_credit = 0.0
         total_items_sold = 0
-        items_list: list[SoldItemDetail] = []
-
-        for r in receipts:
-            ptype = r.payment_type.upper()
-            if ptype == "CASH":
-                total_cash += r.total_amount
-            elif ptype in ["MOBILE", "MPESA"]:
-                total_mobile += r.total_amount
-            elif ptype == "BANK":
-                total_bank += r.total_amount
-            elif ptype == "CREDIT":
-                total_credit += r.total_amount
-
-            sale_items = session.exec(
-                select(SaleItem).where(SaleItem.receipt_id == r.id)
-            ).all()
-
-            for it in sale_items:
-                product = session.get(Product, it.product_id)
-                item_name = product.name if product else f"Product #{it.product_id}"
-                total_items_sold += it.quantity
-
-                items_list.append(SoldItemDetail(
-                    timestamp=r.timestamp.isoformat() + "Z",
-                    date=r.timestamp.strftime("%Y-%m-%d"),
-                    time=r.timestamp.strftime("%H:%M:%S"),
-                    item_name=item_name,
-                    quantity=it.quantity,
-                    unit_price=round(it.price_at_moment, 2),
-                    total_price=round(it.price_at_moment * it.quantity, 2),
-                    payment_type=ptype,
-                    bank_name=r.bank_name,
-                    reference_code=r.reference_code,
-                    receipt_id=r.receipt_id,
-                    db_id=r.id or 0,
-                ))
+        items_list: list[dict] = []
+        last_ts = None
+        for (db_id, receipt_code, ts, ptype, bank_name, reference_code,
+             product_id, quantity, price_at_moment, product_name) in lines:
+            item_name = product_name if product_name is not None else f"Product #{product_id}"
+            total_items_sold += quantity
+            if ts != last_ts:
+                # Lines arrive grouped by receipt: format its timestamp once, and take the
+                # date and time as slices of isoformat() rather than two strftime calls.
+                last_ts = ts
+                iso = ts.isoformat()
+                ts_z, day, clock = iso + "Z", iso[:10], iso[11:19]
+
+            items_list.append({  # SoldItemDetail fields, in order
+                "timestamp": ts_z,
+                "date": day,
+                "time": clock,
+                "item_name": item_name,
+                "quantity": quantity,
+                "unit_price": round(price_at_moment, 2),
+                "total_price": round(price_at_moment * quantity, 2),
+                "payment_type": ptype,
+                "bank_name": bank_name,
+                "reference_code": reference_code,
+                "receipt_id": receipt_code,
+                "db_id": db_id or 0,
+            })
 
         total_revenue = total_cash + total_mobile + total_bank + total_credit
 
-        return DetailedSalesResponse(
+        return _DetailedSales(
             period=period,
             date=date_label,
             summary=DetailedSalesSummary(
@@ -389,7 +493,7 @@ def get_detailed_sales(
                 total_bank=round(total_bank, 2),
                 total_credit=round(total_credit, 2),
                 total_items_sold=total_items_sold,
-                transaction_count=len(receipts),
+                transaction_count=tx_count,
             ),
             items=items_list,
         )
@@ -401,27 +505,27 @@ def export_detailed_sales_csv(
     date: str = Query(..., description="YYYY-MM-DD for daily, YYYY-MM for monthly"),
 ):
     """Export detailed itemized sales report as CSV."""
-    report = get_detailed_sales(period=period, date=date)
-    buf = StringIO()
-
-    buf.write(f"# Detailed Sales Report - {report.period.title()}: {report.date}\n")
-    buf.write(f"# Total Revenue: {report.summary.total_revenue}\n")
-    buf.write(f"# Cash: {report.summary.total_cash}, Mobile: {report.summary.total_mobile}, Bank: {report.summary.total_bank}, Credit: {report.summary.total_credit}\n")
-    buf.write(f"# Total Items Sold: {report.summary.total_items_sold}, Transactions: {report.summary.transaction_count}\n")
-    buf.write("\n")
-
-    buf.write("Date,Time,Item Name,Quantity,Unit Price,Total Price,Payment Type,Receipt ID,DB ID\n")
-
-    for item in report.items:
-        escaped_name = f'"{item.item_name}"' if "," in item.item_name else item.item_name
-        buf.write(
-            f"{item.date},{item.time},{escaped_name},{item.quantity},"
-            f"{item.unit_price},{item.total_price},{item.payment_type},{item.receipt_id},{item.db_id}\n"
+    report = _build_detailed_sales(period, date)
+
+    def rows():
+        yield (
+            f"# Detailed Sales Report - {report.period.title()}: {report.date}\n"
+            f"# Total Revenue: {report.summary.total_revenue}\n"
+            f"# Cash: {report.summary.total_cash}, Mobile: {report.summary.total_mobile}, Bank: {report.summary.total_bank}, Credit: {report.summary.total_credit}\n"
+            f"# Total Items Sold: {report.summary.total_items_sold}, Transactions: {report.summary.transaction_count}\n"
+            "\n"
+            "Date,Time,Item Name,Quantity,Unit Price,Total Price,Payment Type,Receipt ID,DB ID\n"
+        )
+        # Sent in blocks of lines so the client starts receiving before the whole file is formatted
+        yield from _csv_chunks(
+            (item["date"], item["time"], item["item_name"], item["quantity"], item["unit_price"],
+             item["total_price"], item["payment_type"], item["receipt_id"], item["db_id"])
+            for item in report.items
         )
 
     filename = f"dukapos_detailed_sales_{report.period}_{report.date.replace('-', '_')}.csv"
-    return PlainTextResponse(
-        buf.getvalue(),
+    return StreamingResponse(
+        rows(),
         media_type="text/csv",
         headers={
             "Content-Disposition": f"attachment; filename={filename}",
@@ -486,6 +590,19 @@ class StaffPerformanceResponse(BaseModel):
     items: list[CashierSaleItem]
 
 
+class _StaffPerformance(NamedTuple):
+    """StaffPerformanceResponse as built internally: shifts and items are ShiftSummary- and
+    CashierSaleItem-shaped dicts, so a long range of lines goes straight to orjson."""
+    staff_id: int
+    staff_name: str
+    period: str
+    start_date: str
+    end_date: str
+    summary: StaffPerformanceSummary
+    shifts: list[dict]
+    items: list[dict]
+
+
 @router.get("/staff-performance", response_model=StaffPerformanceResponse)
 def get_staff_performance(
     staff_id: int = Query(..., description="Staff ID"),
@@ -493,28 +610,67 @@ def get_staff_performance(
     end_date: str = Query(..., description="YYYY-MM-DD end date"),
 ):
     """Staff accountability and performance report."""
+    # Plain data straight to orjson, as in get_detailed_sales: no response_model re-validation
+    report = _build_staff_performance(staff_id, start_date, end_date)
+    return ORJSONResponse({**report._asdict(), "summary": report.summary.model_dump()})
+
+
+def _build_staff_performance(staff_id: int, start_date: str, end_date: str) -> _StaffPerformance:
+    try:
+        start = datetime.strptime(start_date[:10], "%Y-%m-%d")
+        end = datetime.strptime(end_date[:10], "%Y-%m-%d")
+    except Exception:
+        start = datetime.now(timezone.utc) - timedelta(days=7)
+        end = datetime.now(timezone.utc)
+
+    start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = end.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return _cached_report(
+        ("staff", staff_id, start, end),
+        _ended_before_today(end),
+        lambda: _query_staff_performance(staff_id, start, end),
+    )
+
+
+def _query_staff_performance(staff_id: int, start: datetime, end: datetime) -> _StaffPerformance:
     with Session(engine) as session:
         staff = session.get(Staff, staff_id)
         if not staff:
             raise HTTPException(status_code=404, detail="Staff not found")
 
-        try:
-            start = datetime.strptime(start_date[:10], "%Y-%m-%d")
-            end = datetime.strptime(end_date[:10], "%Y-%m-%d")
-        except Exception:
-            start = datetime.now(timezone.utc) - timedelta(days=7)
-            end = datetime.now(timezone.utc)
-
-        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
-        end = end.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-        receipts = session.exec(
-            select(Receipt).where(
-                Receipt.staff_id == staff_id,
-                Receipt.timestamp >= start,
-                Receipt.timestamp <= end,
-                Receipt.payment_status == "COMPLETED",
-            ).order_by(Receipt.timestamp)
+        in_range = (
+            Receipt.staff_id == staff_id,
+            Receipt.timestamp >= start,
+            Receipt.timestamp <= end,
+            Receipt.payment_status == "COMPLETED",
+        )
+        # Payment buckets per shift come back as a handful of grouped rows; the
+        # item lines are a single joined select of just the columns they show.
+        shift_rows = session.exec(
+            select(
+                Receipt.shift_id,
+                func.count(),
+                _type_total("CASH"),
+                _type_total("MOBILE", "MPESA"),
+                _type_total("BANK"),
+                _type_total("CREDIT"),
+            ).where(*in_range).group_by(Receipt.shift_id)
+        ).all()
+        lines = session.exec(
+            select(
+                Receipt.id,
+                Receipt.receipt_id,
+                Receipt.timestamp,
+                Receipt.payment_type,
+                SaleItem.product_id,
+                SaleItem.quantity,
+                SaleItem.price_at_moment,
+                Product.name,
+            )
+            .join(SaleItem, SaleItem.receipt_id == Receipt.id)
+            .outerjoin(Product, Product.id == SaleItem.product_id)
+            .where(*in_range)
+            .order_by(Receipt.timestamp, Receipt.id, SaleItem.id)
         ).all()
 
         shifts = session.exec(
@@ -529,78 +685,71 @@ def get_staff_performance(
         total_mobile = 0.0
         total_bank = 0.0
         total_credit = 0.0
+        transaction_count = 0
         total_items_sold = 0
-        items_list: list[CashierSaleItem] = []
+        items_list: list[dict] = []
 
         shift_cash = {}
         shift_mobile = {}
         shift_credit = {}
         shift_tx_count = {}
 
-        for r in receipts:
-            amount = r.total_amount
-            sid = r.shift_id or 0
-            ptype = r.payment_type.upper()
-
-            if ptype == "CASH":
-                total_cash += amount
-                shift_cash[sid] = shift_cash.get(sid, 0) + amount
-            elif ptype in ["MOBILE", "MPESA"]:
-                total_mobile += amount
-                shift_mobile[sid] = shift_mobile.get(sid, 0) + amount
-            elif ptype == "BANK":
-                total_bank += amount
-                shift_mobile[sid] = shift_mobile.get(sid, 0) + amount  # Bank goes to mobile for shift tracking
-            elif ptype == "CREDIT":
-                total_credit += amount
-                shift_credit[sid] = shift_credit.get(sid, 0) + amount
-
-            shift_tx_count[sid] = shift_tx_count.get(sid, 0) + 1
-
-            sale_items = session.exec(
-                select(SaleItem).where(SaleItem.receipt_id == r.id)
-            ).all()
-
-            for it in sale_items:
-                product = session.get(Product, it.product_id)
-                it_name = product.name if product else f"Product #{it.product_id}"
-                total_items_sold += it.quantity
-
-                items_list.append(CashierSaleItem(
-                    timestamp=r.timestamp.isoformat() + "Z",
-                    date=r.timestamp.strftime("%Y-%m-%d"),
-                    time=r.timestamp.strftime("%H:%M:%S"),
-                    receipt_id=r.receipt_id,
-                    item_name=it_name,
-                    quantity=it.quantity,
-                    unit_price=round(it.price_at_moment, 2),
-                    total_price=round(it.price_at_moment * it.quantity, 2),
-                    payment_type=ptype,
-                    db_id=r.id or 0,
-                ))
+        for shift_id, count, cash, mobile, bank, credit in shift_rows:
+            sid = shift_id or 0
+            total_cash += cash
+            total_mobile += mobile
+            total_bank += bank
+            total_credit += credit
+            transaction_count += count
+            shift_cash[sid] = cash
+            shift_mobile[sid] = mobile + bank  # Bank goes to mobile for shift tracking
+            shift_credit[sid] = credit
+            shift_tx_count[sid] = count
+
+        last_ts = None
+        for rid, receipt_no, ts, ptype, product_id, quantity, price, product_name in lines:
+            total_items_sold += quantity
+            if ts != last_ts:
+                # Lines arrive grouped by receipt: format each receipt's timestamp once
+                last_ts = ts
+                iso = ts.isoformat()
+                ts_z, day, clock = iso + "Z", iso[:10], iso[11:19]
+            # Trusted, already-typed column values: skip per-line validation
+            items_list.append({
+                "timestamp": ts_z,
+                "date": day,
+                "time": clock,
+                "receipt_id": receipt_no,
+                "item_name": product_name if product_name is not None else f"Product #{product_id}",
+                "quantity": quantity,
+                "unit_price": round(price, 2),
+                "total_price": round(price * quantity, 2),
+                "payment_type": ptype,
+                "db_id": rid or 0,
+            })
 
         shift_summaries = []
         for s in shifts:
             sid = s.id or 0
-            cash_sales = shift_cash.get(sid, 0)
+            cash_sales = shift_cash.get(sid, 0.0)
             expected_cash = s.opening_float + cash_sales
 
-            shift_summaries.append(ShiftSummary(
-                shift_id=sid,
-                opened_at=s.opened_at.isoformat() + "Z",
-                closed_at=s.closed_at.isoformat() + "Z" if s.closed_at else None,
-                opening_float=s.opening_float,
-                expected_cash=round(expected_cash, 2),
-                total_cash_sales=round(cash_sales, 2),
-                total_mobile_sales=round(shift_mobile.get(sid, 0), 2),
-                total_credit_sales=round(shift_credit.get(sid, 0), 2),
-                transaction_count=shift_tx_count.get(sid, 0),
-            ))
+            shift_summaries.append({
+                "shift_id": sid,
+                "opened_at": s.opened_at.isoformat() + "Z",
+                "closed_at": s.closed_at.isoformat() + "Z" if s.closed_at else None,
+                "opening_float": s.opening_float,
+                "expected_cash": round(expected_cash, 2),
+                "total_cash_sales": round(cash_sales, 2),
+                "total_mobile_sales": round(shift_mobile.get(sid, 0.0), 2),
+                "total_credit_sales": round(shift_credit.get(sid, 0.0), 2),
+                "transaction_count": shift_tx_count.get(sid, 0),
+            })
 
         total_rev = total_cash + total_mobile + total_bank + total_credit
-        avg_tx = total_rev / len(receipts) if receipts else 0.0
+        avg_tx = total_rev / transaction_count if transaction_count else 0.0
 
-        return StaffPerformanceResponse(
+        return _StaffPerformance(
             staff_id=staff_id,
             staff_name=staff.username,
             period="custom",
@@ -615,7 +764,7 @@ def get_staff_performance(
                 total_bank=round(total_bank, 2),
                 total_credit=round(total_credit, 2),
                 total_items_sold=total_items_sold,
-                transaction_count=len(receipts),
+                transaction_count=transaction_count,
                 average_transaction=round(avg_tx, 2),
             ),
             shifts=shift_summaries,
@@ -630,34 +779,62 @@ def export_staff_performance_csv(
     end_date: str = Query(..., description="YYYY-MM-DD end date"),
 ):
     """Export staff performance report as CSV."""
-    report = get_staff_performance(staff_id=staff_id, start_date=start_date, end_date=end_date)
-    buf = StringIO()
-    buf.write(f"# Staff Performance: {report.staff_name}\n")
-    buf.write(f"# Sales: {report.summary.total_sales}, Cash: {report.summary.total_cash}, Mobile: {report.summary.total_mobile}, Bank: {report.summary.total_bank}\n\n")
+    report = _build_staff_performance(staff_id, start_date, end_date)
 
-    buf.write("# Shifts\n")
-    buf.write("Shift ID,Opened At,Closed At,Expected Cash,Transactions\n")
-    for s in report.shifts:
-        buf.write(f"{s.shift_id},{s.opened_at},{s.closed_at or 'Open'},{s.expected_cash},{s.transaction_count}\n")
-    buf.write("\n")
-
-    buf.write("# Items Sold\n")
-    buf.write("Date,Time,Receipt ID,Item,Qty,Price,Type\n")
-    for it in report.items:
-        buf.write(f"{it.date},{it.time},{it.receipt_id},{it.item_name},{it.quantity},{it.total_price},{it.payment_type}\n")
-
-    return PlainTextResponse(
-        buf.getvalue(),
+    def rows():
+        yield (
+            f"# Staff Performance: {report.staff_name}\n"
+            f"# Sales: {report.summary.total_sales}, Cash: {report.summary.total_cash}, Mobile: {report.summary.total_mobile}, Bank: {report.summary.total_bank}\n\n"
+            "# Shifts\n"
+        )
+        yield from _csv_chunks(itertools.chain(
+            [("Shift ID", "Opened At", "Closed At", "Expected Cash", "Transactions")],
+            ((s["shift_id"], s["opened_at"], s["closed_at"] or "Open", s["expected_cash"], s["transaction_count"])
+             for s in report.shifts),
+        ))
+        yield "\n# Items Sold\n"
+        yield from _csv_chunks(itertools.chain(
+            [("Date", "Time", "Receipt ID", "Item", "Qty", "Price", "Type")],
+            ((it["date"], it["time"], it["receipt_id"], it["item_name"], it["quantity"], it["total_price"],
+              it["payment_type"]) for it in report.items),
+        ))
+
+    return StreamingResponse(
+        rows(),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=staff_{staff_id}_report.csv"}
     )
 
 
+# Every report screen loads the staff dropdown; the list only changes through the
+# users router, which calls invalidate_staff_list() after each write.
+_STAFF_LIST_TTL = 60.0
+_staff_list_cache: dict[str, tuple[float, list[dict]]] = {}
+_staff_list_generation = 0
+
+
+def invalidate_staff_list() -> None:
+    """Forget the cached staff dropdown (call after committing a Staff change)."""
+    global _staff_list_generation
+    with _report_lock:
+        _staff_list_cache.clear()
+        _staff_list_generation += 1
+
+
 @router.get("/staff-list")
 def list_staff_names(session: Session = Depends(get_session)):
     """List staff for dropdowns."""
-    staff = session.exec(select(Staff).where(Staff.is_active)).all()
-    return [{"id": s.id, "username": s.username, "role": s.role} for s in staff]
+    with _report_lock:
+        hit = _staff_list_cache.get("active")
+        generation = _staff_list_generation
+    if hit and time.monotonic() - hit[0] < _STAFF_LIST_TTL:
+        return hit[1]
+    staff = session.exec(select(Staff.id, Staff.username, Staff.role).where(Staff.is_active)).all()
+    names = [{"id": sid, "username": username, "role": role} for sid, username, role in staff]
+    with _report_lock:
+        if generation == _staff_list_generation:
+            _staff_list_cache["active"] = (time.monotonic(), names)
+    return names
 
 
 # ── Advanced Reports ──────────────────────────────────────────────────────────
@@ -679,34 +856,35 @@ def top_products(
         end = datetime.now(timezone.utc)
     end = end.replace(hour=23, minute=59, second=59)
 
-    receipts = session.exec(
-        select(Receipt).where(
+    qty_sold = func.sum(SaleItem.quantity)
+    rows = session.exec(
+        select(
+            SaleItem.product_id,
+            Product.name,
+            qty_sold,
+            func.sum(SaleItem.price_at_moment * SaleItem.quantity),
+        )
+        .join(Receipt, Receipt.id == SaleItem.receipt_id)
+        .outerjoin(Product, Product.id == SaleItem.product_id)
+        .where(
             Receipt.timestamp >= start,
             Receipt.timestamp <= end,
             Receipt.payment_status == "COMPLETED",
             Receipt.is_return == False,  # noqa: E712
         )
+        .group_by(SaleItem.product_id)
+        .order_by(qty_sold.desc(), SaleItem.product_id)
+        .limit(limit)
     ).all()
-
-    product_qty: dict[int, int] = {}
-    product_rev: dict[int, float] = {}
-    for r in receipts:
-        items = session.exec(select(SaleItem).where(SaleItem.receipt_id == r.id)).all()
-        for it in items:
-            product_qty[it.product_id] = product_qty.get(it.product_id, 0) + it.quantity
-            product_rev[it.product_id] = product_rev.get(it.product_id, 0.0) + it.price_at_moment * it.quantity
-
-    sorted_ids = sorted(product_qty, key=lambda pid: product_qty[pid], reverse=True)[:limit]
-    result = []
-    for pid in sorted_ids:
-        prod = session.get(Product, pid)
-        result.append({
+    return [
+        {
             "product_id": pid,
-            "name": prod.name if prod else f"#{pid}",
-            "qty_sold": product_qty[pid],
-            "revenue": round(product_rev[pid], 2),
-        })
-    return result
+            "name": name if name is not None else f"#{pid}",
+            "qty_sold": qty,
+            "revenue": round(revenue, 2),
+        }
+        for pid, name, qty, revenue in rows
+    ]
 
 
 @router.get("/slow-movers")
@@ -718,19 +896,17 @@ def slow_movers(
     """Products with zero or low sales in the last N days."""
     cutoff = datetime.now(timezone.utc) - timedelta(days=days)
 
-    receipts = session.exec(
-        select(Receipt).where(
+    # Quantity sold per product_id in one grouped query, instead of a SaleItem select per receipt
+    sold_qtys: dict[int, int] = dict(session.exec(
+        select(SaleItem.product_id, func.sum(SaleItem.quantity))
+        .join(Receipt, Receipt.id == SaleItem.receipt_id)
+        .where(
             Receipt.timestamp >= cutoff,
             Receipt.payment_status == "COMPLETED",
             Receipt.is_return == False,  # noqa: E712
         )
-    ).all()
-
-    sold_qtys: dict[int, int] = {}
-    for r in receipts:
-        items = session.exec(select(SaleItem).where(SaleItem.receipt_id == r.id)).all()
-        for it in items:
-            sold_qtys[it.product_id] = sold_qtys.get(it.product_id, 0) + it.quantity
+        .group_by(SaleItem.product_id)
+    ).all())
 
     all_products = session.exec(select(Product)).all()
     movers = []
@@ -761,21 +937,24 @@ def hourly_heatmap(
         end = datetime.now(timezone.utc)
     end = end.replace(hour=23, minute=59, second=59)
 
-    receipts = session.exec(
-        select(Receipt).where(
+    # Bucketed by hour in SQL: 24 rows at most instead of every receipt in the range
+    hour_col = extract("hour", Receipt.timestamp)
+    hour_rows = session.exec(
+        select(hour_col, func.sum(Receipt.total_amount), func.count())
+        .where(
             Receipt.timestamp >= start,
             Receipt.timestamp <= end,
             Receipt.payment_status == "COMPLETED",
             Receipt.is_return == False,  # noqa: E712
         )
+        .group_by(hour_col)
     ).all()
 
     hour_totals: dict[int, float] = {h: 0.0 for h in range(24)}
     hour_counts: dict[int, int] = {h: 0 for h in range(24)}
-    for r in receipts:
-        h = r.timestamp.hour
-        hour_totals[h] += r.total_amount
-        hour_counts[h] += 1
+    for h, total, count in hour_rows:
+        hour_totals[h] = total
+        hour_counts[h] = count
 
     return [
         {
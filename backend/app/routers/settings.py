@@ -85,7 +85,7 @@ def get_store_settings():
 @router.put("/store", response_model=StoreSettingsRead)
 def update_store_settings(data: StoreSettingsUpdate):
     """Update store settings."""
-    with Session(engine) as session:
+    with Session(engine, expire_on_commit=False) as session:
         row = session.get(StoreSettings, STORE_SETTINGS_ID)
         if not row:
             row = StoreSettings(id=STORE_SETTINGS_ID)
@@ -123,7 +123,6 @@ def update_store_settings(data: StoreSettingsUpdate):
             row.vat_rate = data.vat_rate
         session.add(row)
         session.commit()
-        session.refresh(row)
         return StoreSettingsRead(
             shop_name=row.shop_name or "DukaPOS",
             station_id=row.station_id or "POS-01",
@@ -1,8 +1,10 @@
 """Shifts API: Open Shift, Close Shift, Z-Report."""
+from datetime import datetime
 from typing import Optional
 from fastapi import APIRouter, Body, HTTPException
 from pydantic import BaseModel
-from sqlmodel import Session, select
+from sqlalchemy import case
+from sqlmodel import Session, func, select
 
 from app.database import engine
 from app.models import Shift, Receipt, Staff
@@ -43,7 +45,7 @@ class ZReportResponse(BaseModel):
 def open_shift(data: Optional[ShiftOpenRequest] = Body(None)):
     """Open a new shift."""
     req = data if data is not None else ShiftOpenRequest()
-    with Session(engine) as session:
+    with Session(engine, expire_on_commit=False) as session:
         staff = session.get(Staff, req.staff_id)
         if not staff:
             raise HTTPException(status_code=400, detail="Invalid staff_id")
@@ -68,7 +70,6 @@ def open_shift(data: Optional[ShiftOpenRequest] = Body(None)):
         )
         session.add(shift)
         session.commit()
-        session.refresh(shift)
         return ShiftOpenResponse(
             id=shift.id,
             opened_at=shift.opened_at.isoformat(),
@@ -100,21 +101,16 @@ def get_current_shift(staff_id: int = 1):
 
 def _compute_shift_totals(session: Session, shift_id: int) -> dict:
     """Compute cash/mobile/credit totals."""
-    receipts = session.exec(
-        select(Receipt).where(Receipt.shift_id == shift_id)
-    ).all()
-    total_cash = 0.0
-    total_mobile = 0.0
-    total_credit = 0.0
-    for r in receipts:
-        amt = r.total_amount if not r.is_return else -r.total_amount
-        ptype = r.payment_type.upper()
-        if ptype == "CASH":
-            total_cash += amt
-        elif ptype in ["MOBILE", "MPESA"]:
-            total_mobile += amt
-        elif ptype == "CREDIT":
-            total_credit += amt
+    # Returns count negative; one aggregate row instead of loading every receipt of the shift
+    signed = case((Receipt.is_return, -Receipt.total_amount), else_=Receipt.total_amount)
+
+    def bucket(*payment_types: str):
+        return func.coalesce(func.sum(case((Receipt.payment_type.in_(payment_types), signed), else_=0.0)), 0.0)
+
+    total_cash, total_mobile, total_credit, transaction_count = session.exec(
+        select(bucket("CASH"), bucket("MOBILE", "MPESA"), bucket("CREDIT"), func.count())
+        .where(Receipt.shift_id == shift_id)
+    ).one()
 
     shift = session.get(Shift, shift_id)
     opening = shift.opening_float if shift else 0.0
@@ -125,7 +121,7 @@ def _compute_shift_totals(session: Session, shift_id: int) -> dict:
         "total_credit_sales": total_credit,
         "closing_expected": closing_expected,
         "opening_float": opening,
-        "transaction_count": len(receipts),
+        "transaction_count": transaction_count,
     }
 
 
@@ -154,7 +150,7 @@ def get_z_report(shift_id: int):
 @router.post("/{shift_id}/close")
 def close_shift(shift_id: int, data: ShiftCloseRequest):
     """Close shift and return final Z-Report data."""
-    with Session(engine) as session:
+    with Session(engine, expire_on_commit=False) as session:
         shift = session.get(Shift, shift_id)
         if not shift:
             raise HTTPException(status_code=404, detail="Shift not found")
@@ -163,11 +159,9 @@ def close_shift(shift_id: int, data: ShiftCloseRequest):
         totals = _compute_shift_totals(session, shift_id)
         shift.closing_actual = data.closing_actual
         shift.closing_expected = totals["closing_expected"]
-        from datetime import datetime
         shift.closed_at = datetime.utcnow()
         session.add(shift)
         session.commit()
-        session.refresh(shift)
         return {
             "status": "closed",
             "shift_id": shift_id,
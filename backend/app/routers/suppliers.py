@@ -5,17 +5,12 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from sqlmodel import Session, select
 
-from app.database import engine
+from app.database import get_session
 from app.models import Supplier, PurchaseOrder, PurchaseOrderItem, Product, StockAdjustment
 
 router = APIRouter(prefix="/suppliers", tags=["suppliers"])
 
 
-def get_db():
-    with Session(engine) as session:
-        yield session
-
-
 # ── Supplier schemas ──────────────────────────────────────────────────────────
 
 class SupplierCreate(BaseModel):
@@ -85,16 +80,15 @@ class PORead(BaseModel):
 # ── Supplier endpoints ────────────────────────────────────────────────────────
 
 @router.get("", response_model=List[SupplierRead])
-def list_suppliers(session: Session = Depends(get_db)):
+def list_suppliers(session: Session = Depends(get_session)):
     return session.exec(select(Supplier)).all()
 
 
 @router.post("", response_model=SupplierRead, status_code=201)
-def create_supplier(data: SupplierCreate, session: Session = Depends(get_db)):
+def create_supplier(data: SupplierCreate, session: Session = Depends(get_session)):
     supplier = Supplier(**data.model_dump())
     session.add(supplier)
     session.commit()
-    session.refresh(supplier)
     return supplier
 
 
@@ -102,7 +96,7 @@ def create_supplier(data: SupplierCreate, session: Session = Depends(get_db)):
 def update_supplier(
     supplier_id: int,
     data: SupplierUpdate,
-    session: Session = Depends(get_db),
+    session: Session = Depends(get_session),
 ):
     supplier = session.get(Supplier, supplier_id)
     if not supplier:
@@ -111,12 +105,11 @@ def update_supplier(
         setattr(supplier, k, v)
     session.add(supplier)
     session.commit()
-    session.refresh(supplier)
     return supplier
 
 
 @router.delete("/{supplier_id}", status_code=204)
-def delete_supplier(supplier_id: int, session: Session = Depends(get_db)):
+def delete_supplier(supplier_id: int, session: Session = Depends(get_session)):
     supplier = session.get(Supplier, supplier_id)
     if not supplier:
         raise HTTPException(status_code=404, detail="Supplier not found")
@@ -144,7 +137,7 @@ def _po_to_read(po: PurchaseOrder, session: Session) -> PORead:
 
 
 @router.get("/{supplier_id}/purchase-orders", response_model=List[PORead])
-def list_pos(supplier_id: int, session: Session = Depends(get_db)):
+def list_pos(supplier_id: int, session: Session = Depends(get_session)):
     """List purchase orders for a supplier."""
     if not session.get(Supplier, supplier_id):
         raise HTTPException(status_code=404, detail="Supplier not found")
@@ -159,17 +152,20 @@ def list_pos(supplier_id: int, session: Session = Depends(get_db)):
 def create_po(
     supplier_id: int,
     data: POCreate,
-    session: Session = Depends(get_db),
+    session: Session = Depends(get_session),
 ):
     """Create a purchase order for a supplier."""
     if not session.get(Supplier, supplier_id):
         raise HTTPException(status_code=404, detail="Supplier not found")
+    known_ids = set(session.exec(
+        select(Product.id).where(Product.id.in_({it.product_id for it in data.items}))
+    ).all())
     for it in data.items:
         if it.qty_ordered <= 0:
             raise HTTPException(status_code=400, detail=f"qty_ordered must be positive (got {it.qty_ordered})")
         if it.unit_cost < 0:
             raise HTTPException(status_code=400, detail=f"unit_cost cannot be negative (got {it.unit_cost})")
-        if not session.get(Product, it.product_id):
+        if it.product_id not in known_ids:
             raise HTTPException(status_code=404, detail=f"Product {it.product_id} not found")
     total = sum(it.qty_ordered * it.unit_cost for it in data.items)
     po = PurchaseOrder(
@@ -191,12 +187,11 @@ def create_po(
             unit_cost=it.unit_cost,
         ))
     session.commit()
-    session.refresh(po)
     return _po_to_read(po, session)
 
 
 @router.put("/purchase-orders/{po_id}/receive", response_model=PORead)
-def receive_po(po_id: int, staff_id: Optional[int] = None, session: Session = Depends(get_db)):
+def receive_po(po_id: int, staff_id: Optional[int] = None, session: Session = Depends(get_session)):
     """
     Mark a purchase order as received:
     - Sets status to 'received'
@@ -212,9 +207,13 @@ def receive_po(po_id: int, staff_id: Optional[int] = None, session: Session = De
     items = session.exec(
         select(PurchaseOrderItem).where(PurchaseOrderItem.po_id == po_id)
     ).all()
+    products = {
+        p.id: p
+        for p in session.exec(select(Product).where(Product.id.in_({it.product_id for it in items}))).all()
+    }
 
     for it in items:
-        product = session.get(Product, it.product_id)
+        product = products.get(it.product_id)
         if product:
             product.stock_quantity += it.qty_ordered
             it.qty_received = it.qty_ordered
@@ -231,5 +230,4 @@ def receive_po(po_id: int, staff_id: Optional[int] = None, session: Session = De
     po.status = "received"
     session.add(po)
     session.commit()
-    session.refresh(po)
     return _po_to_read(po, session)
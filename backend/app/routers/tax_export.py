@@ -7,10 +7,11 @@ from typing import Any, Dict, List, Optional
 from fastapi import APIRouter, HTTPException, Query
 from app.config import config
 from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import selectinload
 from sqlmodel import Session, select
 
 from app.database import engine
-from app.models import Receipt, SaleItem, Customer, Product, StoreSettings
+from app.models import Receipt, SaleItem, Customer, StoreSettings
 
 router = APIRouter(prefix="/tax", tags=["tax"])
 
@@ -96,9 +97,11 @@ def build_vscu_payload_for_transaction(receipt_db_id: int) -> Dict[str, Any] | N
         vat_amount = round(total / 1.16 * 0.16, 2)
         items: List[Dict[str, Any]] = []
 
-        sale_items = session.exec(select(SaleItem).where(SaleItem.receipt_id == r.id)).all()
+        sale_items = session.exec(
+            select(SaleItem).where(SaleItem.receipt_id == r.id).options(selectinload(SaleItem.product))
+        ).all()
         for si in sale_items:
-            product = session.get(Product, si.product_id)
+            product = si.product
             name = product.name if product else f"Product {si.product_id}"
             line_total = si.price_at_moment * si.quantity
             items.append({
@@ -1,21 +1,25 @@
 """Transactions API: persist sale/return on payment complete."""
-import json
+import threading
 import traceback
-import urllib.request
 from datetime import datetime
 from typing import List, Optional
 
+import httpx
+import orjson
 from app.config import config
 from fastapi import APIRouter, HTTPException, BackgroundTasks
 from pydantic import BaseModel
 from sqlmodel import Session
 
 from app.database import engine, get_next_receipt_id
-from app.models import Receipt, SaleItem, Staff, Customer, Product
+from app.models import Receipt, SaleItem, Staff, Customer, Product, StoreSettings, PriceOverrideLog
+from sqlalchemy import update
 from sqlalchemy.orm import selectinload
 from sqlmodel import select
 from app.routers.tax_export import build_vscu_payload_for_transaction
+from app.routers.dashboard import bump_daily_summary, invalidate_summary_cache
 from app.websocket_manager import broadcast_sync, create_event, EventType
+from app.printer_service import run_in_printer_thread
 from pydantic import Field
 
 router = APIRouter(prefix="/transactions", tags=["transactions"])
@@ -117,6 +121,15 @@ class ReceiptRead(BaseModel):
         from_attributes = True
 
 
+def _add_to_balance(session: Session, customer_id: Optional[int], delta: float) -> None:
+    """Move a customer's credit balance by delta inside SQLite, so concurrent payments cannot be lost."""
+    session.execute(
+        update(Customer)
+        .where(Customer.id == customer_id)
+        .values(current_balance=Customer.current_balance + delta, version=Customer.version + 1)
+    )
+
+
 @router.get("")
 def list_transactions(
     skip: int = 0,
@@ -126,11 +139,8 @@ def list_transactions(
 ):
     """List past transactions with items."""
     try:
-        from sqlmodel import select
-        from sqlalchemy.orm import selectinload
-
         with Session(engine) as session:
-            stmt = select(Receipt).options(selectinload(Receipt.items)).order_by(Receipt.timestamp.desc()).offset(skip).limit(limit)
+            stmt = select(Receipt).options(selectinload(Receipt.items).selectinload(SaleItem.product)).order_by(Receipt.timestamp.desc()).offset(skip).limit(limit)
 
             if start_date:
                 try:
@@ -168,7 +178,7 @@ def list_transactions(
                 }
 
                 for it in r.items:
-                    product = session.get(Product, it.product_id)
+                    product = it.product
                     it_dict = {
                         "id": it.id,
                         "product_id": it.product_id,
@@ -259,7 +269,6 @@ def create_receipt(data: ReceiptCreate, background_tasks: BackgroundTasks):
                 raise HTTPException(status_code=500, detail=f"Database sequence error: {e}")
 
             # Fetch current business name for receipt snapshot
-            from app.models import StoreSettings
             settings = session.get(StoreSettings, 1)
             business_name = settings.shop_name if settings else "DukaPOS"
 
@@ -288,8 +297,7 @@ def create_receipt(data: ReceiptCreate, background_tasks: BackgroundTasks):
                     ),
                 )
                 session.add(receipt)
-                session.flush()
-                session.refresh(receipt)
+                session.flush()  # assigns receipt.id; flush does not expire loaded attributes
             except Exception as e:
                 logger.error(f"Failed to save Receipt: {e}")
                 session.rollback()
@@ -301,6 +309,7 @@ def create_receipt(data: ReceiptCreate, background_tasks: BackgroundTasks):
 
             # Collect (product_id, name, new_qty) for WebSocket broadcast after commit
             _stock_updates: list = []
+            profit = 0.0  # (price_at_moment - buying price) * qty, for the daily summary
 
             for idx, it in enumerate(data.items):
                 logger.info(f"Adding SaleItem [{idx + 1}/{len(data.items)}]: item={it.product_id}, qty={it.quantity}, receipt_id={receipt.id}")
@@ -326,6 +335,7 @@ def create_receipt(data: ReceiptCreate, background_tasks: BackgroundTasks):
                 )
                 # Stock adjustment
                 if product is not None:
+                    profit += (it.price_at_moment - product.price_buying) * it.quantity
                     product.stock_quantity = (product.stock_quantity or 0) - it.quantity
                     session.add(product)
                     _stock_updates.append((product.id, product.name, product.stock_quantity))
@@ -334,23 +344,17 @@ def create_receipt(data: ReceiptCreate, background_tasks: BackgroundTasks):
             # Handle account balance for credit payments
             if p_type == "CREDIT":
                 delta = data.total_amount if not data.is_return else -data.total_amount
-                customer = session.get(Customer, data.customer_id)
-                if customer:
-                    customer.current_balance += delta
-                    session.add(customer)
+                _add_to_balance(session, data.customer_id, delta)
 
             # SPLIT logic...
             if p_type == "SPLIT" and data.payment_details_json:
                 try:
-                    details = json.loads(data.payment_details_json)
+                    details = orjson.loads(data.payment_details_json)
                     for payment in details:
                         if payment.get("method") == "CREDIT" and data.customer_id:
                             amt = payment.get("amount", 0)
                             delta = amt if not data.is_return else -amt
-                            customer = session.get(Customer, data.customer_id)
-                            if customer:
-                                customer.current_balance += delta
-                                session.add(customer)
+                            _add_to_balance(session, data.customer_id, delta)
                 except Exception:
                     pass
 
@@ -364,9 +368,12 @@ def create_receipt(data: ReceiptCreate, background_tasks: BackgroundTasks):
                         customer.lifetime_points += points_earned
                         session.add(customer)
 
+            bump_daily_summary(session, receipt, profit)
+
             logger.info("Ready to commit transaction...")
             session.commit()
             logger.info("Transaction committed successfully.")
+            invalidate_summary_cache()
 
             # Broadcast inventory updates to all connected POS terminals
             for pid, pname, new_qty in _stock_updates:
@@ -395,18 +402,29 @@ def create_receipt(data: ReceiptCreate, background_tasks: BackgroundTasks):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Keep-alive client for KRA submissions: each sale posts to the same host, so reuse
+# one TLS connection. Created on first use; background tasks call it from threads.
+_kra_client: Optional[httpx.Client] = None
+_kra_client_lock = threading.Lock()
+
+
+def _get_kra_client() -> httpx.Client:
+    global _kra_client
+    if _kra_client is None:
+        with _kra_client_lock:
+            if _kra_client is None:
+                _kra_client = httpx.Client(timeout=10)
+    return _kra_client
+
+
 def _submit_kra_task(receipt_id: int, kra_url: str):
     """Background task to submit KRA transaction."""
     try:
         payload = build_vscu_payload_for_transaction(receipt_id)
         if payload is None:
             return
-        body = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(
-            kra_url, data=body,
-            headers={"Content-Type": "application/json"}, method="POST"
-        )
-        urllib.request.urlopen(req, timeout=10)
+        resp = _get_kra_client().post(kra_url, content=orjson.dumps(payload), headers={"Content-Type": "application/json"})
+        resp.raise_for_status()
     except Exception as e:
         logger.error(f"KRA submission error for receipt {receipt_id}: {e}")
 
@@ -419,29 +437,36 @@ def get_receipt_items(receipt_id: int):
         if not receipt:
             raise HTTPException(status_code=404, detail="Receipt not found")
 
-        items_db = session.exec(select(SaleItem).where(SaleItem.receipt_id == receipt.id)).all()
-        for i in items_db:
-            product = session.get(Product, i.product_id)
-            i.name = product.name if product else f"Item #{i.product_id}"
-        return items_db
+        items_db = session.exec(
+            select(SaleItem).where(SaleItem.receipt_id == receipt.id).options(selectinload(SaleItem.product))
+        ).all()
+        # Table models reject unknown attributes, so the name goes on the read model
+        return [
+            SaleItemRead(
+                id=i.id,
+                product_id=i.product_id,
+                quantity=i.quantity,
+                price_at_moment=i.price_at_moment,
+                name=i.product.name if i.product else f"Item #{i.product_id}",
+            )
+            for i in items_db
+        ]
 
 
 @router.post("/{receipt_id}/print")
 def print_past_receipt(receipt_id: int):
     """Reprint a past receipt."""
-    from app.models import StoreSettings
-    from sqlmodel import select
-    from app.printer_service import run_in_printer_thread
-
     with Session(engine) as session:
         receipt = session.get(Receipt, receipt_id)
         if not receipt:
             raise HTTPException(status_code=404, detail="Receipt not found")
 
-        items_db = session.exec(select(SaleItem).where(SaleItem.receipt_id == receipt.id)).all()
+        items_db = session.exec(
+            select(SaleItem).where(SaleItem.receipt_id == receipt.id).options(selectinload(SaleItem.product))
+        ).all()
         items = []
         for i in items_db:
-            product = session.get(Product, i.product_id)
+            product = i.product
             name = product.name if product else f"Item #{i.product_id}"
             items.append({"name": name, "qty": i.quantity, "price": i.price_at_moment})
 
@@ -457,7 +482,7 @@ def print_past_receipt(receipt_id: int):
         payments_list = []
         if receipt.payment_type == "SPLIT" and receipt.payment_details_json:
             try:
-                payments_list = json.loads(receipt.payment_details_json)
+                payments_list = orjson.loads(receipt.payment_details_json)
             except Exception:
                 pass
         else:
@@ -513,9 +538,6 @@ class PriceOverrideLogCreate(BaseModel):
 @router.post("/price-override-log", status_code=201)
 def log_price_override(data: PriceOverrideLogCreate):
     """Record an admin-authorized price override for audit purposes."""
-    from app.models import PriceOverrideLog
-    from datetime import datetime
-
     ts = datetime.utcnow()
     if data.timestamp:
         try:
@@ -3,17 +3,22 @@ import time
 from collections import defaultdict
 from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlmodel import Session, select
+from sqlalchemy import bindparam
+from sqlmodel import Session, func, select
 from pydantic import BaseModel, Field
 import logging
 
 from app.database import get_session
 from app.models import Staff, StoreSettings
-from app.auth_utils import hash_password, verify_password, hash_pin, verify_pin
+from app.routers.reports import invalidate_staff_list
+from app.auth_utils import hash_password, verify_password, hash_pin, verify_pin, needs_rehash, pin_needs_rehash
 
 router = APIRouter(prefix="/staff", tags=["staff"])
 logger = logging.getLogger("dukapos.users")
 
+# Built once at import; each call only binds the username parameter.
+_STAFF_BY_USERNAME = select(Staff).where(Staff.username == bindparam("username"))
+
 # In-memory rate limiter: max 10 attempts per IP per 60 seconds
 _rate_buckets: dict[str, list[float]] = defaultdict(list)
 _RATE_LIMIT_MAX = 10
@@ -78,6 +83,15 @@ class VerifyAdminPinResponse(BaseModel):
     ok: bool = True
 
 
+def _upgrade_pin_hash(session: Session, staff: Staff, pin: str) -> None:
+    """Replace a legacy (bcrypt/argon2 or unpeppered) PIN hash with the peppered HMAC format
+    after a successful verify."""
+    if pin_needs_rehash(staff.pin_hash, pin):
+        staff.pin_hash = hash_pin(pin)
+        session.add(staff)
+        session.commit()
+
+
 def _to_response(u: Staff) -> StaffResponse:
     return StaffResponse(id=u.id or 0, username=u.username, role=u.role, is_active=u.is_active)
 
@@ -96,14 +110,14 @@ def create_staff(body: StaffCreate, session: Session = Depends(get_session)):
     settings = session.get(StoreSettings, 1)
     limit = getattr(settings, "staff_limit", 5) if settings else 5
 
-    current_count = session.exec(select(Staff).where(Staff.is_active)).all()
-    if len(current_count) >= limit:
+    current_count = session.exec(select(func.count()).select_from(Staff).where(Staff.is_active)).one()
+    if current_count >= limit:
         raise HTTPException(
             status_code=403,
             detail=f"Staff limit reached ({limit}). Disable inactive users or upgrade license."
         )
 
-    existing = session.exec(select(Staff).where(Staff.username == body.username)).first()
+    existing = session.exec(_STAFF_BY_USERNAME, params={"username": body.username}).first()
     if existing:
         raise HTTPException(status_code=400, detail="Username already exists")
     staff = Staff(
@@ -115,7 +129,7 @@ def create_staff(body: StaffCreate, session: Session = Depends(get_session)):
     )
     session.add(staff)
     session.commit()
-    session.refresh(staff)
+    invalidate_staff_list()
     return _to_response(staff)
 
 
@@ -133,7 +147,7 @@ def update_staff(staff_id: int, body: StaffUpdate, session: Session = Depends(ge
         staff.is_active = body.is_active
     session.add(staff)
     session.commit()
-    session.refresh(staff)
+    invalidate_staff_list()
     return _to_response(staff)
 
 
@@ -141,13 +155,18 @@ def update_staff(staff_id: int, body: StaffUpdate, session: Session = Depends(ge
 def login(body: LoginRequest, request: Request, session: Session = Depends(get_session)):
     """Login with username and password."""
     _check_rate_limit(request, "login")
-    staff = session.exec(select(Staff).where(Staff.username == body.username)).first()
+    staff = session.exec(_STAFF_BY_USERNAME, params={"username": body.username}).first()
     if not staff:
         raise HTTPException(status_code=401, detail="Invalid username or password")
     if not staff.is_active:
         raise HTTPException(status_code=401, detail="Staff is disabled")
     if not verify_password(body.password, staff.password_hash or ""):
         raise HTTPException(status_code=401, detail="Invalid username or password")
+    if needs_rehash(staff.password_hash):
+        # Upgrade legacy bcrypt hashes to the current scheme on successful login
+        staff.password_hash = hash_password(body.password)
+        session.add(staff)
+        session.commit()
     return LoginResponse(id=staff.id or 0, username=staff.username, role=staff.role, is_active=staff.is_active)
 
 
@@ -163,12 +182,14 @@ def verify_staff_pin(body: VerifyStaffPinRequest, request: Request, session: Ses
     # 1. Check if the specific staff member's PIN matches
     staff = session.get(Staff, body.staff_id)
     if staff and staff.is_active and verify_pin(body.pin, staff.pin_hash or ""):
+        _upgrade_pin_hash(session, staff, body.pin)
         return VerifyAdminPinResponse(ok=True)
 
     # 2. Bypass: Check if it's an admin or developer PIN
     admins = session.exec(select(Staff).where(Staff.role.in_(["admin", "developer"]), Staff.is_active)).all()
     for admin in admins:
         if verify_pin(body.pin, admin.pin_hash or ""):
+            _upgrade_pin_hash(session, admin, body.pin)
             return VerifyAdminPinResponse(ok=True)
 
     raise HTTPException(status_code=401, detail="Invalid PIN")
@@ -181,6 +202,7 @@ def verify_admin_pin(body: VerifyAdminPinRequest, request: Request, session: Ses
     admins = session.exec(select(Staff).where(Staff.role.in_(["admin", "developer"]), Staff.is_active)).all()
     for admin in admins:
         if verify_pin(body.pin, admin.pin_hash or ""):
+            _upgrade_pin_hash(session, admin, body.pin)
             return VerifyAdminPinResponse(ok=True)
     raise HTTPException(status_code=401, detail="Invalid admin PIN")
 
@@ -193,4 +215,5 @@ def delete_staff(staff_id: int, session: Session = Depends(get_session)):
         raise HTTPException(status_code=404, detail="Staff not found")
     session.delete(staff)
     session.commit()
+    invalidate_staff_list()
     return None
@@ -7,6 +7,7 @@ from datetime import datetime
 from typing import Dict, List, Any, Optional
 from fastapi import WebSocket
 import logging
+import orjson
 
 logger = logging.getLogger(__name__)
 
@@ -61,26 +62,27 @@ class ConnectionManager:
         Broadcast a message to all connected clients.
         Returns the number of clients that received the message.
         """
+        # Encode once for every client instead of send_json re-serializing per socket
+        return await self.broadcast_text(orjson.dumps(message).decode(), exclude)
+
+    async def broadcast_text(self, payload: str, exclude: Optional[str] = None) -> int:
+        """Send an already-encoded JSON text frame to all clients concurrently."""
         async with self._lock:
-            connections = list(self.active_connections.items())
+            connections = [(cid, ws) for cid, ws in self.active_connections.items() if cid != exclude]
 
-        sent_count = 0
-        disconnected = []
+        results = await asyncio.gather(
+            *(websocket.send_text(payload) for _, websocket in connections),
+            return_exceptions=True,
+        )
 
-        for client_id, websocket in connections:
-            if exclude and client_id == exclude:
-                continue
-            try:
-                await websocket.send_json(message)
+        sent_count = 0
+        for (client_id, _), result in zip(connections, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"Broadcast failed for {client_id}: {result}")
+                # Clean up disconnected clients
+                await self.disconnect(client_id)
+            else:
                 sent_count += 1
-            except Exception as e:
-                logger.warning(f"Broadcast failed for {client_id}: {e}")
-                disconnected.append(client_id)
-
-        # Clean up disconnected clients
-        for client_id in disconnected:
-            await self.disconnect(client_id)
-
         return sent_count
 
     def get_connection_count(self) -> int:
@@ -54,6 +54,10 @@ a = Analysis(
         'uvicorn.lifespan',
         'uvicorn.lifespan.on',
         'decouple',
+        'orjson',
+        'passlib.handlers.argon2',
+        'passlib.handlers.bcrypt',
+        'argon2',
         'multipart',
         'multipart.multipart',
         'pandas',
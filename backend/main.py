@@ -6,8 +6,10 @@ Or from repo root: python backend/main.py
 import sys
 import os
 
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 import logging
@@ -33,7 +35,12 @@ logging.basicConfig(
 logger = logging.getLogger("dukapos")
 logger.info("Backend logging started.")
 
-from app.database import create_db_and_tables  # noqa: E402
+if __name__ == "__main__":
+    # Launcher only: create the PIN pepper once, before app.auth_utils is imported (never per worker).
+    from app.config import ensure_pin_pepper
+    ensure_pin_pepper()
+
+from app.database import create_db_and_tables, schema_failed, schema_ready  # noqa: E402
 from app.auth_optional import OptionalAPIKeyMiddleware  # noqa: E402
 from app.routers import (  # noqa: E402
     products,
@@ -62,21 +69,45 @@ from app.routers import (  # noqa: E402
 is_production = getattr(sys, "frozen", False) or os.environ.get("DUKAPOS_PRODUCTION") == "1"
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    create_db_and_tables()
+def _prepare_database() -> None:
+    """Schema, migrations and seeds, then start the auto-backup thread."""
+    try:
+        create_db_and_tables()
+    except Exception:
+        logger.exception("Database initialisation failed")
+        schema_failed.set()  # /health and every request now answer 500 "failed"
+        return
     # Phase 2: auto-backup if newest backup is >24h old (runs in background)
     import threading
     from app.routers.system import run_backup_if_needed
     threading.Thread(target=run_backup_if_needed, daemon=True).start()
+    # Configure the printer here so its escpos import is not paid by the first receipt
+    from app.printer_service import get_printer
+    try:
+        get_printer()
+    except Exception:
+        logger.exception("Printer configuration failed")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Don't block startup on schema work: requests get 503 (and /health reports
+    # "starting") until create_db_and_tables() sets schema_ready, or 500 "failed"
+    # if it raised.
+    app.state.db_init_task = asyncio.create_task(asyncio.to_thread(_prepare_database))
     yield
     # shutdown: close printer etc. if needed
+    from app.mpesa_utils import aclose_client
+    await aclose_client()
 
 
 app = FastAPI(
     title="DukaPOS API",
     version="0.1.0",
     lifespan=lifespan,
+    # orjson renders the large list payloads (customers, products, receipts) several
+    # times faster than stdlib json.
+    default_response_class=ORJSONResponse,
     docs_url=None if is_production else "/docs",
     redoc_url=None if is_production else "/redoc",
     openapi_url=None if is_production else "/openapi.json",
@@ -116,7 +147,11 @@ app.include_router(suppliers.router)
 
 
 @app.get("/health")
-def health():
+async def health():  # no I/O: answer on the event loop instead of a threadpool hop
+    if not schema_ready.is_set():
+        if schema_failed.is_set():
+            return JSONResponse(status_code=500, content={"status": "failed"})
+        return JSONResponse(status_code=503, content={"status": "starting"})
     return {"status": "ok"}
 
 
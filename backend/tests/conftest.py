@@ -11,6 +11,8 @@ from sqlmodel import Session
 # Use a distinct name for testing to avoid conflicting with dev DB
 TEST_DB_NAME = "test_dukapos.db"
 os.environ["DATABASE_URL"] = f"sqlite:///{TEST_DB_NAME}"
+# Fixed pepper so importing auth_utils never generates one into the project .env
+os.environ.setdefault("PIN_PEPPER", "test-pin-pepper")
 
 from main import app
 from app.database import engine, create_db_and_tables
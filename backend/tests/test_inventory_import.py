@@ -226,3 +226,28 @@ def test_upload_optional_columns_have_defaults(client: TestClient):
         assert p.min_stock_alert == 5
         assert p.price_buying == 80.0  # defaults to price_selling
         assert p.wholesale_price is None
+
+
+def test_upload_out_of_range_numbers_skip_only_their_row(client: TestClient):
+    """Infinite or oversized numbers are per-row errors, not a 500 or a wrapped-around stock count."""
+    csv_content = (
+        b"name,barcode,price_selling,stock_quantity,wholesale_threshold\n"
+        b"Huge Stock,IMP-RNG-1,50.0,1e30,\n"
+        b"Inf Threshold,IMP-RNG-2,50.0,3,inf\n"
+        b"Overflow Threshold,IMP-RNG-3,50.0,3,1e400\n"
+        b"Fine Row,IMP-RNG-4,50.0,7,12\n"
+    )
+    r = client.post("/inventory/upload",
+        files={"file": ("range.csv", io.BytesIO(csv_content), "text/csv")})
+    assert r.status_code == 200, r.text[:300]
+    d = r.json()
+    assert d["created"] + d["updated"] == 2, d
+    skipped = [e for e in d["errors"] if "out of range" in e]
+    assert len(skipped) == 2, d["errors"]
+    assert "Current Stock" in skipped[0] and "Wholesale Threshold" in skipped[1]
+    assert not _product_exists("IMP-RNG-1") and not _product_exists("IMP-RNG-2")
+    with Session(engine) as s:
+        # 1e400 does not parse as a CSV number, so it is a "treated as missing" warning
+        assert s.exec(select(Product).where(Product.barcode == "IMP-RNG-3")).first().wholesale_threshold is None
+        p = s.exec(select(Product).where(Product.barcode == "IMP-RNG-4")).first()
+        assert (p.stock_quantity, p.wholesale_threshold) == (7, 12)
@@ -1,3 +1,6 @@
+import csv
+import io
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlmodel import Session, select
@@ -80,3 +83,578 @@ def test_staff_limit_enforcement(client: TestClient):
     response = client.post("/staff", json=payload)
     assert response.status_code == 403
     assert "limit reached" in response.json()["detail"].lower()
+
+
+def test_optional_api_key_middleware(monkeypatch):
+    """When API_KEY is set, non-public paths require X-API-Key or Bearer token."""
+    from fastapi import FastAPI
+    from app import auth_optional
+
+    monkeypatch.setattr(auth_optional, "get_optional_api_key", lambda: "s3cret")
+    mini = FastAPI()
+    mini.add_middleware(auth_optional.OptionalAPIKeyMiddleware)
+
+    @mini.get("/health")
+    def _health():
+        return {"status": "ok"}
+
+    @mini.get("/products")
+    def _products():
+        return []
+
+    c = TestClient(mini)
+    assert c.get("/health").status_code == 200
+    assert c.get("/health/").status_code != 401
+    assert c.get("/healthz").status_code == 401
+    assert auth_optional._path_is_public("/openapi.json")
+    assert auth_optional._path_is_public("/docs/oauth2-redirect")
+    denied = c.get("/products")
+    assert denied.status_code == 401
+    assert "invalid API key" in denied.json()["detail"]
+    assert c.get("/products", headers={"X-API-Key": "wrong"}).status_code == 401
+    assert c.get("/products", headers={"X-API-Key": "s3cret"}).status_code == 200
+    assert c.get("/products", headers={"Authorization": "Bearer s3cret"}).status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_async_hash_helpers_round_trip():
+    """Async hashing wrappers produce hashes the sync verifiers accept and vice versa."""
+    from app.auth_utils import hash_password_async, verify_password_async, verify_pin, hash_pin_async
+
+    hashed = await hash_password_async("s3cret-pass")
+    assert await verify_password_async("s3cret-pass", hashed)
+    assert not await verify_password_async("wrong", hashed)
+    assert verify_pin("4321", await hash_pin_async("4321"))
+
+
+def test_pin_hash_hmac_and_legacy_bcrypt():
+    """New PIN hashes are salted HMACs; legacy bcrypt PIN hashes still verify."""
+    import bcrypt
+    from app.auth_utils import hash_pin, verify_pin, pin_needs_rehash
+
+    h1, h2 = hash_pin("1234"), hash_pin("1234")
+    assert h1 != h2  # per-hash salt
+    assert verify_pin("1234", h1) and not verify_pin("4321", h1)
+    assert not pin_needs_rehash(h1)
+
+    legacy = bcrypt.hashpw(b"5678", bcrypt.gensalt(rounds=4)).decode("utf-8")
+    assert verify_pin("5678", legacy) and not verify_pin("0000", legacy)
+    assert pin_needs_rehash(legacy)
+    assert not verify_pin("1234", "not-a-hash")
+
+
+def test_pin_pepper_generated_by_launcher_and_unpeppered_hashes_upgraded(tmp_path, monkeypatch):
+    """Only the launcher writes PIN_PEPPER to .env; auth_utils refuses to run without one."""
+    from app import auth_utils, config as app_config
+
+    env_file = tmp_path / ".env"
+    monkeypatch.setattr(app_config, "ENV_FILE", env_file)
+    monkeypatch.setenv("PIN_PEPPER", "")
+    app_config.config.cache_clear()
+    try:
+        with pytest.raises(RuntimeError, match="PIN_PEPPER"):
+            auth_utils._load_pin_pepper()
+        assert not env_file.exists()
+        app_config.ensure_pin_pepper()
+        pepper = auth_utils._load_pin_pepper()
+        assert len(pepper) == 64 and env_file.read_text().strip() == f"PIN_PEPPER={pepper.decode()}"
+        app_config.ensure_pin_pepper()  # already set: .env is left alone
+        assert env_file.read_text().strip() == f"PIN_PEPPER={pepper.decode()}"
+    finally:
+        app_config.config.cache_clear()
+
+    salt = bytes(16)
+    unpeppered = f"{salt.hex()}:{auth_utils._pin_digest('2468', salt, b'')}"
+    assert auth_utils.verify_pin("2468", unpeppered) and not auth_utils.verify_pin("1357", unpeppered)
+    assert auth_utils.pin_needs_rehash(unpeppered, "2468")
+    assert not auth_utils.pin_needs_rehash(auth_utils.hash_pin("2468"), "2468")
+
+
+def test_seeded_default_credentials_still_work(client: TestClient):
+    """Pre-hashed seed passwords must match the documented default credentials."""
+    from app.auth_utils import verify_password
+    from app.database import _ADMIN_BOOTSTRAP_HASH, _SAMPLE_STAFF
+
+    assert verify_password("admin123", _ADMIN_BOOTSTRAP_HASH)
+    plain = {"cashier": "cashier123", "jane": "jane123"}
+    for sample in _SAMPLE_STAFF:
+        assert verify_password(plain[sample["username"]], sample["password_hash"])
+
+
+def test_requests_get_503_until_schema_ready(client: TestClient):
+    """While startup schema work is pending, only /health answers (with 503 'starting')."""
+    from app.database import schema_ready
+
+    schema_ready.clear()
+    try:
+        health = client.get("/health")
+        assert health.status_code == 503
+        assert health.json()["status"] == "starting"
+        pending = client.get("/products")
+        assert pending.status_code == 503
+        assert pending.headers["retry-after"] == "1"
+    finally:
+        schema_ready.set()
+    assert client.get("/health").json() == {"status": "ok"}
+
+
+def test_customer_search_substring_and_sync(client: TestClient):
+    """Customer search matches substrings of name/phone and follows renames and deletes."""
+    created = client.post("/customers", json={"name": "Wanjiku Kamau", "phone": "0712345987"}).json()
+    cid = created["id"]
+
+    def ids(q):
+        return {c["id"] for c in client.get("/customers", params={"q": q}).json()}
+
+    assert cid in ids("anjik")      # trigram path
+    assert cid in ids("KAMAU")      # case-insensitive
+    assert cid in ids("45987")      # phone substring
+    assert cid in ids("wa")         # short query falls back to LIKE
+    client.patch(f"/customers/{cid}", json={"name": "Achieng Otieno"})
+    assert cid not in ids("anjik")
+    assert cid in ids("tieno")
+    client.delete(f"/customers/{cid}")
+    assert cid not in ids("tieno")
+
+
+def test_product_search_substring_barcode_and_sync(client: TestClient):
+    """Product search matches name substrings or the exact barcode and follows renames."""
+    created = client.post("/products", json={"name": "Kimbo Cooking Fat 1kg", "barcode": "FTS-600123", "price_sell": 320}).json()
+    pid = created["id"]
+
+    def ids(q):
+        return {p["id"] for p in client.get("/products", params={"q": q}).json()}
+
+    assert pid in ids("ooking f")   # trigram path
+    assert pid in ids("KIMBO")      # case-insensitive
+    assert pid in ids("FTS-600123")  # exact barcode
+    assert pid not in ids("600123")  # barcodes are not substring-matched
+    assert pid in ids("1k")         # short query falls back to LIKE
+    client.patch(f"/products/{pid}", json={"name": "Elianto Oil 1L"})
+    assert pid not in ids("kimbo")
+    assert pid in ids("lianto")
+    client.delete(f"/products/{pid}")
+    assert pid not in ids("lianto")
+
+
+def test_inventory_csv_quotes_awkward_names(client: TestClient):
+    """Inventory CSV rows survive names containing commas and quotes."""
+    created = client.post("/products", json={"name": 'Soda 2L, "Family"', "barcode": "CSV-0042", "price_sell": 210}).json()
+    resp = client.get("/reports/inventory/export/csv")
+    assert resp.status_code == 200
+    rows = {row[0]: row for row in csv.reader(io.StringIO(resp.text))}
+    assert rows[str(created["id"])][1:3] == ['Soda 2L, "Family"', "CSV-0042"]
+    client.delete(f"/products/{created['id']}")
+
+
+def test_staff_list_cache_follows_staff_changes(client: TestClient):
+    """The cached report staff dropdown picks up activated and deactivated staff at once."""
+    def names():
+        return {s["username"] for s in client.get("/reports/staff-list").json()}
+
+    with Session(engine) as session:  # direct insert: other tests may have hit the staff limit
+        staff = Staff(username="dropdown_clerk", password_hash="x", role="cashier", is_active=False)
+        session.add(staff)
+        session.commit()
+        staff_id = staff.id
+
+    assert "dropdown_clerk" not in names()  # warms the cache
+    client.put(f"/staff/{staff_id}", json={"is_active": True})
+    assert "dropdown_clerk" in names()
+    client.put(f"/staff/{staff_id}", json={"is_active": False})
+    assert "dropdown_clerk" not in names()
+
+
+def test_customer_balance_writes_bump_version(client: TestClient):
+    """Every balance change is an in-SQL delta that also bumps version."""
+    from app.models import Customer
+
+    cid = client.post("/customers", json={"name": "OCC Debtor", "debt_limit": 1000.0}).json()["id"]
+    assert client.patch(f"/customers/{cid}", json={"current_balance": 500.0}).status_code == 200
+    resp = client.post(f"/customers/{cid}/payment", json={"amount": 200.0})
+    assert resp.json()["new_balance"] == 300.0
+    with Session(engine) as session:
+        p = Product(name="Credit Item", barcode="CRED-001", price_buying=20.0, price_selling=50.0, stock_quantity=5)
+        session.add(p)
+        session.commit()
+        product_id = p.id
+    sale = client.post("/transactions", json={
+        "staff_id": 1,
+        "customer_id": cid,
+        "payment_type": "CREDIT",
+        "total_amount": 50.0,
+        "items": [{"product_id": product_id, "quantity": 1, "price_at_moment": 50.0}],
+    })
+    assert sale.status_code == 201, sale.text
+    with Session(engine) as session:
+        customer = session.get(Customer, cid)
+        assert (customer.current_balance, customer.version) == (350.0, 3)
+
+
+@pytest.mark.asyncio
+async def test_mpesa_token_fetched_once_until_expiry(monkeypatch):
+    """Concurrent callers share one OAuth fetch; the token is reused until near expiry."""
+    import asyncio
+    import httpx
+    from app import mpesa_utils
+
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"access_token": "tok", "expires_in": "3599"})
+
+    client = httpx.AsyncClient(base_url="https://daraja.test", transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(mpesa_utils, "_client", client)
+    monkeypatch.setattr(mpesa_utils, "_token_lock", None)
+    monkeypatch.setattr(mpesa_utils, "_cfg", lambda primary, *fb, default="": "x")
+    mpesa_utils.invalidate_token_cache()
+    try:
+        tokens = await asyncio.gather(*(mpesa_utils.get_access_token() for _ in range(5)))
+        assert tokens == ["tok"] * 5
+        assert await mpesa_utils.get_access_token() == "tok"
+        assert calls == ["/oauth/v1/generate"]
+    finally:
+        mpesa_utils.invalidate_token_cache()
+        await client.aclose()
+
+
+def test_customer_list_keyset_pages(client: TestClient):
+    """list_customers pages by id with limit/after_id, never repeats a row, and is unpaged by default."""
+    for i in range(5):
+        client.post("/customers", json={"name": f"Pager {i}"})
+    first = client.get("/customers", params={"q": "pager", "limit": 3}).json()
+    assert len(first) == 3
+    rest = client.get("/customers", params={"q": "pager", "limit": 3, "after_id": first[-1]["id"]}).json()
+    ids = [c["id"] for c in first + rest]
+    assert len(ids) == 5 and ids == sorted(set(ids))
+    assert client.get("/customers", params={"limit": 500}).status_code == 422
+    # No paging parameters: the admin screen still gets every customer
+    for i in range(55):
+        client.post("/customers", json={"name": f"Unpaged {i}"})
+    assert len(client.get("/customers", params={"q": "unpaged"}).json()) == 55
+
+
+def test_preencoded_escpos_constants_match_library():
+    """The raw formatting bytes in printer_service equal what python-escpos emits."""
+    from escpos.printer import Dummy
+    from app import printer_service as ps
+
+    def emitted(**kw):
+        d = Dummy()
+        d.set(**kw)
+        return d.output
+
+    assert ps._CENTER_BOLD == emitted(align="center", bold=True)
+    assert ps._BOLD_OFF == emitted(bold=False)
+    assert ps._ALIGN_LEFT == emitted(align="left")
+    assert ps._ALIGN_RIGHT == emitted(align="right")
+    assert ps._ALIGN_CENTER == emitted(align="center")
+
+
+def test_printer_executor_created_once_under_race(monkeypatch):
+    """Concurrent first jobs share one printer worker, keeping jobs strictly FIFO."""
+    import threading
+    from app import printer_service
+
+    monkeypatch.setattr(printer_service, "_executor", None)
+    start = threading.Barrier(8)
+    seen = []
+
+    def first_job():
+        start.wait()
+        seen.append(printer_service._get_executor())
+
+    threads = [threading.Thread(target=first_job) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len({id(e) for e in seen}) == 1
+    seen[0].shutdown(wait=False)
+
+
+def test_print_jobs_report_status_by_id(client: TestClient):
+    """Print and kick responses carry a job id whose outcome can be polled."""
+    resp = client.post("/print/receipt", json={"items": [{"name": "Job", "quantity": 1, "price": 10.0}], "total_gross": 10.0})
+    body = resp.json()
+    assert body["ok"] is True
+    assert client.get(f"/print/status/{body['job_id']}").json() == {"job_id": body["job_id"], "status": "done"}
+    kick = client.post("/hardware/kick-drawer").json()
+    assert client.get(f"/print/status/{kick['job_id']}").json()["status"] == "done"
+    assert client.get("/print/status/nope").status_code == 404
+
+
+def test_dashboard_summary_cached_but_fresh_after_sale(client: TestClient):
+    """Summary is served from cache between polls, yet a committed sale shows up at once."""
+    with Session(engine) as session:
+        p = Product(name="Dash Item", barcode="DASH-001", price_buying=60.0, price_selling=100.0, stock_quantity=10)
+        session.add(p)
+        session.commit()
+        session.refresh(p)
+        product_id = p.id
+
+    before = client.get("/dashboard/summary").json()
+    assert client.get("/dashboard/summary").json() == before
+    resp = client.post("/transactions", json={
+        "staff_id": 1,
+        "payment_type": "MOBILE",
+        "total_amount": 200.0,
+        "items": [{"product_id": product_id, "quantity": 2, "price_at_moment": 100.0}],
+    })
+    assert resp.status_code == 201
+    after = client.get("/dashboard/summary").json()
+    assert after["transaction_count"] == before["transaction_count"] + 1
+    assert after["total_mobile"] == pytest.approx(before["total_mobile"] + 200.0)
+    assert after["net_profit"] == pytest.approx(before["net_profit"] + 80.0)
+
+
+def test_receipt_item_listings_carry_product_names(client: TestClient):
+    """Eager-loaded SaleItem.product names appear in history and item listings."""
+    with Session(engine) as session:
+        p = Product(name="History Item", barcode="HIST-001", price_buying=5.0, price_selling=10.0, stock_quantity=10)
+        session.add(p)
+        session.commit()
+        product_id = p.id
+
+    resp = client.post("/transactions", json={
+        "staff_id": 1,
+        "payment_type": "CASH",
+        "total_amount": 30.0,
+        "items": [{"product_id": product_id, "quantity": 3, "price_at_moment": 10.0}],
+    })
+    assert resp.status_code == 201
+    rid = resp.json()["id"]
+    assert [i["name"] for i in client.get(f"/transactions/{rid}/items").json()] == ["History Item"]
+    listed = next(r for r in client.get("/transactions", params={"limit": 500}).json() if r["id"] == rid)
+    assert [i["name"] for i in listed["items"]] == ["History Item"]
+
+
+def test_sales_report_caches_past_ranges_only():
+    """Closed date ranges are computed once; ranges reaching today are always fresh."""
+    from datetime import datetime, timedelta, timezone
+    from app.routers import reports
+
+    past = (datetime.now(timezone.utc) - timedelta(days=400)).strftime("%Y-%m-%d")
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    assert reports.get_sales_report(start_date=past, end_date=past) is reports.get_sales_report(start_date=past, end_date=past)
+    assert reports.get_sales_report(start_date=past, end_date=today) is not reports.get_sales_report(start_date=past, end_date=today)
+
+
+def test_verify_payment_reuses_completed_result(client: TestClient, monkeypatch):
+    """Once Daraja reports success, repeat polls for that checkout skip the STK query."""
+    from app.routers import payments
+
+    calls = []
+
+    async def fake_query(checkout_id):
+        calls.append(checkout_id)
+        return {"ResultCode": "0" if len(calls) > 1 else "1032", "ResultDesc": "ok"}
+
+    monkeypatch.setattr(payments, "query_transaction_status", fake_query)
+    assert client.get("/payments/verify/ws_CO_cache_1").json()["success"] is False
+    first = client.get("/payments/verify/ws_CO_cache_1").json()
+    assert first["success"] is True
+    assert client.get("/payments/verify/ws_CO_cache_1").json() == first
+    assert len(calls) == 2
+
+
+def test_stk_callback_completes_receipt_in_background(client: TestClient):
+    """The STK webhook answers Success and the receipt update runs as a background task."""
+    from app.models import Receipt
+
+    with Session(engine) as session:
+        r = Receipt(receipt_id="STK-BG-1", staff_id=1, payment_type="MOBILE", total_amount=50.0,
+                    payment_status="PENDING", checkout_request_id="ws_CO_bg_1")
+        session.add(r)
+        session.commit()
+        rid = r.id
+
+    body = {"Body": {"stkCallback": {
+        "CheckoutRequestID": "ws_CO_bg_1", "ResultCode": 0,
+        "CallbackMetadata": {"Item": [{"Name": "MpesaReceiptNumber", "Value": "QBG123"}]},
+    }}}
+    resp = client.post("/mpesa/callback", json=body)
+    assert resp.json() == {"ResultCode": 0, "ResultDesc": "Success"}
+    with Session(engine) as session:
+        done = session.get(Receipt, rid)
+        assert done.payment_status == "COMPLETED" and done.mpesa_code == "QBG123"
+
+
+def test_stk_callback_write_is_retried(client: TestClient, monkeypatch):
+    """A transient DB failure in the background STK write is retried, not dropped."""
+    from app.models import Receipt
+    from app.routers import mpesa
+
+    with Session(engine) as session:
+        r = Receipt(receipt_id="STK-RETRY-1", staff_id=1, payment_type="MOBILE", total_amount=60.0,
+                    payment_status="PENDING", checkout_request_id="ws_CO_retry_1")
+        session.add(r)
+        session.commit()
+        rid = r.id
+
+    real_complete = mpesa._complete_stk_receipt
+    failures = iter([True, True])
+
+    def flaky(checkout_id, receipt_code):
+        if next(failures, False):
+            raise RuntimeError("database is locked")
+        return real_complete(checkout_id, receipt_code)
+
+    monkeypatch.setattr(mpesa, "_complete_stk_receipt", flaky)
+    monkeypatch.setattr(mpesa, "_STK_RETRY_DELAY", 0.0)
+    body = {"Body": {"stkCallback": {
+        "CheckoutRequestID": "ws_CO_retry_1", "ResultCode": 0,
+        "CallbackMetadata": {"Item": [{"Name": "MpesaReceiptNumber", "Value": "QRT123"}]},
+    }}}
+    assert client.post("/mpesa/callback", json=body).json()["ResultDesc"] == "Success"
+    with Session(engine) as session:
+        assert session.get(Receipt, rid).payment_status == "COMPLETED"
+
+
+def test_each_route_registered_once():
+    """No router is mounted twice: every (method, path) pair maps to exactly one endpoint."""
+    from collections import Counter
+    from main import app
+
+    seen = Counter(
+        (method, route.path)
+        for route in app.routes
+        for method in (getattr(route, "methods", None) or {"WEBSOCKET"})
+    )
+    assert [key for key, n in seen.items() if n > 1] == []
+    assert seen[("GET", "/dashboard/summary")] == 1
+
+
+@pytest.mark.asyncio
+async def test_broadcast_encodes_once_and_drops_dead_sockets():
+    """Every client gets the same pre-encoded text frame; failing sockets are disconnected."""
+    import json
+    from app.websocket_manager import ConnectionManager, create_event
+
+    class FakeSocket:
+        def __init__(self, fail=False):
+            self.sent, self.fail = [], fail
+
+        async def send_text(self, text):
+            if self.fail:
+                raise RuntimeError("closed")
+            self.sent.append(text)
+
+    mgr = ConnectionManager()
+    good, other, dead = FakeSocket(), FakeSocket(), FakeSocket(fail=True)
+    mgr.active_connections.update({"a": good, "b": other, "c": dead})
+    event = create_event("test.event", {"amount": 10.5, "name": "Ünïcode"})
+
+    assert await mgr.broadcast(event, exclude="b") == 1
+    assert json.loads(good.sent[0]) == event
+    assert other.sent == []
+    assert mgr.get_connected_clients() == ["a", "b"]
+
+
+def test_parse_stk_callback_single_pass():
+    """_parse_stk_callback pulls all three fields and tolerates malformed bodies."""
+    from app.routers.mpesa import _parse_stk_callback
+
+    body = {"Body": {"stkCallback": {
+        "ResultCode": "1032", "CheckoutRequestID": " ws_CO_1 ",
+        "CallbackMetadata": {"Item": [{"Name": "Amount", "Value": 5}, {"Name": "MpesaReceiptNumber", "Value": "QX1"}]},
+    }}}
+    assert _parse_stk_callback(body) == (1032, "ws_CO_1", "QX1")
+    assert _parse_stk_callback({"Body": {"stkCallback": {"ResultCode": "x"}}}) == (None, None, None)
+    assert _parse_stk_callback([1, 2]) == (None, None, None)
+
+
+def test_c2b_retry_does_not_match_a_second_receipt(client: TestClient):
+    """A re-sent C2B confirmation (same TransID) is acknowledged but not applied again."""
+    from app.models import Receipt
+
+    with Session(engine) as session:
+        for i in range(2):
+            session.add(Receipt(receipt_id=f"C2B-DUP-{i}", staff_id=1, payment_type="MOBILE",
+                                total_amount=777.0, payment_status="PENDING"))
+        session.commit()
+
+    body = {"TransID": "QDUP777", "TransAmount": "777.00", "MSISDN": "254700000000"}
+    for _ in range(2):
+        assert client.post("/mpesa/c2b-confirmation", json=body).json()["ResultCode"] == 0
+    with Session(engine) as session:
+        statuses = session.exec(
+            select(Receipt.payment_status).where(Receipt.receipt_id.startswith("C2B-DUP-"))
+        ).all()
+    assert sorted(statuses) == ["COMPLETED", "PENDING"]
+
+
+def test_c2b_retry_applies_after_failed_match(client: TestClient, monkeypatch):
+    """If matching a C2B confirmation fails, Daraja's retry of the same TransID is applied."""
+    from app.models import Receipt
+    from app.routers import mpesa
+
+    with Session(engine) as session:
+        session.add(Receipt(receipt_id="C2B-RETRY-0", staff_id=1, payment_type="MOBILE",
+                            total_amount=778.0, payment_status="PENDING"))
+        session.commit()
+
+    def locked(*args):
+        raise RuntimeError("database is locked")
+
+    body = {"TransID": "QRETRY778", "TransAmount": "778.00", "MSISDN": "254700000000"}
+    real_match = mpesa._match_c2b_payment
+    monkeypatch.setattr(mpesa, "_match_c2b_payment", locked)
+    with pytest.raises(RuntimeError):
+        client.post("/mpesa/c2b-confirmation", json=body)
+    monkeypatch.setattr(mpesa, "_match_c2b_payment", real_match)
+    assert client.post("/mpesa/c2b-confirmation", json=body).json()["ResultCode"] == 0
+    with Session(engine) as session:
+        status = session.exec(select(Receipt.payment_status).where(Receipt.receipt_id == "C2B-RETRY-0")).one()
+    assert status == "COMPLETED"
+
+
+def test_failed_database_init_is_reported(client: TestClient):
+    """A startup schema failure shows up as 500 "failed" instead of an endless 503 "starting"."""
+    from app.database import schema_failed, schema_ready
+
+    schema_ready.clear()
+    schema_failed.set()
+    try:
+        health = client.get("/health")
+        assert health.status_code == 500 and health.json() == {"status": "failed"}
+        assert client.get("/products").status_code == 500
+    finally:
+        schema_failed.clear()
+        schema_ready.set()
+    assert client.get("/health").json() == {"status": "ok"}
+
+
+def test_legacy_transactions_migrate_into_old_receipt_table(tmp_path, monkeypatch):
+    """A DB with the legacy transaction table and a receipt table predating the newer columns still starts."""
+    from sqlalchemy import MetaData, Table, create_engine, text
+    from app import database
+    from app.models import Receipt
+
+    old_engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    old_receipt = MetaData()
+    Table("receipt", old_receipt, *(
+        c.copy() for c in Receipt.__table__.columns
+        if c.name not in {"business_name", "discount_amount", "bank_confirmed"}
+    ))
+    old_receipt.create_all(old_engine)
+    with old_engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE "transaction" (id INTEGER PRIMARY KEY, timestamp DATETIME, shift_id INTEGER, '
+            "cashier_id INTEGER, customer_id INTEGER, total_amount FLOAT, payment_method TEXT, "
+            "is_return BOOLEAN, payment_status TEXT)"
+        ))
+        conn.execute(text(
+            "INSERT INTO \"transaction\" VALUES (1, '2024-01-02 10:00:00', NULL, 1, NULL, 250.0, 'cash', 0, 'COMPLETED')"
+        ))
+    monkeypatch.setattr(database, "engine", old_engine)
+    database.create_db_and_tables()
+
+    with old_engine.connect() as conn:
+        row = conn.execute(text(
+            "SELECT receipt_id, payment_type, business_name, discount_amount, bank_confirmed FROM receipt WHERE id = 1"
+        )).one()
+    old_engine.dispose()
+    assert tuple(row) == ("MIG-1", "CASH", "DukaPOS", 0, 0)
@@ -61,6 +61,8 @@ def wipe_database():
         # Reset invoice sequence
         print("Resetting invoice sequence...")
         cursor.execute("UPDATE invoicesequence SET last_number = 0;")
+        cursor.execute("DELETE FROM receiptseq;")
+        cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'receiptseq';")
         
         # Re-enable foreign keys
         cursor.execute("PRAGMA foreign_keys = ON;")